@@ -0,0 +1,367 @@
+"""
+Asyncio chat room client
+Speaks the same protocol as client.py, but from a single event loop, so it can also be used as a library
+to run many clients (e.g. bots) in one process:
+
+async with AsyncChatClient(HOST, PORT, "bot") as client:
+    await client.send("Hello")
+    async for message in client:
+        print(message.sender, message.text)
+
+Run as a script it is an interactive client like client.py, the server is read by the event loop and the keyboard
+by a small thread handing typed lines to the loop
+"""
+import asyncio
+import itertools
+import os
+import sys
+import threading
+from dataclasses import dataclass
+from typing import AsyncIterator
+
+from async_node import AsyncNetworkNode
+from client import HOST, PORT, parse_command
+from file_transfer import FileDownloads
+from comms_protocol import MessageType, WRONG_PASSWORD_ERROR, CONN_ERROR, INVALID_MSG_LEN_ERROR, \
+    LATEST_PROTOCOL_VERSION, MSG_TOO_LONG_ERROR, ZLIB_CAPABILITY, PASSWORD_REQUIRED, INVALID_NAME_ERROR, \
+    MAX_NAME_LENGTH, PROTOCOL_REPLY_TIMEOUT, PROTOCOL_V1, V1_PASSWORD_ACCOUNT, parse_protocol_message
+
+# Most bytes handed from the keyboard thread to the event loop at once
+STDIN_READ_SIZE = 4096
+
+
+@dataclass
+class ChatMessage:
+    """A packet received from the server
+    sender is the username of the sender for chat messages (MESSAGE) and files (FILE), None for everything else
+    data is the body of FILE_CHUNK packets, which is not text, see file_transfer.FileDownloads
+    """
+
+    message_type: str
+    text: str
+    sender: str | None = None
+    data: bytes = b""
+
+
+class AsyncChatClient:
+    """Connection of a single user to the chat room server
+
+    Iterating over the client gives the received messages until the connection is closed,
+    the NAME packet in front of every chat message is joined with it into a single ChatMessage
+    and PING packets are answered without being given out
+
+    Methods
+    -------
+    connect()
+        Connects, agrees on a protocol version and enters the chat
+    send(message), join(room), leave(), list_rooms()
+        Send a chat message or room command, waiting only if the connection can not keep up
+    send_file(path)
+        Sends a file to the room, see file_transfer.py
+    close()
+        Closes the connection
+    """
+
+    def __init__(self, host: str, port: int, username: str, password: str | None = None, compression: bool = True):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.compression = compression
+        self.client_node: AsyncNetworkNode | None = None
+        # Chat packet received while entering the chat, given out first by the iterator
+        self._first_packet: tuple[str, bytes] | None = None
+        self._transfer_ids = itertools.count(1)
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def connect(self):
+        """Connects, agrees on a protocol version and enters the chat
+
+        Raises
+        ------
+        PermissionError - If the username is not valid, or has an account and password was not given or is wrong
+        """
+
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        self.client_node = AsyncNetworkNode(reader, writer)
+        try:
+            if not await self._negotiate_protocol():
+                # Servers older than protocol versions stop serving the connection, v1 is kept on a new one
+                await self.close()
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+                self.client_node = AsyncNetworkNode(reader, writer)
+            await self._authenticate()
+        except BaseException:
+            await self.close()
+            raise
+
+    async def _negotiate_protocol(self) -> bool:
+        """Returns False if the server did not reply within PROTOCOL_REPLY_TIMEOUT seconds"""
+        request = f"{LATEST_PROTOCOL_VERSION} {ZLIB_CAPABILITY}" if self.compression else str(LATEST_PROTOCOL_VERSION)
+        self.client_node.send_message(request, MessageType.PROTOCOL)
+        try:
+            message_type, reply = await asyncio.wait_for(self.client_node.recv_message(), PROTOCOL_REPLY_TIMEOUT)
+        except TimeoutError:
+            return False
+        # Servers replying with anything else, e.g. a wrong packet INFO message, keep v1
+        if message_type == MessageType.PROTOCOL.value:
+            protocol_version, capabilities = parse_protocol_message(reply)
+            self.client_node.set_protocol_version(protocol_version)
+            self.client_node.set_compression(ZLIB_CAPABILITY in capabilities)
+        return True
+
+    async def _authenticate(self):
+        self.client_node.send_message(self.username, MessageType.NAME)
+        if self.client_node.protocol_version == PROTOCOL_V1:
+            # Servers older than protocol versions never ask for the password, it is sent right after the name
+            if self.username != V1_PASSWORD_ACCOUNT:
+                return
+            if self.password is None:
+                raise PermissionError(PASSWORD_REQUIRED)
+            self.client_node.send_message(self.password, MessageType.PASSWORD)
+            _, response = await self.client_node.recv_message()
+            if response == WRONG_PASSWORD_ERROR:
+                raise PermissionError(WRONG_PASSWORD_ERROR)
+            return
+
+        # Server asks for the password of usernames with an account, every other username is let in right away
+        message_type, message_body = await self.client_node.recv_frame()
+        if message_type == MessageType.INFO.value and message_body.decode().strip() == INVALID_NAME_ERROR:
+            raise PermissionError(INVALID_NAME_ERROR)
+        if message_type != MessageType.INFO.value or message_body.decode().strip() != PASSWORD_REQUIRED:
+            self._first_packet = message_type, message_body
+            return
+
+        if self.password is None:
+            raise PermissionError(PASSWORD_REQUIRED)
+        self.client_node.send_message(self.password, MessageType.PASSWORD)
+        _, response = await self.client_node.recv_message()
+        if response == WRONG_PASSWORD_ERROR:
+            raise PermissionError(WRONG_PASSWORD_ERROR)
+
+    async def send(self, message: str, message_type: MessageType = MessageType.MESSAGE):
+        """Raises ValueError if the message is too long for the protocol version"""
+        self.client_node.send_message(message, message_type)
+        await self.client_node.drain()
+
+    async def join(self, room: str):
+        await self.send(room, MessageType.JOIN)
+
+    async def leave(self):
+        await self.send("", MessageType.LEAVE)
+
+    async def list_rooms(self):
+        """The room list is received as a ROOMS message"""
+        await self.send("", MessageType.ROOMS)
+
+    async def send_file(self, path: str):
+        """Raises OSError if the file can not be read, ValueError if the server does not use protocol v2"""
+        with open(path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            transfer_id = next(self._transfer_ids)
+            await self.send(f"{transfer_id} {size} {os.path.basename(path)}", MessageType.FILE)
+            await self.client_node.send_file(file, transfer_id, size)
+
+    async def close(self):
+        if self.client_node is not None:
+            await self.client_node.close()
+
+    def __aiter__(self) -> AsyncIterator[ChatMessage]:
+        return self.messages()
+
+    async def messages(self) -> AsyncIterator[ChatMessage]:
+        """Received messages until the connection is closed
+
+        Raises
+        ------
+        ValueError - On invalid msg length
+        """
+
+        # Username of the sender of the chat message which follows
+        sender_name: str | None = None
+        first_packet, self._first_packet = self._first_packet, None
+
+        while True:
+            if first_packet is not None:
+                (message_type, message_body), first_packet = first_packet, None
+            else:
+                try:
+                    message_type, message_body = await self.client_node.recv_frame()
+                except ConnectionError:
+                    return
+            if message_type == MessageType.FILE_CHUNK.value:
+                yield ChatMessage(message_type, "", data=message_body)
+                continue
+
+            message = message_body.decode().strip()
+            match message_type:
+                case MessageType.NAME.value:
+                    sender_name = message
+                case MessageType.MESSAGE.value | MessageType.FILE.value:
+                    yield ChatMessage(message_type, message, sender_name)
+                    sender_name = None
+                case MessageType.PING.value:
+                    # Server checking if the client is still there
+                    self.client_node.send_message("", MessageType.PONG)
+                case MessageType.PONG.value:
+                    pass
+                case _:
+                    yield ChatMessage(message_type, message)
+
+
+def format_message(message: ChatMessage) -> str:
+    """Text printed for a received message, same as client.py"""
+    match message.message_type:
+        case MessageType.MESSAGE.value:
+            return f"{message.sender}: {message.text}"
+        case MessageType.ROOMS.value:
+            return f"Rooms: {message.text}"
+        case MessageType.THROTTLED.value:
+            return f"Slow down, messages are being dropped, wait {message.text} seconds"
+        case MessageType.INFO.value:
+            return message.text
+    return f"Received invalid message type: {message.message_type}"
+
+
+async def open_stdin() -> asyncio.StreamReader:
+    """Wraps stdin in a StreamReader, so typed lines are awaited like the socket
+    Event loops can not watch a Windows console, so a daemon thread reads the input and feeds it to the loop
+    The unbuffered stream is read, a thread blocked on the buffered one would abort the interpreter at exit
+    """
+
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+
+    def read_stdin():
+        try:
+            while data := sys.stdin.buffer.raw.read(STDIN_READ_SIZE):
+                loop.call_soon_threadsafe(reader.feed_data, data)
+            loop.call_soon_threadsafe(reader.feed_eof)
+        except RuntimeError:
+            # The loop was closed, the client has already quit
+            pass
+
+    threading.Thread(target=read_stdin, daemon=True).start()
+    return reader
+
+
+async def read_line(stdin: asyncio.StreamReader, prompt: str) -> str:
+    print(prompt, end="", flush=True)
+    return (await stdin.readline()).decode().rstrip("\r\n")
+
+
+async def print_messages(client: AsyncChatClient):
+    """Prints received messages, and saves received files in the downloads directory"""
+    downloads = FileDownloads()
+    try:
+        async for message in client:
+            match message.message_type:
+                case MessageType.FILE.value:
+                    try:
+                        download = downloads.start(message.text, message.sender)
+                    except ValueError as e:
+                        # Only this file is skipped, the connection is fine
+                        print(e)
+                        continue
+                    print(f"{message.sender} is sending a file, saving it to {download.path}")
+                case MessageType.FILE_CHUNK.value:
+                    try:
+                        download = downloads.write_chunk(message.data)
+                    except ValueError as e:
+                        print(e)
+                        continue
+                    if download is not None and download.remaining:
+                        print(f"{download.sender_name} left before sending the whole file, removed {download.path}")
+                    elif download is not None:
+                        print(f"Received file {download.path}")
+                case _:
+                    print(format_message(message))
+    except ValueError:
+        print(INVALID_MSG_LEN_ERROR)
+    finally:
+        downloads.close()
+
+
+async def send_file(client: AsyncChatClient, path: str):
+    """Sends the file at path, messages typed meanwhile are sent once the whole file is"""
+    if not os.path.isfile(path) or not os.path.getsize(path):
+        print(f"Cannot send {path}, it is not a file or it is empty")
+        return
+    print(f"Sending {path}")
+    try:
+        await client.send_file(path)
+    except ValueError as e:
+        print(e)
+        return
+    print(f"Sent {path}")
+
+
+async def run_client(host: str = HOST, port: int = PORT):
+    """Interactive client, takes the username and password from the command line like client.py"""
+    stdin = await open_stdin()
+    username = sys.argv[1] if len(sys.argv) > 1 else await read_line(stdin, "Enter your username - ")
+    password = sys.argv[2] if len(sys.argv) > 2 else None
+
+    # Reconnect until the server lets the user in
+    while True:
+        client = AsyncChatClient(host, port, username, password)
+        try:
+            await client.connect()
+            break
+        # PermissionError is an OSError too, so it is caught first
+        except PermissionError as e:
+            if e.args[0] == INVALID_NAME_ERROR:
+                print(f"Usernames are 1 to {MAX_NAME_LENGTH} printable characters")
+                username = await read_line(stdin, "Enter your username - ")
+                continue
+            if e.args[0] == WRONG_PASSWORD_ERROR:
+                print("Wrong password")
+                username = await read_line(stdin, "Enter your username - ")
+            password = await read_line(stdin, "Enter your password - ")
+        except OSError:
+            print("Cannot connect to server")
+            print("Maybe the server is offline, or you are not connected to the internet")
+            return
+
+    receiver = asyncio.create_task(print_messages(client))
+    try:
+        # Typed lines are sent until quit, end of input or the server closing the connection
+        while not receiver.done():
+            line_reader = asyncio.ensure_future(stdin.readline())
+            await asyncio.wait((line_reader, receiver), return_when=asyncio.FIRST_COMPLETED)
+            if not line_reader.done():
+                line_reader.cancel()
+                print(CONN_ERROR)
+                break
+            message = line_reader.result().decode().rstrip("\r\n")
+            if not line_reader.result() or message == "quit":
+                break
+            try:
+                if message.startswith("/send "):
+                    await send_file(client, message.removeprefix("/send ").strip())
+                else:
+                    await client.send(*parse_command(message))
+            except ValueError:
+                print(MSG_TOO_LONG_ERROR)
+            except ConnectionError:
+                print(CONN_ERROR)
+                break
+    finally:
+        await client.close()
+        await receiver
+
+
+if __name__ == "__main__":
+    print("GWA's Chatroom")
+    print("Type 'quit' to quit the program")
+    print("Type and press enter to send message")
+    print("Type '/join <room>' to join a room, '/leave' to go back to the lobby, '/rooms' to list rooms")
+    print("Type '/send <path>' to send a file to the room")
+    print()
+    asyncio.run(run_client())
@@ -0,0 +1,135 @@
+"""
+Asyncio counterpart of node.py
+AsyncNetworkNode speaks the exact same protocol as NetworkNode, see node.py,
+but works on an asyncio StreamReader and StreamWriter pair instead of a blocking socket
+"""
+import asyncio
+from time import monotonic
+from typing import BinaryIO
+
+from node import NetworkNode
+from frame_buffer import FrameBuffer, CHUNK_SIZE
+from outbound_queue import SLOW_CONSUMER_ERROR
+from metrics import frames_received, bytes_received, packets_sent, bytes_sent
+from comms_protocol import MessageType, CONN_ERROR, PROTOCOL_V1, PROTOCOL_V2, FILE_CHUNK_SIZE, FILE_V1_ERROR, \
+    file_chunk_header
+
+
+class AsyncNetworkNode:
+    """A class for handling the sending and receiving of data over asyncio streams
+    All methods execpt property peer_address raise socket.error if any connection error occurs
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 max_write_buffer: int = 4 * 1024 * 1024):
+        self.reader = reader
+        self.writer = writer
+        # Remote address is cached as the transport forgets it once the connection is closed
+        self.address = self.peer_address
+        # Set when the node is added to a ClientRegistry, see client_registry.py
+        self.connection_id: int | None = None
+        self.frame_buffer = FrameBuffer()
+        # Version of the protocol used for both sending and receiving, see set_protocol_version
+        self.protocol_version = PROTOCOL_V1
+        # Compress large message bodies sent with protocol v2, see NetworkNode.set_compression
+        self.compression = False
+        # Time (monotonic) data was last received, see NetworkNode.last_received
+        self.last_received = monotonic()
+        # Max number of bytes waiting in the transport before the client is dropped as a slow consumer
+        self.max_write_buffer = max_write_buffer
+
+    @property
+    def peer_address(self):
+        # Get remote/receiver address, None if the transport is already closed
+        return self.writer.get_extra_info("peername")
+
+    async def recv_message(self) -> tuple[str, str]:
+        """Receives complete message packets, returns message type and message body
+        Packets are parsed by a FrameBuffer just like NetworkNode.recv_message
+
+        Raises
+        ------
+        ValueError - On invalid msg length
+        """
+
+        message_type, message_body = await self.recv_frame()
+        return message_type, message_body.decode().strip()
+
+    async def recv_frame(self) -> tuple[str, bytes]:
+        """Receives a complete message packet like recv_message, but returns the message body as bytes"""
+        frame = self.frame_buffer.next_frame()  # May raise ValueError
+        while frame is None:
+            data = await self.reader.read(CHUNK_SIZE)
+            # Empty read means the peer closed the connection
+            if not data:
+                raise ConnectionResetError(CONN_ERROR)
+            bytes_received.inc(len(data))
+            self.last_received = monotonic()
+            self.frame_buffer.feed(data)
+            frame = self.frame_buffer.next_frame()
+
+        frames_received.inc()
+        return frame
+
+    def send_packet(self, message_packet: bytes):
+        """Queues an encoded message packet on the transport without waiting for it to be written
+        The transport buffer is the outbound queue of the client, a client letting it grow over
+        max_write_buffer bytes is disconnected
+        """
+
+        if self.writer.is_closing():
+            raise ConnectionResetError(CONN_ERROR)
+        if self.writer.transport.get_write_buffer_size() > self.max_write_buffer:
+            self.writer.transport.abort()
+            raise ConnectionAbortedError(SLOW_CONSUMER_ERROR)
+        packets_sent.inc()
+        bytes_sent.inc(len(message_packet))
+        self.writer.write(message_packet)
+
+    def send_message(self, message_body: str, message_type: MessageType):
+        """Adds header to message and queues it on the transport, see NetworkNode.send_message"""
+        self.send_packet(NetworkNode.encode_message(message_body, message_type.value, self.protocol_version,
+                                                    self.compression))
+
+    async def send_file(self, file: BinaryIO, transfer_id: int, size: int):
+        """Sends size bytes of file from its current position as the FILE_CHUNK packets of transfer_id
+        Waits for every chunk to be flushed before reading the next one, so a large file is never all in memory
+
+        Raises
+        ------
+        ValueError - If the node does not use protocol v2
+        """
+
+        if self.protocol_version != PROTOCOL_V2:
+            raise ValueError(FILE_V1_ERROR)
+        while size > 0:
+            data = file.read(min(FILE_CHUNK_SIZE, size))
+            if not data:
+                raise EOFError(f"File ended {size} bytes early")
+            self.send_packet(file_chunk_header(transfer_id, len(data)) + data)
+            await self.drain()
+            size -= len(data)
+
+    def set_protocol_version(self, protocol_version: int):
+        """Switches sending and receiving of the following packets to protocol_version"""
+        self.protocol_version = protocol_version
+        self.frame_buffer.protocol_version = protocol_version
+
+    def set_compression(self, enabled: bool):
+        """Turns compression of large message bodies on or off for the following v2 packets"""
+        self.compression = enabled
+
+    async def drain(self):
+        """Waits until the transport write buffer is flushed to the peer"""
+        await self.writer.drain()
+
+    def disconnect(self):
+        """Drops the connection, the task receiving from it gets a connection error and cleans up"""
+        self.writer.transport.abort()
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
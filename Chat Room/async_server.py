@@ -0,0 +1,105 @@
+"""
+Asyncio chat room server
+Speaks the same protocol as server.py, but serves every client from a single event loop
+instead of a thread per client, so idle clients only cost a socket and a small buffer
+Packets are handled by the same ClientSession as with server.py, see chat_service.py
+"""
+import asyncio
+from concurrent.futures import Future
+
+from async_node import AsyncNetworkNode
+from chat_service import ChatService, ClientSession, load_credentials, HOST, PORT, LOG_LEVEL, LOG_SAMPLE_RATES, \
+    STATS_HOST, STATS_PORT
+from server_logging import log_event, setup_logging
+from metrics import metrics, start_stats_server, connections
+
+# Max number of pending connections, large to survive bursts of clients connecting at once
+BACKLOG = 4096
+# Clients, rooms, history, chat log and accounts of this server
+# Its bus is only set when running as a worker of multi_server.py, and its chat log replaced by one per worker
+service = ChatService()
+
+
+async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    connections.inc()
+    client_node = AsyncNetworkNode(reader, writer)
+    log_event("connection", address=client_node.address)
+    service.clients.add(client_node)
+
+    try:
+        await serve_client(ClientSession(service, client_node))
+    finally:
+        service.clients.remove(client_node)
+        service.rooms.remove(client_node)
+        await client_node.close()
+
+
+async def serve_client(session: ClientSession):
+    """Receives packets from the client until it leaves or is disconnected, see server.serve_client"""
+    client_node = session.client_node
+    while not session.closed:
+        try:
+            message_type, message_body = await client_node.recv_frame()
+            wait = session.receive(message_type, message_body)
+            # Hashing runs on the credential threads, the event loop keeps serving other clients meanwhile
+            if isinstance(wait, Future):
+                session.password_checked(await asyncio.wrap_future(wait))
+            elif wait:
+                await asyncio.sleep(wait)
+        except OSError as e:
+            session.disconnected(e)
+        except ValueError:
+            session.invalid_packet()
+
+
+async def serve(host: str = HOST, port: int = PORT, reuse_port: bool = False):
+    """Serves clients until cancelled
+    With reuse_port, other processes can listen on the same port and the kernel spreads connections between them
+    """
+
+    server = await asyncio.start_server(handle_client, host, port, backlog=BACKLOG, reuse_port=reuse_port)
+    log_event("listening", host=host, port=port)
+    reaper_task = asyncio.create_task(service.reaper.run_async())
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        reaper_task.cancel()
+
+
+def write_buffer_sizes() -> list[int]:
+    return [c_node.writer.transport.get_write_buffer_size() for c_node in service.clients.snapshot()
+            if not c_node.writer.is_closing()]
+
+
+def start_stats(port: int = STATS_PORT):
+    """Registers the metrics of this server and serves all metrics over HTTP, see metrics.py
+    Metrics are read by the thread of the stats server, everything they read is safe to read from another thread
+    """
+
+    metrics.gauge("chat_connected_clients", "Connected clients", lambda: len(service.clients))
+    metrics.gauge("chat_rooms", "Rooms with at least one member", lambda: len(service.rooms.room_sizes()))
+    metrics.gauge("chat_queued_bytes", "Bytes waiting in the transports of all clients",
+                  lambda: sum(write_buffer_sizes()))
+    metrics.gauge("chat_max_queued_bytes", "Bytes waiting in the fullest transport",
+                  lambda: max(write_buffer_sizes(), default=0))
+    start_stats_server(STATS_HOST, port)
+
+
+def run_server(host: str = HOST, port: int = PORT):
+    """Runs the asyncio chat room server"""
+    log_listener = setup_logging(LOG_LEVEL, LOG_SAMPLE_RATES)
+    load_credentials(service.credentials, log_listener)
+    start_stats()
+    try:
+        asyncio.run(serve(host, port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Write out the messages still queued for the chat log, and the events still queued for logging
+        service.chat_log.close()
+        log_listener.stop()
+
+
+if __name__ == "__main__":
+    run_server()
@@ -0,0 +1,271 @@
+"""
+Load generator and latency benchmark for the chat room servers
+
+Starts a server in a subprocess on localhost, connects simulated clients speaking the NetworkNode protocol,
+makes some of them send chat messages at a fixed rate and measures how long every copy of a message
+takes to reach each receiving client (fan-out latency), along with the CPU time and memory used by the server
+
+Usage:
+python benchmark.py --server threaded --clients 200 --senders 10 --rate 20 --size 64 --duration 10
+python benchmark.py --server asyncio --clients 200 --senders 10 --rate 20 --size 64 --duration 10
+python benchmark.py --server multiprocess --clients 200 --senders 10 --rate 20 --size 64 --duration 10
+
+Servers write their chat log to a temporary directory, which is removed after the benchmark
+Servers limit every client to 50 messages per second (MESSAGE_RATE in chat_service.py), keep --rate below that
+Many clients need many file descriptors, raise the limit (ulimit -n) when going over a thousand clients
+"""
+import argparse
+import os
+import selectors
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+
+from node import NetworkNode
+from comms_protocol import MessageType, PROTOCOL_V1, ZLIB_CAPABILITY, parse_protocol_message
+
+# Modules with a run_server(host, port) function for every server which can be benchmarked
+SERVER_MODULES = {"threaded": "server", "asyncio": "async_server", "multiprocess": "multi_server"}
+# Modules holding the ChatService of every server, multi_server workers use the one of async_server
+SERVICE_MODULES = {"threaded": "server", "asyncio": "async_server", "multiprocess": "async_server"}
+BENCHMARK_HOST = "127.0.0.1"
+# Seconds given to receivers to get messages which are still in flight after the senders stop
+DRAIN_TIME = 1.0
+
+
+@dataclass
+class BenchmarkResult:
+    """Measurements of a single benchmark run"""
+    duration: float = 0.0
+    sent_messages: int = 0
+    received_messages: int = 0
+    latencies: list[float] = field(default_factory=list)
+    server_cpu_seconds: float | None = None
+    server_rss_bytes: int | None = None
+
+    def percentile(self, percent: float) -> float:
+        """Returns the latency (seconds) below which `percent` percent of the latencies fall"""
+        if not self.latencies:
+            return float("nan")
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * percent / 100))
+        return ordered[index]
+
+    def report(self):
+        print(f"Duration            : {self.duration:.2f} s")
+        print(f"Sent messages       : {self.sent_messages} ({self.sent_messages / self.duration:.0f} msg/s)")
+        print(f"Delivered messages  : {self.received_messages} ({self.received_messages / self.duration:.0f} msg/s)")
+        for percent in (50, 99, 99.9):
+            label = f"p{percent} latency"
+            print(f"{label:<20}: {self.percentile(percent) * 1000:.3f} ms")
+
+        if self.server_cpu_seconds is None:
+            print("Server CPU and RSS  : not available on this platform")
+            return
+        cpu_usage = self.server_cpu_seconds / self.duration * 100
+        print(f"Server CPU          : {self.server_cpu_seconds:.2f} s ({cpu_usage:.0f}% of a core)")
+        print(f"Server RSS          : {self.server_rss_bytes / 1024 / 1024:.1f} MiB")
+
+
+def read_process_stats(pid: int) -> tuple[float, int] | None:
+    """Returns CPU seconds (user + system) used by the process and its resident memory in bytes,
+    including its child processes (workers of the multiprocess server)
+    Returns None if /proc is not available (not Linux)
+    """
+
+    try:
+        with open(f"/proc/{pid}/stat") as stat_file:
+            # Fields after the command name, which is in parentheses and may contain spaces
+            stat_fields = stat_file.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/statm") as statm_file:
+            resident_pages = int(statm_file.read().split()[1])
+    except OSError:
+        return None
+
+    # utime and stime are fields 14 and 15 of /proc/pid/stat, i.e. 12 and 13 after the command name
+    cpu_seconds = (int(stat_fields[11]) + int(stat_fields[12])) / os.sysconf("SC_CLK_TCK")
+    rss_bytes = resident_pages * os.sysconf("SC_PAGE_SIZE")
+
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as children_file:
+            child_pids = [int(child_pid) for child_pid in children_file.read().split()]
+    except OSError:
+        child_pids = []
+    for child_pid in child_pids:
+        child_stats = read_process_stats(child_pid)
+        if child_stats is not None:
+            cpu_seconds += child_stats[0]
+            rss_bytes += child_stats[1]
+    return cpu_seconds, rss_bytes
+
+
+def start_server(server: str, port: int, chat_log_directory: str) -> subprocess.Popen:
+    """Starts the server in a subprocess and waits until it accepts connections
+    The server logs chat messages to chat_log_directory instead of its own chat log
+    """
+
+    module, service_module = SERVER_MODULES[server], SERVICE_MODULES[server]
+    command = (f"import chat_log, {service_module}, {module}; "
+               f"{service_module}.service.chat_log = chat_log.ChatLog({chat_log_directory!r}); "
+               f"{module}.run_server({BENCHMARK_HOST!r}, {port})")
+    process = subprocess.Popen([sys.executable, "-c", command], cwd=os.path.dirname(os.path.abspath(__file__)),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((BENCHMARK_HOST, port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"{server} server did not start listening on port {port}")
+
+
+def connect_client(port: int, username: str, protocol_version: int, room: str | None,
+                   compression: bool = False) -> NetworkNode:
+    """Connects a simulated client and enters the chat, joining room if given"""
+    connection = socket.create_connection((BENCHMARK_HOST, port))
+    client_node = NetworkNode(connection)
+    client_node.set_nodelay(True)
+
+    if protocol_version != PROTOCOL_V1:
+        request = f"{protocol_version} {ZLIB_CAPABILITY}" if compression else str(protocol_version)
+        client_node.send_message(request, MessageType.PROTOCOL)
+        message_type, reply = client_node.recv_message()
+        if message_type == MessageType.PROTOCOL.value:
+            version, capabilities = parse_protocol_message(reply)
+            client_node.set_protocol_version(version)
+            client_node.set_compression(ZLIB_CAPABILITY in capabilities)
+
+    client_node.send_message(username, MessageType.NAME)
+    if room is not None:
+        client_node.send_message(room, MessageType.JOIN)
+    return client_node
+
+
+class Receiver(threading.Thread):
+    """Single thread receiving for all simulated clients using a selector
+    Chat messages start with the perf_counter time they were sent at, which gives their latency
+    """
+
+    def __init__(self, client_nodes: list[NetworkNode], result: BenchmarkResult):
+        super().__init__(daemon=True)
+        self.result = result
+        self.running = True
+        self.recording = False
+        self.selector = selectors.DefaultSelector()
+        for client_node in client_nodes:
+            self.selector.register(client_node.connection, selectors.EVENT_READ, client_node)
+
+    def run(self):
+        while self.running:
+            for key, _ in self.selector.select(timeout=0.1):
+                client_node: NetworkNode = key.data
+                try:
+                    client_node.frame_buffer.recv_into(client_node.connection)
+                except OSError:
+                    self.selector.unregister(client_node.connection)
+                    continue
+
+                received_at = time.perf_counter()
+                for message_type, message_body in client_node.frame_buffer.frames():
+                    if message_type == MessageType.PING.value:
+                        # Long runs would otherwise get idle clients disconnected by the server
+                        client_node.send_message("", MessageType.PONG)
+                    if message_type != MessageType.MESSAGE.value or not self.recording:
+                        continue
+                    sent_at = float(message_body.split(b" ", 1)[0])
+                    self.result.latencies.append(received_at - sent_at)
+                    self.result.received_messages += 1
+
+
+def send_messages(senders: list[NetworkNode], rate: float, size: int, duration: float, result: BenchmarkResult):
+    """Sends messages from every sender at `rate` messages per second each, for `duration` seconds"""
+    padding = "x" * size
+    interval = 1 / (rate * len(senders))
+    start = time.perf_counter()
+    next_send = start
+    index = 0
+
+    while next_send - start < duration:
+        delay = next_send - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+        sender = senders[index % len(senders)]
+        sender.send_message(f"{time.perf_counter():.9f} {padding}", MessageType.MESSAGE)
+        result.sent_messages += 1
+        index += 1
+        next_send += interval
+
+
+def run_benchmark(server: str, port: int, clients: int, senders: int, rate: float, size: int, duration: float,
+                  protocol_version: int, rooms: int, compression: bool = False) -> BenchmarkResult:
+    result = BenchmarkResult()
+    chat_log_directory = tempfile.TemporaryDirectory(prefix="chat_log")
+    process = start_server(server, port, chat_log_directory.name)
+    client_nodes: list[NetworkNode] = []
+    try:
+        for index in range(clients):
+            room = f"room{index % rooms}" if rooms > 1 else None
+            client_nodes.append(connect_client(port, f"bot{index}", protocol_version, room, compression))
+
+        receiver = Receiver(client_nodes, result)
+        receiver.start()
+        # Let join messages settle before measuring
+        time.sleep(DRAIN_TIME)
+
+        stats_before = read_process_stats(process.pid)
+        receiver.recording = True
+        start = time.perf_counter()
+        send_messages(client_nodes[:senders], rate, size, duration, result)
+        time.sleep(DRAIN_TIME)
+        result.duration = time.perf_counter() - start - DRAIN_TIME
+        receiver.recording = False
+        stats_after = read_process_stats(process.pid)
+
+        receiver.running = False
+        receiver.join()
+        if stats_before is not None and stats_after is not None:
+            result.server_cpu_seconds = stats_after[0] - stats_before[0]
+            result.server_rss_bytes = stats_after[1]
+    finally:
+        for client_node in client_nodes:
+            client_node.close()
+        process.terminate()
+        process.wait()
+        chat_log_directory.cleanup()
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark a chat room server with simulated clients")
+    parser.add_argument("--server", choices=SERVER_MODULES, default="threaded")
+    parser.add_argument("--port", type=int, default=5051)
+    parser.add_argument("--clients", type=int, default=100, help="number of connected clients")
+    parser.add_argument("--senders", type=int, default=10, help="number of clients sending messages")
+    parser.add_argument("--rate", type=float, default=10, help="messages per second sent by each sender")
+    parser.add_argument("--size", type=int, default=64, help="bytes of padding in every message")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to send messages for")
+    parser.add_argument("--protocol", type=int, default=2, choices=(1, 2), help="protocol version of the clients")
+    parser.add_argument("--rooms", type=int, default=1, help="number of rooms clients are spread over")
+    parser.add_argument("--compression", action="store_true", help="ask for compression of large messages (v2)")
+    args = parser.parse_args()
+
+    senders = min(args.senders, args.clients)
+    print(f"Benchmarking {args.server} server: {args.clients} clients, {senders} senders at {args.rate} msg/s, "
+          f"{args.size} byte messages, {args.rooms} room(s), protocol v{args.protocol}"
+          f"{' with compression' if args.compression else ''}\n")
+    result = run_benchmark(args.server, args.port, args.clients, senders, args.rate, args.size, args.duration,
+                           args.protocol, args.rooms, args.compression)
+    result.report()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+"""
+Persistent chat log
+
+Every chat message is appended to a log on disk by a background writer thread, so recording a message
+only appends it to a queue and never waits for the disk
+
+The log is split into segment files named after the sequence number of their first record,
+a new segment is started once the current one reaches segment_bytes.
+Next to every segment is a sparse index with an entry every index_interval bytes,
+so looking up a message by sequence number or time reads a few KiB instead of whole segments
+
+Segment record:   sequence (u64) | timestamp (f64) | room length (u16) | name length (u16) | message length (u32)
+                  followed by the utf-8 room, name and message
+Index entry:      sequence (u64) | timestamp (f64) | offset of the record in the segment (u64)
+"""
+import logging
+import os
+import struct
+import threading
+from bisect import bisect_right
+from collections import deque
+from dataclasses import dataclass
+from time import monotonic, time
+from typing import Iterator
+
+from server_logging import log_event
+
+RECORD_HEADER = struct.Struct("!QdHHI")
+INDEX_ENTRY = struct.Struct("!QdQ")
+SEGMENT_SUFFIX = ".log"
+INDEX_SUFFIX = ".index"
+# Size of the buffer records are read with when scanning a segment
+READ_CHUNK_SIZE = 64 * 1024
+
+
+@dataclass
+class LogRecord:
+    """A chat message as stored in the log"""
+    sequence: int
+    timestamp: float
+    room: str
+    username: str
+    message: str
+
+    def encode(self) -> bytes:
+        room, username, message = self.room.encode(), self.username.encode(), self.message.encode()
+        header = RECORD_HEADER.pack(self.sequence, self.timestamp, len(room), len(username), len(message))
+        return b"".join((header, room, username, message))
+
+
+class Segment:
+    """A segment file of the log and its sparse index, which is also kept in memory
+
+    Attributes
+    ----------
+    first_sequence : int
+        sequence number of the first record of the segment, also the name of its files
+    size : int
+        number of bytes of complete records in the segment file
+    index : list[tuple[int, float, int]]
+        (sequence, timestamp, offset) of every indexed record, always starting with the first record
+    """
+
+    def __init__(self, directory: str, first_sequence: int):
+        self.first_sequence = first_sequence
+        self.path = os.path.join(directory, f"{first_sequence:020d}{SEGMENT_SUFFIX}")
+        self.index_path = os.path.join(directory, f"{first_sequence:020d}{INDEX_SUFFIX}")
+        self.size = 0
+        self.index: list[tuple[int, float, int]] = []
+
+    def offset_of_sequence(self, sequence: int) -> int:
+        """Returns the offset of the last indexed record at or before sequence"""
+        position = bisect_right(self.index, sequence, key=lambda entry: entry[0])
+        return self.index[position - 1][2] if position else 0
+
+    def offset_of_time(self, timestamp: float) -> int:
+        """Returns the offset of the last indexed record before timestamp"""
+        position = bisect_right(self.index, timestamp, key=lambda entry: entry[1])
+        # Records with an equal timestamp can be before the indexed one
+        while position and self.index[position - 1][1] >= timestamp:
+            position -= 1
+        return self.index[position - 1][2] if position else 0
+
+    def read_records(self, offset: int = 0, end: int | None = None) -> Iterator[tuple[int, LogRecord]]:
+        """Yields (offset, record) of the complete records from offset up to end, the size of the file by default"""
+        with open(self.path, "rb") as segment_file:
+            segment_file.seek(offset)
+            buffer = b""
+            position = 0  # position of the next record in buffer
+            while True:
+                chunk = segment_file.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    return
+                buffer = buffer[position:] + chunk
+                position = 0
+
+                while len(buffer) - position >= RECORD_HEADER.size:
+                    sequence, timestamp, room_len, name_len, message_len = \
+                        RECORD_HEADER.unpack_from(buffer, position)
+                    body_start = position + RECORD_HEADER.size
+                    record_end = body_start + room_len + name_len + message_len
+                    if record_end > len(buffer):
+                        break
+                    if end is not None and offset + record_end > end:
+                        return
+
+                    name_start = body_start + room_len
+                    message_start = name_start + name_len
+                    record = LogRecord(sequence, timestamp, buffer[body_start:name_start].decode(),
+                                       buffer[name_start:message_start].decode(),
+                                       buffer[message_start:record_end].decode())
+                    yield offset + position, record
+                    position = record_end
+                offset += position
+
+    def load(self, index_interval: int, is_last: bool):
+        """Loads the index of an existing segment
+        The index is rebuilt for the last segment, whose tail may be lost or half written after a crash,
+        or when it is missing
+        """
+
+        self.size = os.path.getsize(self.path)
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "rb") as index_file:
+                data = index_file.read()
+            # Drop a half written entry, and entries pointing past the end of the segment
+            data = data[:len(data) - len(data) % INDEX_ENTRY.size]
+            self.index = [entry for entry in INDEX_ENTRY.iter_unpack(data) if entry[2] < self.size]
+            if not is_last and self.index:
+                return
+
+        # Scan the records after the last indexed one, keeping only complete records
+        start = self.index[-1][2] if self.index else 0
+        last_indexed = start
+        end = start
+        for offset, record in self.read_records(start):
+            if not self.index or offset - last_indexed >= index_interval:
+                self.index.append((record.sequence, record.timestamp, offset))
+                last_indexed = offset
+            end = offset + len(record.encode())
+
+        # Cut off a half written record, along with the index entry pointing to it
+        self.size = end
+        self.index = [entry for entry in self.index if entry[2] < self.size]
+
+        with open(self.path, "r+b") as segment_file:
+            segment_file.truncate(self.size)
+        with open(self.index_path, "wb") as index_file:
+            index_file.write(b"".join(INDEX_ENTRY.pack(*entry) for entry in self.index))
+
+    def last_sequence(self) -> int | None:
+        """Returns the sequence number of the last record, found by scanning from the last index entry"""
+        if not self.index:
+            return None
+        last_sequence = self.index[-1][0]
+        for _, record in self.read_records(self.index[-1][2], self.size):
+            last_sequence = record.sequence
+        return last_sequence
+
+
+class ChatLog:
+    """Append only log of chat messages, written by a background thread
+
+    Files are only opened once the log is used, so creating a ChatLog has no side effects
+
+    Attributes
+    ----------
+    directory : str
+        directory the segments and their indexes are stored in
+    segment_bytes : int
+        size after which a new segment is started
+    index_interval : int
+        number of segment bytes between index entries
+    fsync_interval : float
+        max seconds a written record can wait before it is synced to disk, records are synced in batches
+
+    Methods
+    -------
+    append(room, username, message) -> int | None
+        Queues a chat message to be written, returns its sequence number
+    read_from_sequence(sequence) -> Iterator[LogRecord]
+        Written records starting at sequence number
+    read_from_time(timestamp) -> Iterator[LogRecord]
+        Written records logged at or after timestamp
+    close()
+        Writes and syncs all queued records, and stops the writer thread
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = 64 * 1024 * 1024, index_interval: int = 4096,
+                 fsync_interval: float = 0.05):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.index_interval = index_interval
+        self.fsync_interval = fsync_interval
+        self.closed = False
+
+        self._segments: list[Segment] = []
+        self._next_sequence = 0
+        self._records: deque[LogRecord] = deque()
+        self._condition = threading.Condition()
+        self._writer: threading.Thread | None = None
+
+        # Only used by the writer thread
+        self._segment_file = None
+        self._index_file = None
+        self._last_indexed = 0
+
+    def append(self, room: str, username: str, message: str) -> int | None:
+        """Queues a chat message to be written to the log, never blocks on the disk
+        Returns the sequence number of the message, None if the log is closed and the message was not logged
+        """
+
+        with self._condition:
+            if self.closed:
+                return None
+            if self._writer is None:
+                self._open()
+
+            sequence = self._next_sequence
+            self._next_sequence += 1
+            self._records.append(LogRecord(sequence, time(), room, username, message))
+            self._condition.notify()
+        return sequence
+
+    def read_from_sequence(self, sequence: int) -> Iterator[LogRecord]:
+        """Yields records written to the log starting at sequence number"""
+        segments = self._readable_segments()
+        position = bisect_right(segments, sequence, key=lambda item: item[0].first_sequence)
+        for segment, size in segments[max(position - 1, 0):]:
+            start = segment.offset_of_sequence(sequence)
+            for _, record in segment.read_records(start, size):
+                if record.sequence >= sequence:
+                    yield record
+
+    def read_from_time(self, timestamp: float) -> Iterator[LogRecord]:
+        """Yields records written to the log at or after timestamp (seconds since the epoch)"""
+        segments = self._readable_segments()
+        # Segments are in time order, start at the last segment beginning before timestamp
+        position = bisect_right(segments, timestamp,
+                                key=lambda item: item[0].index[0][1] if item[0].index else float("inf"))
+        while position > 1 and segments[position - 1][0].index[0][1] >= timestamp:
+            position -= 1
+        for segment, size in segments[max(position - 1, 0):]:
+            start = segment.offset_of_time(timestamp)
+            for _, record in segment.read_records(start, size):
+                if record.timestamp >= timestamp:
+                    yield record
+
+    def close(self):
+        """Writes and syncs the queued records, and waits for the writer thread to stop"""
+        with self._condition:
+            if self.closed:
+                return
+            self.closed = True
+            self._condition.notify()
+            writer = self._writer
+        if writer is not None:
+            writer.join()
+
+    def _readable_segments(self) -> list[tuple[Segment, int]]:
+        """Returns the segments with the number of bytes which can be read from each"""
+        with self._condition:
+            if self._writer is None and not self.closed:
+                self._open()
+            return [(segment, segment.size) for segment in self._segments]
+
+    def _open(self):
+        """Loads the existing segments and starts the writer thread, the condition lock must be held by the caller"""
+        os.makedirs(self.directory, exist_ok=True)
+        first_sequences = sorted(int(name.removesuffix(SEGMENT_SUFFIX)) for name in os.listdir(self.directory)
+                                 if name.endswith(SEGMENT_SUFFIX))
+        for first_sequence in first_sequences:
+            segment = Segment(self.directory, first_sequence)
+            segment.load(self.index_interval, is_last=first_sequence == first_sequences[-1])
+            self._segments.append(segment)
+
+        if self._segments:
+            last_sequence = self._segments[-1].last_sequence()
+            self._next_sequence = self._segments[-1].first_sequence if last_sequence is None else last_sequence + 1
+
+        self._writer = threading.Thread(target=self._write_records, daemon=True)
+        self._writer.start()
+
+    def _start_segment(self, first_sequence: int):
+        """Closes the current segment and starts a new one, only called by the writer thread"""
+        self._close_segment()
+        segment = self._segments[-1] if self._segments else None
+        if segment is None or segment.size >= self.segment_bytes:
+            # The last segment is appended to when the log is reopened, unless it is full
+            segment = Segment(self.directory, first_sequence)
+            with self._condition:
+                self._segments.append(segment)
+        self._segment_file = open(segment.path, "ab")
+        self._index_file = open(segment.index_path, "ab")
+        self._last_indexed = segment.index[-1][2] if segment.index else 0
+
+    def _close_segment(self):
+        if self._segment_file is None:
+            return
+        self._sync()
+        self._segment_file.close()
+        self._index_file.close()
+        self._segment_file = self._index_file = None
+
+    def _sync(self):
+        """Flushes and syncs the current segment and its index, the index is synced after the records it points to"""
+        self._segment_file.flush()
+        os.fsync(self._segment_file.fileno())
+        self._index_file.flush()
+        os.fsync(self._index_file.fileno())
+
+    def _write_batch(self, records: list[LogRecord]) -> bool:
+        """Writes records to the current segment, starting new segments as needed
+        Returns False if no segment is open, i.e. there is nothing to sync
+        """
+
+        for record in records:
+            try:
+                data = record.encode()
+            except (struct.error, ValueError) as e:
+                # e.g. a name too long for its length field, only this record is lost
+                log_event("chat_log_error", logging.ERROR, sequence=record.sequence, error=str(e),
+                          detail="Record skipped")
+                continue
+
+            if self._segment_file is None or self._segments[-1].size >= self.segment_bytes:
+                self._start_segment(record.sequence)
+            segment = self._segments[-1]
+
+            self._segment_file.write(data)
+            if not segment.index or segment.size - self._last_indexed >= self.index_interval:
+                entry = (record.sequence, record.timestamp, segment.size)
+                self._index_file.write(INDEX_ENTRY.pack(*entry))
+                segment.index.append(entry)
+                self._last_indexed = segment.size
+            segment.size += len(data)
+
+        if self._segment_file is None:
+            # Every record was skipped, nothing to flush or sync
+            return False
+        # Readers only read up to segment.size, so the records must reach the file before they are read
+        self._segment_file.flush()
+        self._index_file.flush()
+        return True
+
+    def _write_records(self):
+        """Writer thread, writes queued records in batches and syncs them at most every fsync_interval"""
+        last_sync = monotonic()
+        unsynced = False
+        while True:
+            with self._condition:
+                while not self._records and not self.closed:
+                    if not unsynced:
+                        self._condition.wait()
+                        continue
+                    remaining = last_sync + self.fsync_interval - monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                records = list(self._records)
+                self._records.clear()
+                closing = self.closed
+
+            try:
+                if records and self._write_batch(records):
+                    unsynced = True
+                if unsynced and (closing or monotonic() - last_sync >= self.fsync_interval):
+                    self._sync()
+                    last_sync = monotonic()
+                    unsynced = False
+            except OSError as e:
+                log_event("chat_log_error", logging.ERROR, error=str(e), detail="Messages are no longer logged")
+                with self._condition:
+                    self.closed = True
+                    self._records.clear()
+                closing = True
+
+            if closing:
+                try:
+                    self._close_segment()
+                except OSError:
+                    pass
+                return
@@ -0,0 +1,432 @@
+"""
+Chat room protocol handling shared by the servers
+
+server.py (a thread per client) and async_server.py (a single event loop) only move packets between
+their sockets and a ClientSession, which decides what every packet means: logging in, chat messages,
+room commands and file transfers. Sending never waits with either server (outbound queues and transports),
+so sessions send to the nodes directly, and only hand back to the server what it has to wait for:
+a password check running on the credential threads, or the seconds a file sender is paused for
+
+The state of a server shared by all of its clients (rooms, history, chat log, accounts, rate limits)
+is bundled in a ChatService, every server module has its own
+"""
+import logging
+import os
+import socket
+from concurrent.futures import Future
+from time import perf_counter
+
+from node import SharedPacket
+from client_registry import ClientRegistry
+from rooms import ChatRooms, DEFAULT_ROOM
+from history import ChatHistory
+from chat_log import ChatLog
+from credentials import CredentialStore
+from worker_bus import WorkerBus
+from rate_limit import RateLimiter
+from file_transfer import FileTransfers
+from heartbeat import IdleReaper, Node, handle_heartbeat
+from server_logging import log_event
+from metrics import auth_failures, broadcast_seconds, broadcast_fanout
+from comms_protocol import MessageType, WRONG_PASSWORD_ERROR, report_wrong_packet, INVALID_MSG_LEN_ERROR, \
+    WRONG_PACKET_MSG, negotiate_protocol, MSG_TOO_LONG_ERROR, INVALID_ROOM_NAME_ERROR, PASSWORD_REQUIRED, \
+    FILE_V1_ERROR, PROTOCOL_V2, INVALID_NAME_ERROR, file_chunk_header, is_valid_name
+
+# To broadcast the message to all clients and not exclude anyone
+NO_CLIENT_ID = -1
+# Server address
+HOST, PORT = socket.gethostbyname(socket.gethostname()), 5050
+# Chat log and credentials are next to this file, so they are found whatever directory the server is started from
+SERVER_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+# Every chat message is persisted here, segments are rolled over at 64 MiB and synced to disk in batches
+CHAT_LOG_DIRECTORY = os.path.join(SERVER_DIRECTORY, "chat_log")
+# Usernames which need a password, with their roles and password hashes, see credentials.py
+CREDENTIALS_FILE = os.path.join(SERVER_DIRECTORY, "credentials.txt")
+# Failed logins a connection gets before it is disconnected, every attempt hashes a password
+MAX_AUTH_ATTEMPTS = 3
+# Clients silent for PING_AFTER seconds are pinged, and disconnected once silent for IDLE_TIMEOUT seconds
+PING_AFTER = 30.0
+IDLE_TIMEOUT = 90.0
+# Packets per second a connection can keep sending, and how many it can send at once after being quiet
+MESSAGE_RATE, MESSAGE_BURST = 50.0, 100.0
+# Same for all connections of a username together, None does not limit usernames
+USER_MESSAGE_RATE, USER_MESSAGE_BURST = None, None
+# Bytes per second of files a connection can send, and how many it can send at once, see file_transfer.py
+FILE_RATE, FILE_BURST = 4 * 1024 * 1024, 1024 * 1024
+# Events below this level are not logged, and the fraction of events logged for frequent events
+LOG_LEVEL = logging.INFO
+# e.g. {"message": 0.01} logs 1 in 100 chat messages, lower the rate when logging can not keep up
+LOG_SAMPLE_RATES: dict[str, float] = {"message": 1.0}
+# Metrics are served over HTTP on this address, only reachable from the machine running the server
+STATS_HOST, STATS_PORT = "127.0.0.1", 9090
+
+
+def load_credentials(credential_store: CredentialStore, log_listener):
+    """Loads the accounts of credential_store, exits if the credentials file is missing"""
+    try:
+        credential_store.load()
+    except FileNotFoundError:
+        log_listener.stop()
+        raise SystemExit(f"Cannot start without the credentials file {credential_store.path}")
+
+
+class ChatService:
+    """State of a chat room server, shared by the sessions of all of its clients
+
+    Attributes
+    ----------
+    clients : ClientRegistry
+        connected/active clients
+    rooms : ChatRooms
+        members of every chat room, messages are only broadcast to the room of the sender
+    history : ChatHistory
+        recent chat messages of every room, sent to clients entering the room
+    chat_log : ChatLog
+        every chat message is persisted here
+    credentials : CredentialStore
+        usernames which need a password
+    rate_limiter : RateLimiter
+        limits the packets every client can send
+    reaper : IdleReaper
+        disconnects clients which vanished without closing their connection, see heartbeat.py
+    bus : WorkerBus | None
+        other worker processes broadcasts are relayed to, only set for workers of multi_server.py
+
+    Methods
+    -------
+    broadcast_message(room, exclude_ids, sender_name, message, message_type, relay) -> SharedPacket
+        Sends a message to all clients in room
+    relay_file_packet(room, sender, packet)
+        Sends a file announcement or chunk to all v2 members of room but the sender
+    replay_history(client_node, room)
+        Sends the recent chat history of room to the client
+    move_to_room(client_node, username, room)
+        Moves client to room, and informs members of both the rooms
+    """
+
+    def __init__(self, chat_log_directory: str = CHAT_LOG_DIRECTORY, credentials_file: str = CREDENTIALS_FILE):
+        self.clients: ClientRegistry[Node] = ClientRegistry()
+        self.rooms: ChatRooms[Node] = ChatRooms()
+        self.history = ChatHistory(max_messages=50)
+        self.chat_log = ChatLog(chat_log_directory)
+        self.credentials = CredentialStore(credentials_file)
+        self.rate_limiter = RateLimiter(MESSAGE_RATE, MESSAGE_BURST, USER_MESSAGE_RATE, USER_MESSAGE_BURST,
+                                        FILE_RATE, FILE_BURST)
+        self.reaper = IdleReaper(self.clients, PING_AFTER, IDLE_TIMEOUT)
+        self.bus: WorkerBus | None = None
+
+    def broadcast_message(self, room: str, exclude_ids: tuple[int, ...], sender_name: str | None, message: str,
+                          message_type: MessageType = MessageType.MESSAGE, relay: bool = True) -> SharedPacket:
+        """Send messages to all clients in room
+        When sender_name is None, sends the message without sending username
+        Returns the packet sent, which can be sent again later without encoding it again
+
+        Packets are only queued for each client, so a broadcast never waits on a slow client
+        With a worker bus, the broadcast is also relayed to the members of room held by other workers,
+        unless relay is False, i.e. the broadcast came from another worker
+        """
+
+        if relay and self.bus is not None and room is not None:
+            self.bus.publish(room, sender_name, message, message_type)
+
+        # Encode the packets only once per protocol version, every client is sent the same bytes
+        # NAME and message packets are joined so each client gets a single write
+        message_packet = SharedPacket((message, message_type))
+        if sender_name:
+            message_packet = SharedPacket((sender_name, MessageType.NAME), (message, message_type))
+
+        start = perf_counter()
+        members = self.rooms.members(room)
+        for c_node in members:
+            try:
+                # Don't broadcast if client in exclude ids
+                if c_node.connection_id in exclude_ids:
+                    continue
+
+                c_node.send_packet(message_packet.encode_for(c_node))
+            except ValueError:
+                # Message is too long for the protocol version of the client, it misses out on this one
+                log_event("broadcast_error", logging.WARNING, address=c_node.address, error=MSG_TOO_LONG_ERROR)
+            except OSError:
+                # Thread or task of the client removes it from its room once it notices the broken connection
+                self._remove_broken(c_node)
+
+        broadcast_seconds.observe(perf_counter() - start)
+        broadcast_fanout.observe(len(members))
+        return message_packet
+
+    def relay_file_packet(self, room: str, sender: Node, packet: SharedPacket | bytes | bytearray):
+        """Sends a file announcement or chunk to all members of room but the sender
+        v1 clients are skipped, their packets can not carry files
+        """
+
+        for c_node in self.rooms.members(room):
+            if c_node is sender or c_node.protocol_version != PROTOCOL_V2:
+                continue
+            try:
+                c_node.send_packet(packet.encode_for(c_node) if isinstance(packet, SharedPacket) else packet)
+            except OSError:
+                self._remove_broken(c_node)
+
+    def replay_history(self, client_node: Node, room: str):
+        """Sends the recent chat history of room to the client in a single write"""
+        history_packet = self.history.replay_packet(room, client_node)
+        if not history_packet:
+            return
+        try:
+            client_node.send_packet(history_packet)
+        except OSError:
+            # Thread or task of the client notices the broken connection when it receives
+            pass
+
+    def move_to_room(self, client_node: Node, username: str, room: str):
+        """Moves client to room, and informs members of both the rooms
+        Room names which are not valid are reported to the client instead
+        """
+
+        if not ChatRooms.is_valid_name(room):
+            report_wrong_packet(f"[{username}] {INVALID_ROOM_NAME_ERROR}", INVALID_ROOM_NAME_ERROR, client_node)
+            return
+        previous_room = self.rooms.join(client_node, room)
+        if previous_room == room:
+            client_node.send_message(f"Already in {room}", MessageType.INFO)
+            return
+        self.replay_history(client_node, room)
+
+        log_event("room", username=username, previous_room=previous_room, room=room)
+        if previous_room is not None:
+            self.broadcast_message(previous_room, (NO_CLIENT_ID,), None, f"{username} Left the room", MessageType.INFO)
+        self.broadcast_message(room, (NO_CLIENT_ID,), None, f"{username} Entered the room {room}", MessageType.INFO)
+
+    def _remove_broken(self, client_node: Node):
+        if self.clients.remove(client_node):
+            log_event("broadcast_error", logging.WARNING, address=client_node.address, error="Removed from clients")
+
+
+class ClientSession:
+    """Protocol state of a single client connection, fed every packet received from the client
+
+    Attributes
+    ----------
+    service : ChatService
+        state of the server the client is connected to
+    client_node : NetworkNode | AsyncNetworkNode
+        connection packets are sent to
+    username : str | None
+        name of the client, None until it logged in
+    closed : bool
+        set once the client left or has to be disconnected, the server stops receiving from it then
+
+    Methods
+    -------
+    receive(message_type, message_body) -> Future | float
+        Handles a received packet, returns what the server has to wait for before receiving the next one
+    password_checked(role)
+        Finishes a login with the role given by the password check returned by receive
+    invalid_packet()
+        Tells the client its last packet could not be parsed
+    disconnected(error)
+        Cleans up after the connection broke, and tells the room the client left
+    """
+
+    def __init__(self, service: ChatService, client_node: Node):
+        self.service = service
+        self.client_node = client_node
+        self.username: str | None = None
+        self.closed = False
+
+        self._failed_logins = 0
+        # Name waiting for its password, see _receive_login
+        self._pending_name: str | None = None
+        self._rate_limit = None
+        self._transfers = FileTransfers()
+
+    def receive(self, message_type: str, message_body: bytes) -> Future | float:
+        """Handles a packet received from the client
+
+        Returns a Future of the role when a password has to be checked, its result is passed to password_checked
+        Otherwise returns the seconds the server should not receive from the client for, 0 mostly.
+        Not receiving from a file sender until its file bucket refills slows the sender down through TCP
+
+        Raises
+        ------
+        socket.error - If the connection broke while answering
+        ValueError - If a text packet is not valid utf-8
+        """
+
+        if handle_heartbeat(self.client_node, message_type):
+            return 0.0
+        if self.username is None:
+            return self._receive_login(message_type, message_body.decode().strip())
+
+        # File chunks are limited by their bytes instead of the packet rate limit
+        if message_type == MessageType.FILE_CHUNK.value:
+            return self._relay_file_chunk(message_body)
+        # Every other packet can make the server broadcast, and counts towards the rate limit
+        retry_after = self._rate_limit.take()
+        if retry_after:
+            self._throttle(retry_after)
+            return 0.0
+
+        chat_message = message_body.decode().strip()
+        match message_type:
+            case MessageType.MESSAGE.value:
+                self._send_chat_message(chat_message)
+            case MessageType.JOIN.value:
+                self.service.move_to_room(self.client_node, self.username, chat_message)
+            case MessageType.LEAVE.value:
+                self.service.move_to_room(self.client_node, self.username, DEFAULT_ROOM)
+            case MessageType.ROOMS.value:
+                # e.g. "lobby (12), python (3)"
+                room_sizes = sorted(self.service.rooms.room_sizes().items())
+                self.client_node.send_message(", ".join(f"{room} ({size})" for room, size in room_sizes),
+                                              MessageType.ROOMS)
+            case MessageType.FILE.value:
+                self._start_file_transfer(chat_message)
+            case _:
+                # If not a message packet, inform client and log on console of wrong packet type
+                self._report(WRONG_PACKET_MSG.format(listen=MessageType.MESSAGE.value, recv=message_type))
+        return 0.0
+
+    def password_checked(self, role: str | None):
+        """Logs the client in with role, or counts a failed login if the password was wrong (role is None)"""
+        username, self._pending_name = self._pending_name, None
+        if role is None:
+            self._login_failed(WRONG_PASSWORD_ERROR)
+            return
+
+        log_event("authenticated", address=self.client_node.address, username=username, role=role)
+        self.client_node.send_message(f"Authenticated as {role}", MessageType.INFO)
+        self._enter_chat(username)
+
+    def invalid_packet(self):
+        self._report(INVALID_MSG_LEN_ERROR)
+
+    def disconnected(self, error: OSError):
+        """Removes the client, and tells its room it left if it was logged in"""
+        self.closed = True
+        self.service.clients.remove(self.client_node)
+        if self.username is None:
+            log_event("disconnected", address=self.client_node.address, error=error.strerror)
+            return
+
+        room = self.service.rooms.remove(self.client_node)
+        leave_message = f"{self.username} Left the chat"
+        self.service.broadcast_message(room, (self.client_node.connection_id,), None, leave_message, MessageType.INFO)
+        log_event("left", username=self.username, room=room)
+        # Receivers of unfinished files are told to drop them
+        for transfer in self._transfers.abort():
+            self.service.relay_file_packet(transfer.room, self.client_node, file_chunk_header(transfer.transfer_id, 0))
+
+    def _receive_login(self, message_type: str, message: str) -> Future | float:
+        """Handles the packets of a client which has not logged in yet"""
+        # A name which needs a password must be followed by a PASSWORD packet
+        if self._pending_name is not None:
+            if message_type != MessageType.PASSWORD.value:
+                self._pending_name = None
+                self._login_failed(WRONG_PACKET_MSG.format(listen=MessageType.PASSWORD.value, recv=message_type))
+                return 0.0
+            # Hashing runs on the credential threads, the server only waits for the result
+            return self.service.credentials.verify(self._pending_name, message)
+
+        # Clients supporting newer protocol versions ask for them before sending their name
+        if message_type == MessageType.PROTOCOL.value:
+            negotiate_protocol(self.client_node, message)
+        elif message_type != MessageType.NAME.value:
+            self._report(WRONG_PACKET_MSG.format(listen="username", recv=message_type))
+        # Names end up in the chat log and bus packets, which only have room for MAX_NAME_LENGTH characters
+        elif not is_valid_name(message):
+            self._report(INVALID_NAME_ERROR)
+        # No auth required if user has no account
+        elif not self.service.credentials.requires_password(message):
+            self._enter_chat(message)
+        else:
+            self._pending_name = message
+            # Clients older than protocol versions send the PASSWORD packet right after the name without being asked,
+            # and would take PASSWORD_REQUIRED for the reply to it
+            if self.client_node.protocol_version == PROTOCOL_V2:
+                self.client_node.send_message(PASSWORD_REQUIRED, MessageType.INFO)
+        return 0.0
+
+    def _login_failed(self, error_msg: str):
+        """Reports a failed login, and disconnects the client after MAX_AUTH_ATTEMPTS of them"""
+        self._report(error_msg)
+        auth_failures.inc()
+        self._failed_logins += 1
+        if self._failed_logins >= MAX_AUTH_ATTEMPTS:
+            log_event("auth_attempts_exceeded", logging.WARNING, address=self.client_node.address,
+                      attempts=self._failed_logins)
+            self.closed = True
+
+    def _enter_chat(self, username: str):
+        """Every client starts in the default room, and gets to see what it missed there"""
+        self.username = username
+        self._rate_limit = self.service.rate_limiter.for_client(username)
+        log_event("name", address=self.client_node.address, username=username)
+
+        self.service.rooms.join(self.client_node, DEFAULT_ROOM)
+        self.service.replay_history(self.client_node, DEFAULT_ROOM)
+        # NO_CLIENT_ID is used to broadcast to all clients of the room
+        self.service.broadcast_message(DEFAULT_ROOM, (NO_CLIENT_ID,), None, f"{username} Entered the chat",
+                                       MessageType.INFO)
+
+    def _send_chat_message(self, message: str):
+        """Broadcasts a chat message to the room of the client, records it in the history and the chat log"""
+        # No need to broadcast empty messages
+        if message == "":
+            return
+        room = self.service.rooms.room_of(self.client_node)
+        log_event("message", username=self.username, room=room, message=message)
+        message_packet = self.service.broadcast_message(room, (self.client_node.connection_id,), self.username,
+                                                        message)
+        self.service.history.record(room, message_packet)
+        self.service.chat_log.append(room, self.username, message)
+
+    def _throttle(self, retry_after: float):
+        """Tells the client its packets are being dropped, only once until it slows down"""
+        if self._rate_limit.throttled:
+            return
+        self._rate_limit.throttled = True
+        log_event("throttled", logging.WARNING, username=self.username, retry_after=round(retry_after, 3))
+        self.client_node.send_message(f"{retry_after:.3f}", MessageType.THROTTLED)
+
+    def _start_file_transfer(self, message: str):
+        """Announces the file of a FILE packet to the room of the client, its chunks are relayed by _relay_file_chunk"""
+        if self.client_node.protocol_version != PROTOCOL_V2:
+            self._report(FILE_V1_ERROR)
+            return
+
+        room = self.service.rooms.room_of(self.client_node)
+        try:
+            transfer = self._transfers.start(message, room)
+        except ValueError as e:
+            self._report(str(e))
+            return
+
+        log_event("file", username=self.username, room=room, file_name=transfer.file_name, size=transfer.remaining)
+        announcement = f"{transfer.transfer_id} {transfer.remaining} {transfer.file_name}"
+        packet = SharedPacket((self.username, MessageType.NAME), (announcement, MessageType.FILE))
+        self.service.relay_file_packet(room, self.client_node, packet)
+
+    def _relay_file_chunk(self, body: bytes) -> float:
+        """Relays the body of a FILE_CHUNK packet to the room its file was announced in, without decoding it
+        Returns the seconds the sender has to wait for its file bucket to refill
+        """
+
+        try:
+            transfer, packet = self._transfers.relay_packet(body)
+        except ValueError as e:
+            # Invalid chunks are answered, so they count towards the packet rate limit like other packets
+            retry_after = self._rate_limit.take()
+            if retry_after:
+                self._throttle(retry_after)
+            else:
+                self._report(str(e))
+            return 0.0
+
+        self.service.relay_file_packet(transfer.room, self.client_node, packet)
+        return self._rate_limit.pace_file(len(body))
+
+    def _report(self, error_msg: str):
+        """Logs error_msg with the username (the address before logging in) of the client and sends it to the client"""
+        report_wrong_packet(f"[{self.username or self.client_node.address}] {error_msg}", error_msg, self.client_node)
@@ -1,57 +1,126 @@
+import itertools
+import os
 import socket
 import threading
 from sys import argv
 
 from node import NetworkNode
-from comms_protocol import MessageType, WRONG_PASSWORD_ERROR, CONN_ERROR, INVALID_MSG_LEN_ERROR
+from file_transfer import FileDownloads
+from comms_protocol import MessageType, WRONG_PASSWORD_ERROR, CONN_ERROR, INVALID_MSG_LEN_ERROR, \
+    LATEST_PROTOCOL_VERSION, MSG_TOO_LONG_ERROR, ZLIB_CAPABILITY, PASSWORD_REQUIRED, PROTOCOL_V2, FILE_V1_ERROR, \
+    INVALID_NAME_ERROR, MAX_NAME_LENGTH, PROTOCOL_REPLY_TIMEOUT, PROTOCOL_V1, \
+    V1_PASSWORD_ACCOUNT, parse_protocol_message
 
 HOST, PORT = socket.gethostbyname(socket.gethostname()), 5050  # Server address
 is_alive: bool = True  # flag to check if all services are alive
+downloads = FileDownloads()  # files being received, saved in the downloads directory
+transfer_ids = itertools.count(1)  # ids of the files sent by this client
 
 
-def get_username_and_password():
-    username, password = None, None
+def get_username():
     # No CLI argument was passed
     if len(argv) == 1:
-        username = input("Enter your username - ")
-        if username == "admin":
-            password = input("Enter your password - ")
+        return input("Enter your username - ")
 
-    # At least username was passed as a CLI argument
-    if len(argv) > 1:
-        username = argv[1]
-        print(f"Enter your username - {username}")
-    # Password was also passed as a CLI argument
-    if len(argv) > 2:
-        password = argv[2]
-        print(f"Enter your password - {password}")
+    # Username was passed as a CLI argument
+    username = argv[1]
+    print(f"Enter your username - {username}")
+    return username
 
-    return username, password
+
+def get_password():
+    # Password was not passed as a CLI argument
+    if len(argv) <= 2:
+        return input("Enter your password - ")
+
+    password = argv[2]
+    print(f"Enter your password - {password}")
+    return password
+
+
+def negotiate_protocol_with_server(client_node: NetworkNode) -> bool:
+    """Asks the server for the latest protocol version with compression and switches to what it replies with
+    Returns False if the server did not reply within PROTOCOL_REPLY_TIMEOUT seconds, servers older than
+    protocol versions stop serving the connection on a PROTOCOL packet, the client has to reconnect then
+    """
+
+    global is_alive
+    try:
+        client_node.send_message(f"{LATEST_PROTOCOL_VERSION} {ZLIB_CAPABILITY}", MessageType.PROTOCOL)
+        client_node.connection.settimeout(PROTOCOL_REPLY_TIMEOUT)
+        try:
+            message_type, reply = client_node.recv_message()
+        except socket.timeout:
+            return False
+        client_node.connection.settimeout(None)
+        if message_type == MessageType.PROTOCOL.value:
+            protocol_version, capabilities = parse_protocol_message(reply)
+            client_node.set_protocol_version(protocol_version)
+            client_node.set_compression(ZLIB_CAPABILITY in capabilities)
+    except socket.error:
+        print(CONN_ERROR)
+        is_alive = False
+    return True
+
+
+def connect_to_server(negotiate: bool = True) -> NetworkNode | None:
+    """Connects to the server and agrees on a protocol version, returns None if the server can not be reached
+    Servers which do not reply to the PROTOCOL packet are connected to again, keeping protocol v1
+    """
+
+    client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        client.connect((HOST, PORT))
+    except socket.error:
+        client.close()
+        print("Cannot connect to server")
+        print("Maybe the server is offline, or you are not connected to the internet")
+        return None
+
+    client_node = NetworkNode(client)
+    if negotiate and not negotiate_protocol_with_server(client_node):
+        client.close()
+        return connect_to_server(negotiate=False)
+    return client_node
 
 
 def authenticate_with_server(client_node: NetworkNode):
     global is_alive
     while is_alive:
         try:
-            username, password = get_username_and_password()
+            username = get_username()
 
             # Sending username to server
             client_node.send_message(username, MessageType.NAME)
-            # If username is not admin, no need for authentication
-            if username != "admin":
-                break
+            if client_node.protocol_version == PROTOCOL_V1:
+                # Servers older than protocol versions never ask for the password, it is sent right after the name
+                if username != V1_PASSWORD_ACCOUNT:
+                    break
+            else:
+                # Server asks for the password of usernames with an account, every other username
+                # is let in right away and the packet is the first one of the chat
+                message_type, message = client_node.recv_message()
+                if message_type == MessageType.INFO.value and message == INVALID_NAME_ERROR:
+                    print(f"Usernames are 1 to {MAX_NAME_LENGTH} printable characters")
+                    del argv[1:]
+                    continue
+                if message_type != MessageType.INFO.value or message != PASSWORD_REQUIRED:
+                    handle_packet(client_node, message_type, message)
+                    break
 
-            # Send password for admin authentication
-            client_node.send_message(password, MessageType.PASSWORD)
+            # Send password for authentication
+            client_node.send_message(get_password(), MessageType.PASSWORD)
 
             # Handle server response of authentication
             _, response = client_node.recv_message()
             if response == WRONG_PASSWORD_ERROR:
                 print("Wrong password")
+                # Ask again instead of sending the same wrong password
+                del argv[1:]
                 continue
 
             # response was not password error, hence authenticated
-            print("Authenticated as admin successfully\n")
+            print(f"{response}\n")
             break
 
         except socket.error:
@@ -60,6 +129,45 @@ def authenticate_with_server(client_node: NetworkNode):
             break
 
 
+def parse_command(message: str) -> tuple[str, MessageType]:
+    """Turns room commands typed by the user into packets, everything else is a chat message
+    /join <room>, /leave, /rooms
+    """
+
+    command, _, argument = message.partition(" ")
+    match command:
+        case "/join":
+            return argument.strip(), MessageType.JOIN
+        case "/leave":
+            return "", MessageType.LEAVE
+        case "/rooms":
+            return "", MessageType.ROOMS
+    return message, MessageType.MESSAGE
+
+
+def send_file(client_node: NetworkNode, path: str):
+    """Sends the file at path to the room, the typed messages are only sent once the whole file is"""
+    if client_node.protocol_version != PROTOCOL_V2:
+        print(FILE_V1_ERROR)
+        return
+    try:
+        file = open(path, "rb")
+    except OSError as e:
+        print(f"Cannot open {path}: {e.strerror}")
+        return
+
+    with file:
+        size = os.fstat(file.fileno()).st_size
+        if size == 0:
+            print("Empty files can not be sent")
+            return
+        transfer_id = next(transfer_ids)
+        print(f"Sending {path} ({size} bytes)")
+        client_node.send_message(f"{transfer_id} {size} {os.path.basename(path)}", MessageType.FILE)
+        client_node.send_file(file, transfer_id, size)
+        print(f"Sent {path}")
+
+
 def send_messages_to_server(client_node: NetworkNode):
     global is_alive
     try:
@@ -69,37 +177,85 @@ def send_messages_to_server(client_node: NetworkNode):
             if message == "quit":
                 is_alive = False  # Send service died
                 break
-            client_node.send_message(message, MessageType.MESSAGE)
+            if message.startswith("/send "):
+                send_file(client_node, message.removeprefix("/send ").strip())
+                continue
+            try:
+                client_node.send_message(*parse_command(message))
+            except ValueError:
+                print(MSG_TOO_LONG_ERROR)
 
     except socket.error:
         print(f"[SENDER SERVICE] {CONN_ERROR}")
         return
 
 
+def handle_packet(client_node: NetworkNode, message_type: str, message: str):
+    """Prints a packet received from the server, or answers it"""
+    received_message: str
+    # Check message type
+    match message_type:
+        case MessageType.INFO.value:
+            received_message = f"{message}"
+        case MessageType.NAME.value:
+            sender_name = message  # Username of sender
+            # if username of sender is received, chat message or file should follow
+            message_type, chat_message = client_node.recv_message()
+            if message_type == MessageType.FILE.value:
+                try:
+                    download = downloads.start(chat_message, sender_name)
+                except ValueError as e:
+                    # Only this file is skipped, the connection is fine
+                    print(e)
+                    return
+                received_message = f"{sender_name} is sending a file, saving it to {download.path}"
+            else:
+                received_message = f"{sender_name}: {chat_message}"
+        case MessageType.ROOMS.value:
+            received_message = f"Rooms: {message}"
+        case MessageType.THROTTLED.value:
+            received_message = f"Slow down, messages are being dropped, wait {message} seconds"
+        case MessageType.PING.value:
+            # Server checking if the client is still there
+            client_node.send_message("", MessageType.PONG)
+            return
+        case no_matches:
+            print(f"Received invalid message type: {no_matches}")
+            return
+    print(received_message)
+
+
+def receive_file_chunk(body: bytes):
+    try:
+        download = downloads.write_chunk(body)
+    except ValueError as e:
+        print(e)
+        return
+    if download is None:
+        return
+    if download.remaining:
+        print(f"{download.sender_name} left before sending the whole file, removed {download.path}")
+    else:
+        print(f"Received file {download.path}")
+
+
 def receive_messages_from_server(client_node: NetworkNode):
     global is_alive
-    received_message: str
     # Keep listening for messages while all services are alive
     while is_alive:
         try:
-            message_type, message = client_node.recv_message()
-            # Check message type
-            match message_type:
-                case MessageType.INFO.value:
-                    received_message = f"{message}"
-                case MessageType.NAME.value:
-                    sender_name = message  # Username of sender
-                    # if username of sender is received, chat message should follow
-                    _, chat_message = client_node.recv_message()
-                    received_message = f"{sender_name}: {chat_message}"
-                case no_matches:
-                    print(f"Received invalid message type: {no_matches}")
-                    continue
-            print(received_message)
+            message_type, message_body = client_node.recv_frame()
+            # File chunks are written as they are, everything else is text
+            if message_type == MessageType.FILE_CHUNK.value:
+                receive_file_chunk(message_body)
+                continue
+            handle_packet(client_node, message_type, message_body.decode().strip())
 
         except socket.error:
             print(CONN_ERROR)
             is_alive = False  # Receiver service died
+            # Partial files will never be completed
+            downloads.close()
             break
         except ValueError:
             print(INVALID_MSG_LEN_ERROR)
@@ -111,17 +267,12 @@ def run_client():
     while the `send_messages_to_server` function faclitates sending of messages to the server
     """
 
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as client:
-        # Try connecting to server
-        try:
-            client.connect((HOST, PORT))
-        except socket.error:
-            print("Cannot connect to server")
-            print("Maybe the server is offline, or you are not connected to the internet")
-
-        client_node = NetworkNode(client)
+    # First agree on a protocol version and authenticate before starting sender and receiver functions
+    client_node = connect_to_server()
+    if client_node is None:
+        return
 
-        # First authenticate before starting sender and receiver functions
+    with client_node.connection:
         authenticate_with_server(client_node)
 
         receiver_thread = threading.Thread(target=receive_messages_from_server, args=(client_node,))
@@ -134,5 +285,7 @@ if __name__ == "__main__":
     print("GWA's Chatroom")
     print("Type 'quit' to quit the program")
     print("Type and press enter to send message")
+    print("Type '/join <room>' to join a room, '/leave' to go back to the lobby, '/rooms' to list rooms")
+    print("Type '/send <path>' to send a file to the room")
     print()
     run_client()
@@ -0,0 +1,77 @@
+"""
+Registry of connected clients
+
+Clients are keyed by a connection id given to them when they are added, so adding and removing
+a client is O(1), and broadcasts iterate over a snapshot which is only rebuilt after the registry changes
+"""
+import threading
+from itertools import count
+from typing import TypeVar, Generic
+
+# Any node class, NetworkNode or AsyncNetworkNode, it must have a connection_id attribute
+Node = TypeVar("Node")
+
+
+class ClientRegistry(Generic[Node]):
+    """Thread safe registry of connected client nodes
+
+    Methods
+    -------
+    add(client_node) -> int
+        Adds a client and sets its connection_id, returns the connection id
+    remove(client_node) -> bool
+        Removes a client, returns False if it was already removed
+    get(connection_id)
+        Gets a client by its connection id
+    snapshot() -> tuple
+        Immutable tuple of all clients, safe to iterate while clients come and go
+    """
+
+    def __init__(self):
+        self._clients: dict[int, Node] = {}
+        self._lock = threading.Lock()
+        self._connection_ids = count()
+        # Cached result of snapshot(), None when the registry changed after it was built
+        self._snapshot: tuple[Node, ...] | None = None
+
+    def __len__(self):
+        return len(self._clients)
+
+    def __contains__(self, client_node: Node):
+        return self._clients.get(client_node.connection_id) is client_node
+
+    def add(self, client_node: Node) -> int:
+        """Adds client_node to the registry with a new connection id and returns the id"""
+        with self._lock:
+            client_node.connection_id = next(self._connection_ids)
+            self._clients[client_node.connection_id] = client_node
+            self._snapshot = None
+        return client_node.connection_id
+
+    def remove(self, client_node: Node) -> bool:
+        """Removes client_node from the registry
+        A client can be removed by both its own handler and a broadcast failing to send to it,
+        so returns False instead of raising when the client was already removed
+        """
+
+        with self._lock:
+            if self._clients.pop(client_node.connection_id, None) is None:
+                return False
+            self._snapshot = None
+        return True
+
+    def get(self, connection_id: int) -> Node | None:
+        return self._clients.get(connection_id)
+
+    def snapshot(self) -> tuple[Node, ...]:
+        """Returns all clients as a tuple
+        The tuple is shared by all callers until the registry is changed, so it must not be modified
+        """
+
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = tuple(self._clients.values())
+                snapshot = self._snapshot
+        return snapshot
@@ -1,14 +1,57 @@
+import logging
+import struct
+import zlib
 from enum import StrEnum
 
-# Header size constants
+from server_logging import log_event
+
+# Protocol versions, every connection starts with v1 and can negotiate v2 with a PROTOCOL packet
+PROTOCOL_V1 = 1
+PROTOCOL_V2 = 2
+LATEST_PROTOCOL_VERSION = PROTOCOL_V2
+# Seconds a client waits for the reply to its PROTOCOL packet, servers older than protocol versions never reply
+PROTOCOL_REPLY_TIMEOUT = 3.0
+# The only account of servers older than protocol versions, v1 clients send its password right after the name
+V1_PASSWORD_ACCOUNT = "admin"
+
+# Header size constants of protocol v1
 MSG_LEN_HEADER_SIZE = 5
 MSG_TYPE_HEADER_SIZE = 10
 HEADER_SIZE = MSG_LEN_HEADER_SIZE + MSG_TYPE_HEADER_SIZE
+# Largest message body length fitting in the length header of protocol v1
+V1_MAX_MESSAGE_SIZE = 10 ** MSG_LEN_HEADER_SIZE - 1
+
+# Header of protocol v2, unsigned 32 bit message length and 1 byte message type code, big endian
+V2_HEADER = struct.Struct("!IB")
+V2_HEADER_SIZE = V2_HEADER.size
+# Max message body size accepted in protocol v2, protects from huge allocations
+V2_MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+
+# Compression of v2 message bodies, used when both sides list ZLIB_CAPABILITY in their PROTOCOL packets
+ZLIB_CAPABILITY = "zlib"
+# Set on the type code of a v2 header when the message body is zlib compressed
+COMPRESSED_FLAG = 0x80
+# Bodies smaller than this are sent as they are, compressing them costs more than it saves
+COMPRESSION_THRESHOLD = 512
+COMPRESSION_LEVEL = 6
+
+# Body of FILE_CHUNK packets, unsigned 32 bit transfer id followed by the bytes of the file
+FILE_CHUNK_HEADER = struct.Struct("!I")
+# Max number of file bytes sent in a single FILE_CHUNK packet
+FILE_CHUNK_SIZE = 64 * 1024
+# Max characters of usernames and room names, their utf-8 must fit the u16 lengths of chat log records and bus packets
+MAX_NAME_LENGTH = 32
 
 # Error messages
 CONN_ERROR = "Connection Broken"
 INVALID_MSG_LEN_ERROR = "Invlaid message length received"
+MSG_TOO_LONG_ERROR = "Message is too long for the protocol version"
+FILE_V1_ERROR = "Files can only be sent with protocol v2"
 WRONG_PASSWORD_ERROR = "WRONG_PASSWORD"
+# Sent as an INFO packet in reply to the NAME packet of a username with an account
+PASSWORD_REQUIRED = "PASSWORD_REQUIRED"
+INVALID_ROOM_NAME_ERROR = "Invalid room name"
+INVALID_NAME_ERROR = "Invalid username"
 
 # listen = listening type, recv = received type
 WRONG_PACKET_MSG = "Expected {listen} packet, but received {recv} packet"
@@ -19,17 +62,131 @@ class MessageType(StrEnum):
     INFO = "INFO"  # "{name} entered the chat" like messages, info messages
     NAME = "NAME"  # for sharing names of clients between server and client
     MESSAGE = "MESSAGE"  # chat messages
-    PASSWORD = "PASSWORD"  # message containing the password for admin auth
+    PASSWORD = "PASSWORD"  # message containing the password of an account
+    PROTOCOL = "PROTOCOL"  # protocol version negotiation, always sent as a v1 packet
+    JOIN = "JOIN"  # client joining the room named in the message
+    LEAVE = "LEAVE"  # client leaving its room, going back to the default room
+    ROOMS = "ROOMS"  # request for the list of rooms, and its reply
+    PING = "PING"  # heartbeat, asks the other side for a PONG
+    PONG = "PONG"  # answer to a PING
+    THROTTLED = "THROTTLED"  # packets of the client are dropped, message is the seconds to wait before sending more
+    FILE = "FILE"  # start of a file transfer, message is "{transfer id} {size} {file name}"
+    FILE_CHUNK = "FILE_CHUNK"  # binary part of a file, see FILE_CHUNK_HEADER, empty means the transfer was aborted
+
+
+# Message type codes used in the header of protocol v2
+MESSAGE_TYPE_CODES: dict[MessageType, int] = {
+    MessageType.INFO: 1,
+    MessageType.NAME: 2,
+    MessageType.MESSAGE: 3,
+    MessageType.PASSWORD: 4,
+    MessageType.PROTOCOL: 5,
+    MessageType.JOIN: 6,
+    MessageType.LEAVE: 7,
+    MessageType.ROOMS: 8,
+    MessageType.PING: 9,
+    MessageType.PONG: 10,
+    MessageType.THROTTLED: 11,
+    MessageType.FILE: 12,
+    MessageType.FILE_CHUNK: 13,
+}
+MESSAGE_TYPES_BY_CODE: dict[int, MessageType] = {code: msg_type for msg_type, code in MESSAGE_TYPE_CODES.items()}
 
 
 # NetworkNode string for type hinting
 NetworkNode = 'NetworkNode'
 
 
+def is_valid_name(name: str) -> bool:
+    """Usernames and room names are 1 to MAX_NAME_LENGTH printable characters, not only spaces"""
+    return 0 < len(name) <= MAX_NAME_LENGTH and name.isprintable() and not name.isspace()
+
+
 def report_wrong_packet(log_msg: str, send_msg: str, client_node: NetworkNode):
-    """Logs log_msg to console and sends the send_msg to client
+    """Logs log_msg and sends the send_msg to client
     To be called when a wrong type of packet is receievd
     """
 
-    print(log_msg)
-    client_node.send_email_message(send_msg)
+    log_event("wrong_packet", logging.WARNING, detail=log_msg)
+    client_node.send_message(send_msg, MessageType.INFO)
+
+
+def parse_protocol_message(message: str) -> tuple[int, set[str]]:
+    """Splits the body of a PROTOCOL packet, e.g. "2 zlib", into the protocol version and the capabilities
+
+    Raises
+    ------
+    ValueError - If the message does not start with a version number
+    """
+
+    protocol_version, *capabilities = message.split() or [""]
+    return int(protocol_version), set(capabilities)
+
+
+def negotiate_protocol(client_node: NetworkNode, request: str):
+    """Replies to a PROTOCOL packet of the client with the version to be used and switches the node to it
+    The highest version supported by both sides is used, the reply is still sent with protocol v1
+    Compression is turned on when the client asked for it and v2 is used, the reply then lists ZLIB_CAPABILITY
+    """
+
+    try:
+        requested_version, capabilities = parse_protocol_message(request)
+        protocol_version = max(PROTOCOL_V1, min(requested_version, LATEST_PROTOCOL_VERSION))
+    except ValueError:
+        protocol_version, capabilities = PROTOCOL_V1, set()
+    compression = protocol_version >= PROTOCOL_V2 and ZLIB_CAPABILITY in capabilities
+
+    reply = f"{protocol_version} {ZLIB_CAPABILITY}" if compression else str(protocol_version)
+    client_node.send_message(reply, MessageType.PROTOCOL)
+    client_node.set_protocol_version(protocol_version)
+    client_node.set_compression(compression)
+
+
+def parse_file_message(message: str) -> tuple[int, int, str]:
+    """Splits the body of a FILE packet into the transfer id, the file size and the file name
+
+    Raises
+    ------
+    ValueError - If the message is not a transfer id and size followed by a name
+    """
+
+    transfer_id, size, file_name = message.split(" ", 2)
+    if not file_name:
+        raise ValueError("Missing file name")
+    return int(transfer_id), int(size), file_name
+
+
+def file_chunk_header(transfer_id: int, data_size: int) -> bytes:
+    """v2 header and transfer id of a FILE_CHUNK packet carrying data_size bytes of the file
+    The bytes of the file follow it as they are, never compressed, so they can be sent straight from a file
+    """
+
+    return V2_HEADER.pack(FILE_CHUNK_HEADER.size + data_size, MESSAGE_TYPE_CODES[MessageType.FILE_CHUNK]) + \
+        FILE_CHUNK_HEADER.pack(transfer_id)
+
+
+def compress_body(body: bytes) -> bytes | None:
+    """Returns the zlib compressed body, None if the body is too small or compressing does not make it smaller"""
+    if len(body) < COMPRESSION_THRESHOLD:
+        return None
+    compressed = zlib.compress(body, COMPRESSION_LEVEL)
+    return compressed if len(compressed) < len(body) else None
+
+
+def decompress_body(body: bytes) -> bytes:
+    """Returns the decompressed body
+
+    Raises
+    ------
+    ValueError - If the body is not valid zlib data, or decompresses to more than V2_MAX_MESSAGE_SIZE bytes
+    """
+
+    decompressor = zlib.decompressobj()
+    try:
+        # max_length stops small packets from expanding into huge allocations
+        data = decompressor.decompress(body, V2_MAX_MESSAGE_SIZE)
+    except zlib.error as e:
+        raise ValueError(f"Invalid compressed message: {e}") from None
+    if decompressor.unconsumed_tail or not decompressor.eof:
+        raise ValueError("Invalid compressed message, it is truncated or over the size limit")
+    return data
@@ -0,0 +1,155 @@
+"""
+Accounts of the chat room servers
+
+Usernames which need a password are listed in a local file, one account per line with its role
+and a salted slow hash of its password, lines starting with # are comments:
+
+admin admin scrypt$16384$8$1$<salt hex>$<hash hex>
+alice moderator pbkdf2_sha256$600000$<salt hex>$<hash hex>
+
+Hashing a password takes tens of milliseconds on purpose, so passwords are verified on a small pool of
+threads (hashlib releases the GIL while hashing) instead of the thread or event loop serving clients.
+Add or replace an account with:
+
+python credentials.py <username> <role>
+"""
+import hashlib
+import logging
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from getpass import getpass
+from secrets import compare_digest, token_bytes
+from sys import argv
+
+from server_logging import log_event
+
+# Cost parameters of new scrypt hashes, n=2**14 and r=8 take 16 MiB of memory per hash
+SCRYPT_N, SCRYPT_R, SCRYPT_P = 2 ** 14, 8, 1
+# Iterations of new pbkdf2 hashes, for Pythons built without scrypt
+PBKDF2_ITERATIONS = 600000
+SALT_SIZE = 16
+# Max number of passwords hashed at once, the rest wait for a free thread
+VERIFY_WORKERS = 2
+
+
+@dataclass
+class Account:
+    username: str
+    role: str
+    password_hash: str
+
+
+def hash_password(password: str, algorithm: str = "scrypt") -> str:
+    """Returns the salted hash of password, in the format stored in the credentials file"""
+    salt = token_bytes(SALT_SIZE)
+    match algorithm:
+        case "scrypt":
+            digest = hashlib.scrypt(password.encode(), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P)
+            return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${digest.hex()}"
+        case "pbkdf2_sha256":
+            digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, PBKDF2_ITERATIONS)
+            return f"pbkdf2_sha256${PBKDF2_ITERATIONS}${salt.hex()}${digest.hex()}"
+    raise ValueError(f"Unknown password hash algorithm {algorithm}")
+
+
+def verify_password(password: str, password_hash: str) -> bool:
+    """Hashes password with the algorithm, parameters and salt of password_hash and compares the hashes
+    Raises ValueError if password_hash is malformed
+    """
+
+    algorithm, *fields = password_hash.split("$")
+    match algorithm, fields:
+        case "scrypt", [n, r, p, salt, expected]:
+            expected = bytes.fromhex(expected)
+            # maxmem leaves room for the hash itself on top of the 128 * n * r bytes scrypt needs
+            digest = hashlib.scrypt(password.encode(), salt=bytes.fromhex(salt), n=int(n), r=int(r), p=int(p),
+                                    maxmem=256 * int(n) * int(r), dklen=len(expected))
+        case "pbkdf2_sha256", [iterations, salt, expected]:
+            expected = bytes.fromhex(expected)
+            digest = hashlib.pbkdf2_hmac("sha256", password.encode(), bytes.fromhex(salt), int(iterations))
+        case _:
+            raise ValueError(f"Malformed password hash of algorithm {algorithm}")
+    return compare_digest(digest, expected)
+
+
+class CredentialStore:
+    """Accounts loaded from the credentials file, and the threads verifying their passwords
+
+    Usernames without an account can be used by anyone without a password
+
+    Methods
+    -------
+    load()
+        Reads the accounts from the credentials file, raises FileNotFoundError if it does not exist
+    requires_password(username) -> bool
+        True if username has an account
+    verify(username, password) -> Future[str | None]
+        Checks the password on the worker threads, the future gives the role of the account or None
+    """
+
+    def __init__(self, path: str, workers: int = VERIFY_WORKERS):
+        self.path = path
+        self.accounts: dict[str, Account] = {}
+        # Threads are only started by the first verification, so the store can be created before forking
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="credentials")
+
+    def load(self):
+        accounts = {}
+        try:
+            with open(self.path, encoding="utf-8") as credentials_file:
+                for line_number, line in enumerate(credentials_file, 1):
+                    line = line.strip()
+                    if not line or line.startswith("#"):
+                        continue
+                    try:
+                        username, role, password_hash = line.split()
+                    except ValueError:
+                        log_event("credentials_error", logging.WARNING, path=self.path, line=line_number,
+                                  detail="Expected username, role and password hash")
+                        continue
+                    accounts[username] = Account(username, role, password_hash)
+        except FileNotFoundError:
+            # Without the file every account could be used without its password
+            log_event("credentials_missing", logging.ERROR, path=self.path, detail="Refusing to start")
+            raise
+        self.accounts = accounts
+        log_event("credentials_loaded", path=self.path, accounts=len(accounts))
+
+    def requires_password(self, username: str) -> bool:
+        return username in self.accounts
+
+    def verify(self, username: str, password: str) -> Future:
+        return self._executor.submit(self._verify, username, password)
+
+    def _verify(self, username: str, password: str) -> str | None:
+        account = self.accounts.get(username)
+        if account is None:
+            return None
+        try:
+            if verify_password(password, account.password_hash):
+                return account.role
+        except ValueError as e:
+            log_event("credentials_error", logging.WARNING, path=self.path, username=username, detail=str(e))
+        return None
+
+
+def set_account(path: str, username: str, role: str, password_hash: str):
+    """Adds the account to the credentials file, replacing the account of the same username"""
+    lines = []
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as credentials_file:
+            lines = [line for line in credentials_file if line.split()[:1] != [username]]
+    lines.append(f"{username} {role} {password_hash}\n")
+    with open(path, "w", encoding="utf-8") as credentials_file:
+        credentials_file.writelines(lines)
+
+
+if __name__ == "__main__":
+    from server import CREDENTIALS_FILE
+
+    if len(argv) != 3:
+        print("Usage: python credentials.py <username> <role>")
+        raise SystemExit(1)
+    set_account(CREDENTIALS_FILE, argv[1], argv[2], hash_password(getpass(f"Password of {argv[1]} - ")))
+    print(f"Saved account {argv[1]} to {CREDENTIALS_FILE}")
@@ -0,0 +1,201 @@
+"""
+File transfers over the chat protocol
+
+A client sends a file to its room as a FILE packet, "{transfer id} {size} {file name}", followed by
+FILE_CHUNK packets carrying the bytes of the file in order, see comms_protocol.py
+
+The server never holds a whole file, or decodes any of it. Every chunk is relayed as soon as it is received:
+its bytes are taken out of the receive buffer, copied into a packet with the transfer id given by the server,
+and that single packet is sent to every member of the room. Transfer ids of clients are only unique per
+connection, so the server gives every transfer its own id.
+Files need protocol v2, v1 packets can not carry binary data
+"""
+import itertools
+import os
+from dataclasses import dataclass
+from typing import BinaryIO
+
+from comms_protocol import FILE_CHUNK_HEADER, FILE_CHUNK_SIZE, file_chunk_header, parse_file_message
+
+# Largest file accepted by the server
+MAX_FILE_SIZE = 1024 ** 3
+# Max number of unfinished transfers of a single client
+MAX_TRANSFERS = 4
+# Longest file name in bytes, most file systems do not allow longer ones
+MAX_FILE_NAME_SIZE = 255
+# Directory files received by clients are saved to
+DOWNLOADS_DIRECTORY = "downloads"
+
+# Transfer ids given by the server, unique among all connections
+_transfer_ids = itertools.count(1)
+
+
+@dataclass
+class Transfer:
+    """File being relayed by the server
+    transfer_id is the id given by the server, remaining is the number of bytes still to be received
+    """
+
+    transfer_id: int
+    room: str
+    file_name: str
+    remaining: int
+
+
+class FileTransfers:
+    """Unfinished transfers of a single client, by the transfer id given by the client
+
+    Methods
+    -------
+    start(message, room) -> Transfer
+        Starts relaying the file announced by a FILE packet to room
+    relay_packet(body) -> tuple[Transfer, bytearray]
+        Packet relaying the FILE_CHUNK packet body to other clients
+    abort() -> list[Transfer]
+        Forgets all unfinished transfers, when the client leaves
+    """
+
+    def __init__(self):
+        self.transfers: dict[int, Transfer] = {}
+
+    def start(self, message: str, room: str) -> Transfer:
+        """Raises ValueError if the FILE packet is invalid, or the client has too many unfinished transfers"""
+        client_transfer_id, size, file_name = parse_file_message(message)
+        if not 0 < size <= MAX_FILE_SIZE:
+            raise ValueError(f"File size must be between 1 and {MAX_FILE_SIZE} bytes")
+        # Receivers save the file under this name, it must be a valid name and not a path
+        if not 0 < len(file_name.encode()) <= MAX_FILE_NAME_SIZE or any(char in file_name for char in "\0/\\"):
+            raise ValueError(f"File name must be 1 to {MAX_FILE_NAME_SIZE} bytes, without NUL, / or \\")
+        if client_transfer_id in self.transfers:
+            raise ValueError(f"Transfer {client_transfer_id} is not finished")
+        if len(self.transfers) >= MAX_TRANSFERS:
+            raise ValueError(f"Only {MAX_TRANSFERS} files can be sent at once")
+
+        transfer = self.transfers[client_transfer_id] = Transfer(next(_transfer_ids), room, file_name, size)
+        return transfer
+
+    def relay_packet(self, body: bytes) -> tuple[Transfer, bytearray]:
+        """Returns the transfer the chunk is part of, and the complete packet to relay it with
+        The bytes of the file are copied from body into the packet, which is shared by all the receivers
+
+        Raises
+        ------
+        ValueError - If the chunk is not part of an unfinished transfer, or is larger than the rest of the file
+                     The chunk is dropped, and the transfer is aborted once the client leaves
+        """
+
+        if len(body) < FILE_CHUNK_HEADER.size:
+            raise ValueError("File chunk without a transfer id")
+        client_transfer_id, = FILE_CHUNK_HEADER.unpack_from(body)
+        transfer = self.transfers.get(client_transfer_id)
+        if transfer is None:
+            raise ValueError(f"Unknown transfer {client_transfer_id}")
+
+        data = memoryview(body)[FILE_CHUNK_HEADER.size:]
+        if not 0 < len(data) <= min(transfer.remaining, FILE_CHUNK_SIZE):
+            raise ValueError(f"Invalid chunk of {len(data)} bytes for transfer {client_transfer_id}")
+
+        transfer.remaining -= len(data)
+        if not transfer.remaining:
+            del self.transfers[client_transfer_id]
+        packet = bytearray(file_chunk_header(transfer.transfer_id, len(data)))
+        packet += data
+        return transfer, packet
+
+    def abort(self) -> list[Transfer]:
+        transfers = list(self.transfers.values())
+        self.transfers.clear()
+        return transfers
+
+
+@dataclass
+class Download:
+    """File being received by a client"""
+
+    path: str
+    sender_name: str | None
+    remaining: int
+
+
+class FileDownloads:
+    """Files being received by a client, written to disk chunk by chunk as they arrive
+
+    Methods
+    -------
+    start(message, sender_name) -> Download
+        Creates the file announced by a FILE packet
+    write_chunk(body) -> Download | None
+        Writes the FILE_CHUNK packet body to its file, returns the download once it is complete or aborted
+
+    Files which can not be created or written raise ValueError, the download is dropped and the connection
+    is not affected, chunks of dropped downloads are ignored
+    """
+
+    def __init__(self, directory: str = DOWNLOADS_DIRECTORY):
+        self.directory = directory
+        self._downloads: dict[int, tuple[Download, BinaryIO]] = {}
+
+    def start(self, message: str, sender_name: str | None) -> Download:
+        """Raises ValueError if the FILE packet is invalid, or the file can not be created"""
+        transfer_id, size, file_name = parse_file_message(message)
+        # Only the base name is used, senders can not write outside the downloads directory
+        base_name = os.path.basename(file_name.replace("\\", "/").replace("\0", "")) or "file"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._free_path(base_name)
+            file = open(path, "wb")
+        except OSError as e:
+            # e.g. a name too long for the file system, servers of other versions may not check it
+            raise ValueError(f"Cannot save file {base_name[:64]!r}: {e.strerror}")
+
+        download = Download(path, sender_name, size)
+        self._downloads[transfer_id] = download, file
+        return download
+
+    def write_chunk(self, body: bytes) -> Download | None:
+        """An empty chunk means the sender left before sending the whole file, its partial file is removed
+        Raises ValueError if the file can not be written
+        """
+
+        if len(body) < FILE_CHUNK_HEADER.size:
+            return None
+        transfer_id, = FILE_CHUNK_HEADER.unpack_from(body)
+        if transfer_id not in self._downloads:
+            # Announced before joining the room
+            return None
+        download, file = self._downloads[transfer_id]
+
+        data = memoryview(body)[FILE_CHUNK_HEADER.size:]
+        try:
+            file.write(data)
+        except OSError as e:
+            # e.g. the disk is full, the partial file is removed and the rest of the file ignored
+            file.close()
+            del self._downloads[transfer_id]
+            os.remove(download.path)
+            raise ValueError(f"Cannot write {download.path}: {e.strerror}")
+        download.remaining -= len(data)
+        if data and download.remaining > 0:
+            return None
+
+        file.close()
+        del self._downloads[transfer_id]
+        if download.remaining:
+            os.remove(download.path)
+        return download
+
+    def close(self):
+        """Closes and removes the files of unfinished downloads"""
+        for download, file in self._downloads.values():
+            file.close()
+            os.remove(download.path)
+        self._downloads.clear()
+
+    def _free_path(self, file_name: str) -> str:
+        """Path in the downloads directory not used by any file, e.g. log (1).txt if log.txt exists"""
+        stem, extension = os.path.splitext(file_name)
+        path = os.path.join(self.directory, file_name)
+        for number in itertools.count(1):
+            if not os.path.exists(path):
+                return path
+            path = os.path.join(self.directory, f"{stem} ({number}){extension}")
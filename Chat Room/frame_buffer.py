@@ -0,0 +1,182 @@
+"""
+Receive buffer for parsing message packets out of a stream of bytes
+
+A single recv_into call usually brings in many packets (or parts of them) at once,
+FrameBuffer keeps the received bytes and hands out complete packets one by one,
+so a packet costs well under one recv syscall under load instead of three
+"""
+import socket
+from typing import Iterator
+
+from comms_protocol import MSG_LEN_HEADER_SIZE, HEADER_SIZE, CONN_ERROR, PROTOCOL_V1, PROTOCOL_V2, V2_HEADER, \
+    V2_HEADER_SIZE, V2_MAX_MESSAGE_SIZE, MESSAGE_TYPES_BY_CODE, COMPRESSED_FLAG, decompress_body
+
+# Frame is a complete packet, (message type, message body bytes)
+Frame = tuple[str, bytes]
+
+# Default number of bytes pulled from the socket by a single recv_into call
+CHUNK_SIZE = 64 * 1024
+
+
+class FrameBuffer:
+    """Per connection buffer of received bytes which parses packets following the protocol
+
+    Received data lives in buffer[start:end], everything before start is already parsed
+    Packets are parsed following `protocol_version`, which can be changed between packets
+
+    Methods
+    -------
+    recv_into(connection)
+        Receives as many bytes as available (up to the free space) from the socket into the buffer
+    feed(data)
+        Adds already received bytes to the buffer
+    next_frame()
+        Returns the next complete packet, or None if more data has to be received
+    frames()
+        Yields all complete packets present in the buffer
+    """
+
+    def __init__(self, chunk_size: int = CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.protocol_version = PROTOCOL_V1
+        self._buffer = bytearray(chunk_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
+
+    def __len__(self):
+        """Number of received bytes which are not parsed yet"""
+        return self._end - self._start
+
+    def recv_into(self, connection: socket.socket) -> int:
+        """Receives data from the connection into the free space of the buffer
+
+        Raises
+        ------
+        socket.error - On connection errors, or when the peer closed the connection
+        """
+
+        self._make_room(self.chunk_size)
+        received = connection.recv_into(self._view[self._end:])
+        # recv returns 0 bytes only when the peer has closed the connection
+        if received == 0:
+            raise ConnectionResetError(CONN_ERROR)
+        self._end += received
+        return received
+
+    def feed(self, data: bytes):
+        """Adds data received by other means (e.g. asyncio) to the buffer"""
+        self._make_room(len(data))
+        self._view[self._end:self._end + len(data)] = data
+        self._end += len(data)
+
+    def next_frame(self) -> Frame | None:
+        """Parses the next packet in the buffer
+        Returns None if the complete packet has not been received yet
+
+        Raises
+        ------
+        ValueError - On invalid msg length, the buffered data is dropped as packet boundaries are lost
+                     On invalid compressed body or message type, only the bad packet is dropped
+        """
+
+        if self.protocol_version == PROTOCOL_V2:
+            return self._next_frame_v2()
+        return self._next_frame_v1()
+
+    def _next_frame_v1(self) -> Frame | None:
+        """Parses the next packet with a v1 header, 5 ASCII digits of length and 10 characters of type"""
+        if len(self) < HEADER_SIZE:
+            return None
+
+        header_end = self._start + HEADER_SIZE
+        try:
+            message_length = int(bytes(self._view[self._start:self._start + MSG_LEN_HEADER_SIZE]))
+            if message_length < 0:
+                raise ValueError(f"Negative message length {message_length}")
+        except ValueError:
+            self.clear()
+            raise
+
+        if not self._is_body_complete(header_end, message_length):
+            return None
+
+        # The packet is taken before decoding its type, so an undecodable type does not stay in the buffer
+        type_header = bytes(self._view[self._start + MSG_LEN_HEADER_SIZE:header_end])
+        message_body = self._take_body(header_end, message_length)
+        return type_header.decode().strip(), message_body
+
+    def _next_frame_v2(self) -> Frame | None:
+        """Parses the next packet with a v2 header, packed length and type code, see comms_protocol.V2_HEADER"""
+        if len(self) < V2_HEADER_SIZE:
+            return None
+
+        message_length, type_code = V2_HEADER.unpack_from(self._buffer, self._start)
+        if message_length > V2_MAX_MESSAGE_SIZE:
+            self.clear()
+            raise ValueError(f"Message length {message_length} is over the limit")
+
+        header_end = self._start + V2_HEADER_SIZE
+        if not self._is_body_complete(header_end, message_length):
+            return None
+
+        # Unknown codes are passed on as the code itself, to be reported like any other unexpected packet
+        message_type = MESSAGE_TYPES_BY_CODE.get(type_code & ~COMPRESSED_FLAG, str(type_code))
+        message_body = self._take_body(header_end, message_length)
+        if type_code & COMPRESSED_FLAG:
+            message_body = decompress_body(message_body)
+        return message_type, message_body
+
+    def _is_body_complete(self, body_start: int, message_length: int) -> bool:
+        """Checks if the whole body of the packet is buffered
+        If it is not, makes sure the whole packet fits, so it can be completed by the next recv_into calls
+        """
+
+        if self._end - body_start >= message_length:
+            return True
+        self._make_room(body_start - self._start + message_length - len(self))
+        return False
+
+    def _take_body(self, body_start: int, message_length: int) -> bytes:
+        """Returns the body of the packet and marks the packet as parsed"""
+        self._start = body_start + message_length
+        message_body = bytes(self._view[body_start:self._start])
+        # Nothing is left to parse, so the space grown for a large packet can be given back
+        if self._start == self._end:
+            self.clear()
+        return message_body
+
+    def frames(self) -> Iterator[Frame]:
+        """Yields all complete packets available in the buffer"""
+        while (frame := self.next_frame()) is not None:
+            yield frame
+
+    def clear(self):
+        """Drops all buffered data, and shrinks the buffer back to chunk_size if it grew for a large packet"""
+        self._start = self._end = 0
+        if len(self._buffer) > self.chunk_size:
+            # The memoryview must be released before its buffer can be replaced
+            self._view.release()
+            self._buffer = bytearray(self.chunk_size)
+            self._view = memoryview(self._buffer)
+
+    def _make_room(self, size: int):
+        """Ensures at least `size` bytes are free after the buffered data
+        Moves the unparsed data to the front of the buffer, and grows the buffer if it is still too small
+        """
+
+        if len(self._buffer) - self._end >= size:
+            return
+
+        pending = len(self)
+        if pending + size <= len(self._buffer):
+            self._view[:pending] = self._view[self._start:self._end]
+        else:
+            # The memoryview must be released before its buffer can be replaced
+            grown = bytearray(max(pending + size, 2 * len(self._buffer)))
+            grown[:pending] = self._view[self._start:self._end]
+            self._view.release()
+            self._buffer = grown
+            self._view = memoryview(self._buffer)
+
+        self._start, self._end = 0, pending
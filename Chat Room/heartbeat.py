@@ -0,0 +1,111 @@
+"""
+Heartbeats and idle timeouts
+
+Connections whose peer vanished without closing them (machine turned off, NAT entry dropped) never
+receive anything again, so they would hold a client slot (and a thread with server.py) forever.
+IdleReaper pings clients which have been silent for a while, any packet counts as a sign of life,
+and disconnects clients which stay silent until the idle timeout
+"""
+import asyncio
+import logging
+import threading
+from time import monotonic, sleep
+
+from client_registry import ClientRegistry
+from comms_protocol import MessageType
+from metrics import idle_clients_reaped
+from server_logging import log_event
+
+# NetworkNode or AsyncNetworkNode, string for type hinting
+Node = 'NetworkNode | AsyncNetworkNode'
+
+
+def handle_heartbeat(client_node: Node, message_type: str) -> bool:
+    """Answers PING packets with a PONG packet, PONG packets need no answer
+    Returns False if the packet was not a heartbeat
+    """
+
+    match message_type:
+        case MessageType.PING.value:
+            client_node.send_message("", MessageType.PONG)
+        case MessageType.PONG.value:
+            pass
+        case _:
+            return False
+    return True
+
+
+class IdleReaper:
+    """Pings clients silent for ping_after seconds, and disconnects clients silent for idle_timeout seconds
+
+    Clients are pinged once per silence, so idle_timeout should leave them time to answer
+
+    Methods
+    -------
+    check()
+        Pings and disconnects idle clients once
+    run()
+        Checks clients every check_interval seconds from a daemon thread, for server.py
+    run_async()
+        Checks clients every check_interval seconds on the event loop, for async_server.py
+    """
+
+    def __init__(self, clients: ClientRegistry, ping_after: float, idle_timeout: float,
+                 check_interval: float | None = None):
+        self.clients = clients
+        self.ping_after = ping_after
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval if check_interval is not None else ping_after / 4
+        # When idle clients were last pinged, by connection id
+        self._pinged_at: dict[int, float] = {}
+        # Connection ids of disconnected clients which have not been removed from clients yet
+        self._reaped: set[int] = set()
+
+    def check(self):
+        now = monotonic()
+        pinged_at = {}
+        reaped = set()
+        for c_node in self.clients.snapshot():
+            if c_node.connection_id in self._reaped:
+                # Already disconnected, its thread or task has not removed it yet
+                reaped.add(c_node.connection_id)
+                continue
+
+            idle = now - c_node.last_received
+            if idle >= self.idle_timeout:
+                log_event("idle_timeout", logging.WARNING, address=c_node.address, idle_seconds=round(idle, 1))
+                idle_clients_reaped.inc()
+                reaped.add(c_node.connection_id)
+                # Thread or task of the client notices the closed connection and cleans up
+                c_node.disconnect()
+            elif idle >= self.ping_after:
+                last_ping = self._pinged_at.get(c_node.connection_id)
+                # Only ping once until the client is heard from again
+                if last_ping is None or last_ping < c_node.last_received:
+                    last_ping = now
+                    try:
+                        c_node.send_message("", MessageType.PING)
+                    except OSError:
+                        c_node.disconnect()
+                pinged_at[c_node.connection_id] = last_ping
+        # Forget clients which answered or left
+        self._pinged_at = pinged_at
+        self._reaped = reaped
+
+    def run(self) -> threading.Thread:
+        """Starts checking clients from a daemon thread, returns the thread"""
+
+        def check_forever():
+            while True:
+                sleep(self.check_interval)
+                self.check()
+
+        thread = threading.Thread(target=check_forever, daemon=True)
+        thread.start()
+        return thread
+
+    async def run_async(self):
+        """Checks clients until cancelled"""
+        while True:
+            await asyncio.sleep(self.check_interval)
+            self.check()
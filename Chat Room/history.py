@@ -0,0 +1,59 @@
+"""
+Recent chat history of rooms
+
+Keeps the last few chat messages of every room in memory as SharedPackets, which hold the already encoded bytes,
+so clients entering a room are sent what they missed in a single write without encoding anything again
+"""
+import threading
+from collections import OrderedDict, deque
+
+from node import SharedPacket
+
+
+class ChatHistory:
+    """Thread safe ring buffers of recent chat messages, one per room
+
+    Memory is bounded: every room keeps at most max_messages messages, and only the
+    max_rooms most recently used rooms keep a history
+
+    Methods
+    -------
+    record(room, message_packet)
+        Adds a message to the history of room, dropping the oldest one if the history is full
+    replay_packet(room, client_node) -> bytes
+        All the messages in the history of room encoded for client_node as a single buffer
+    """
+
+    def __init__(self, max_messages: int = 50, max_rooms: int = 1000):
+        self.max_messages = max_messages
+        self.max_rooms = max_rooms
+        self._rooms: OrderedDict[str, deque[SharedPacket]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, room: str, message_packet: SharedPacket):
+        with self._lock:
+            messages = self._rooms.get(room)
+            if messages is None:
+                messages = self._rooms[room] = deque(maxlen=self.max_messages)
+                # Forget the history of the least recently used room
+                if len(self._rooms) > self.max_rooms:
+                    self._rooms.popitem(last=False)
+            else:
+                self._rooms.move_to_end(room)
+            messages.append(message_packet)
+
+    def replay_packet(self, room: str, client_node) -> bytes:
+        """Returns the history of room encoded for the protocol version of client_node
+        Messages too long for the protocol version of client_node are left out
+        """
+
+        with self._lock:
+            message_packets = tuple(self._rooms.get(room, ()))
+
+        encoded_packets = []
+        for message_packet in message_packets:
+            try:
+                encoded_packets.append(message_packet.encode_for(client_node))
+            except ValueError:
+                continue
+        return b"".join(encoded_packets)
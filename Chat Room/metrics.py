@@ -0,0 +1,177 @@
+"""
+Metrics of the chat room servers
+
+Counters, gauges and histograms updated on the hot paths of the nodes and servers,
+and a small HTTP server exposing them in the Prometheus text format on a local port:
+
+curl http://127.0.0.1:9090/metrics
+
+Updating a metric only takes a lock around an addition, gauges are computed when the stats are read
+"""
+import logging
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+from server_logging import log_event
+
+# Upper bounds (seconds) of the buckets of latency histograms
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+# Upper bounds of the buckets of size histograms, e.g. number of clients a broadcast is sent to
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Counter:
+    """Monotonically increasing count, e.g. of received bytes"""
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1):
+        with self._lock:
+            self.value += amount
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter", f"{self.name} {self.value}"]
+
+
+class Gauge:
+    """Current value of something, read from a function only when the stats are rendered"""
+
+    def __init__(self, name: str, description: str, function: Callable[[], float]):
+        self.name = name
+        self.description = description
+        self.function = function
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} gauge",
+                f"{self.name} {self.function()}"]
+
+
+class Histogram:
+    """Distribution of observed values, counted in buckets with fixed upper bounds"""
+
+    def __init__(self, name: str, description: str, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        # Last count is for values over the largest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def render(self) -> list[str]:
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        # Buckets are cumulative, every bucket counts all values up to its bound
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        cumulative += counts[-1]
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {cumulative}')
+        lines.append(f"{self.name}_sum {total}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """All metrics of a process, in the order they were registered
+
+    Methods
+    -------
+    counter(name, description) -> Counter
+    gauge(name, description, function) -> Gauge
+    histogram(name, description, buckets) -> Histogram
+        Create and register a metric
+    render() -> str
+        All metrics in the Prometheus text format
+    """
+
+    def __init__(self):
+        self.metrics: dict[str, Counter | Gauge | Histogram] = {}
+
+    def _register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, description: str) -> Counter:
+        return self._register(Counter(name, description))
+
+    def gauge(self, name: str, description: str, function: Callable[[], float]) -> Gauge:
+        return self._register(Gauge(name, description, function))
+
+    def histogram(self, name: str, description: str, buckets: tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, description, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Metrics of this process, shared by the nodes and the server
+metrics = MetricsRegistry()
+
+frames_received = metrics.counter("chat_frames_received_total", "Message packets received")
+bytes_received = metrics.counter("chat_bytes_received_total", "Bytes received from connections")
+packets_sent = metrics.counter("chat_packets_sent_total", "Buffers of one or more message packets sent or queued")
+bytes_sent = metrics.counter("chat_bytes_sent_total", "Bytes of message packets sent or queued")
+connections = metrics.counter("chat_connections_total", "Accepted connections")
+auth_failures = metrics.counter("chat_auth_failures_total", "Failed admin authentications")
+idle_clients_reaped = metrics.counter("chat_idle_clients_reaped_total",
+                                      "Clients disconnected for being silent too long")
+broadcast_seconds = metrics.histogram("chat_broadcast_seconds", "Time taken to send a broadcast to a room")
+broadcast_fanout = metrics.histogram("chat_broadcast_fanout", "Clients a broadcast was sent to", SIZE_BUCKETS)
+
+
+class StatsRequestHandler(BaseHTTPRequestHandler):
+    """Serves the rendered metrics on GET /metrics (or /)"""
+
+    def do_GET(self):
+        if self.path not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+
+        body = metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes are not worth a line of output each
+        pass
+
+
+def start_stats_server(host: str, port: int) -> ThreadingHTTPServer | None:
+    """Serves the metrics over HTTP from a daemon thread
+    Returns None if the port can not be used, the chat server keeps running without stats
+    """
+
+    try:
+        stats_server = ThreadingHTTPServer((host, port), StatsRequestHandler)
+    except OSError as e:
+        log_event("stats_error", logging.WARNING, host=host, port=port, error=e.strerror)
+        return None
+
+    stats_server.daemon_threads = True
+    threading.Thread(target=stats_server.serve_forever, daemon=True).start()
+    log_event("stats_listening", url=f"http://{host}:{port}/metrics")
+    return stats_server
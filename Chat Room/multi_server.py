@@ -0,0 +1,146 @@
+"""
+Multi-process chat room server
+
+Forks a number of worker processes, each running the asyncio server of async_server.py with its own
+event loop and GIL. All workers listen on the same port with SO_REUSEPORT, so the kernel spreads
+connecting clients between them, and broadcast encoding and socket work scale with the number of cores
+
+Each worker only knows about its own clients, so every broadcast is also relayed to the other workers
+over a bus of Unix domain sockets (see worker_bus.py), which broadcast it to their members of the room.
+Rooms listed by ROOMS packets only count the members held by the worker of the client
+
+Needs fork and SO_REUSEPORT, i.e. Linux or BSD
+"""
+import asyncio
+import os
+import signal
+import socket
+from itertools import combinations
+
+import async_server
+from chat_log import ChatLog
+from server_logging import log_event, setup_logging
+from worker_bus import WorkerBus
+from chat_service import HOST, PORT, NO_CLIENT_ID, CREDENTIALS_FILE, STATS_PORT, LOG_LEVEL, \
+    LOG_SAMPLE_RATES, load_credentials
+from comms_protocol import MessageType
+
+# Number of worker processes, one per core
+WORKERS = os.cpu_count() or 1
+
+
+def deliver_broadcast(room: str, sender_name: str | None, message: str, message_type: MessageType):
+    """Broadcasts a message relayed by another worker to the members of room held by this worker"""
+    message_packet = async_server.service.broadcast_message(room, (NO_CLIENT_ID,), sender_name, message,
+                                                            message_type, relay=False)
+    # Every worker keeps the history of all rooms, so it can be replayed to its own clients
+    if message_type == MessageType.MESSAGE:
+        async_server.service.history.record(room, message_packet)
+
+
+async def serve_worker(host: str, port: int, peer_sockets: list[socket.socket]):
+    """Serves clients until the main process stops the worker with SIGTERM"""
+    stopping = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stopping.set)
+
+    bus = WorkerBus(peer_sockets)
+    await bus.start(deliver_broadcast)
+    async_server.service.bus = bus
+
+    serving = asyncio.create_task(async_server.serve(host, port, reuse_port=True))
+    stop_waiter = asyncio.create_task(stopping.wait())
+    await asyncio.wait((serving, stop_waiter), return_when=asyncio.FIRST_COMPLETED)
+    if serving.done():
+        # Serving failed, e.g. the port is taken by another program
+        stop_waiter.cancel()
+        serving.result()
+
+    # Disconnect the clients and the other workers, so their tasks end normally before the loop is closed
+    serving.cancel()
+    bus.close()
+    for client_node in async_server.service.clients.snapshot():
+        client_node.writer.close()
+    pending = asyncio.all_tasks() - {asyncio.current_task()}
+    if pending:
+        await asyncio.wait(pending, timeout=1)
+
+
+def run_worker(worker_id: int, host: str, port: int, peer_sockets: list[socket.socket]):
+    """Runs a worker process until it is terminated by the main process"""
+    # Workers are stopped by the main process, so Ctrl+C in a terminal does not hit them twice
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Messages are only logged by the worker of their sender, each worker has its own log
+    chat_log_directory = async_server.service.chat_log.directory
+    async_server.service.chat_log = ChatLog(os.path.join(chat_log_directory, f"worker{worker_id}"))
+    # Logging threads are started after forking, threads do not survive a fork
+    log_listener = setup_logging(LOG_LEVEL, LOG_SAMPLE_RATES)
+    log_event("worker_started", worker_id=worker_id, pid=os.getpid())
+    load_credentials(async_server.service.credentials, log_listener)
+    # Every worker serves its own metrics, worker N on STATS_PORT + N
+    async_server.start_stats(STATS_PORT + worker_id)
+
+    try:
+        asyncio.run(serve_worker(host, port, peer_sockets))
+    finally:
+        # Write out the messages still queued for the chat log, and the events still queued for logging
+        async_server.service.chat_log.close()
+        log_listener.stop()
+
+
+def run_server(host: str = HOST, port: int = PORT, workers: int = WORKERS):
+    """Runs the multi-process chat room server, returns once all the workers exited"""
+    # Checked before forking, workers without their accounts would let anyone use them
+    if not os.path.isfile(CREDENTIALS_FILE):
+        raise SystemExit(f"Cannot start without the credentials file {CREDENTIALS_FILE}")
+
+    # One socket pair for every pair of workers, created before forking so both workers inherit it
+    bus_sockets = {pair: socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+                   for pair in combinations(range(workers), 2)}
+
+    worker_pids = []
+    for worker_id in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            # Keep the end of every pair this worker is part of, the other end belongs to the peer
+            peer_sockets = []
+            for (first, second), (first_end, second_end) in bus_sockets.items():
+                if worker_id == first:
+                    peer_sockets.append(first_end)
+                    second_end.close()
+                elif worker_id == second:
+                    peer_sockets.append(second_end)
+                    first_end.close()
+                else:
+                    first_end.close()
+                    second_end.close()
+
+            try:
+                run_worker(worker_id, host, port, peer_sockets)
+            finally:
+                os._exit(0)
+        worker_pids.append(pid)
+
+    # The sockets are only used by the workers
+    for first_end, second_end in bus_sockets.values():
+        first_end.close()
+        second_end.close()
+
+    def stop_workers(signum, frame):
+        for worker_pid in worker_pids:
+            try:
+                os.kill(worker_pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    log_listener = setup_logging(LOG_LEVEL, LOG_SAMPLE_RATES)
+    # Interrupting or terminating the main process stops all the workers, which then exit cleanly
+    signal.signal(signal.SIGINT, stop_workers)
+    signal.signal(signal.SIGTERM, stop_workers)
+    for pid in worker_pids:
+        os.waitpid(pid, 0)
+    log_event("workers_exited")
+    log_listener.stop()
+
+
+if __name__ == "__main__":
+    run_server()
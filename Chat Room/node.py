@@ -2,9 +2,23 @@
 Protocol for communication:
 For sending/receiving data, NetworkNode first sends/recieves message length
 of size `MSG_LEN_HEADER_SIZE` and then message type and then message email_body
+
+Protocol v2 replaces the header with a packed binary length and type code, see comms_protocol.py
+and can compress large message bodies when both sides agree to
+
+Received data is kept in a FrameBuffer, see frame_buffer.py
+Sent data can go through an OutboundQueue written by its own thread, see outbound_queue.py
 """
 import socket
-from comms_protocol import MessageType, MSG_LEN_HEADER_SIZE, MSG_TYPE_HEADER_SIZE
+import threading
+from time import monotonic
+from typing import BinaryIO
+from comms_protocol import MessageType, MSG_LEN_HEADER_SIZE, MSG_TYPE_HEADER_SIZE, PROTOCOL_V1, PROTOCOL_V2, \
+    V2_HEADER, MESSAGE_TYPE_CODES, V1_MAX_MESSAGE_SIZE, V2_MAX_MESSAGE_SIZE, MSG_TOO_LONG_ERROR, COMPRESSED_FLAG, \
+    FILE_CHUNK_SIZE, FILE_V1_ERROR, compress_body, file_chunk_header
+from frame_buffer import FrameBuffer
+from outbound_queue import OutboundQueue, OverflowPolicy
+from metrics import frames_received, bytes_received, packets_sent, bytes_sent
 
 
 class NetworkNode:
@@ -12,8 +26,23 @@ class NetworkNode:
     All methods execpt property peer_address raise socket.error if any connection error occurs
     """
 
-    def __init__(self, connection: socket.socket):
+    def __init__(self, connection: socket.socket, address: tuple[str, int] | None = None):
         self.connection = connection
+        # Remote address is cached, so it is known without a syscall, even after the connection breaks
+        self.address = address if address is not None else self.peer_address
+        # Set when the node is added to a ClientRegistry, see client_registry.py
+        self.connection_id: int | None = None
+        self.frame_buffer = FrameBuffer()
+        # Version of the protocol used for both sending and receiving, see set_protocol_version
+        self.protocol_version = PROTOCOL_V1
+        # Compress large message bodies sent with protocol v2, see set_compression
+        self.compression = False
+        # Time (monotonic) data was last received, tells how long the peer has been silent, see heartbeat.py
+        self.last_received = monotonic()
+        # When set, packets are queued and sent by the writer thread of the queue
+        self.outbound_queue: OutboundQueue | None = None
+        # Keeps packets sent from different threads without an outbound queue from interleaving
+        self._send_lock = threading.Lock()
 
     @property
     def peer_address(self):
@@ -23,37 +52,109 @@ class NetworkNode:
         except OSError:
             return None
 
-    def recv(self, size: int) -> str:
-        """Receieve data of size `size`"""
-        return self.connection.recv(size).decode()
-
     def recv_message(self) -> tuple[str, str]:
-        """Receives complete message packets, returns message type and message email_body
+        """Receives complete message packets, returns message type and message body
 
-        Following communication protocol, receives message length, message type and message email_body
-        until complete message email_body of that length is received
+        Following communication protocol, parses message length, message type and message body
+        out of the frame buffer, receiving data in large chunks only when no complete packet is buffered
 
         Raises
         ------
         ValueError - On invalid msg length
         """
 
-        message_body = ""
-        # Receive message length header, and listen for data accordingly
-        message_length = int(self.recv(MSG_LEN_HEADER_SIZE))  # May raise ValueError
-        # Receive message type header
-        message_type = self.recv(MSG_TYPE_HEADER_SIZE)
-        # Receive message body according to message length
-        while len(message_body) < message_length:
-            received_message = self.recv(message_length - len(message_body))
-            message_body += received_message
+        message_type, message_body = self.recv_frame()
+        # Body is decoded only once complete, so multi-byte characters split between recv calls stay intact
+        return message_type, message_body.decode().strip()
 
-        return message_type.strip(), message_body.strip()
+    def recv_frame(self) -> tuple[str, bytes]:
+        """Receives a complete message packet like recv_message, but returns the message body as bytes
+        For packets whose body is not text, e.g. FILE_CHUNK
+        """
+
+        frame = self.frame_buffer.next_frame()  # May raise ValueError
+        while frame is None:
+            bytes_received.inc(self.frame_buffer.recv_into(self.connection))
+            self.last_received = monotonic()
+            frame = self.frame_buffer.next_frame()
+
+        frames_received.inc()
+        return frame
 
     def send(self, data: str):
         """Sends data"""
         self.connection.sendall(data.encode())
 
+    def send_packet(self, message_packet: bytes):
+        """Sends an already encoded message packet, see encode_message
+        Only queues the packet if the node has an outbound queue
+        """
+
+        packets_sent.inc()
+        bytes_sent.inc(len(message_packet))
+        if self.outbound_queue is not None:
+            self.outbound_queue.put(message_packet)
+        else:
+            with self._send_lock:
+                self.connection.sendall(message_packet)
+
+    def send_file(self, file: BinaryIO, transfer_id: int, size: int):
+        """Sends size bytes of file from its current position as the FILE_CHUNK packets of transfer_id
+        The bytes of the file are sent with socket.sendfile, so they are not copied through Python
+        Not for nodes with an outbound queue, every packet would wait for the writer thread
+
+        Raises
+        ------
+        ValueError - If the node does not use protocol v2
+        """
+
+        if self.protocol_version != PROTOCOL_V2:
+            raise ValueError(FILE_V1_ERROR)
+        offset = file.tell()
+        for chunk_offset in range(offset, offset + size, FILE_CHUNK_SIZE):
+            chunk_size = min(FILE_CHUNK_SIZE, offset + size - chunk_offset)
+            # Lock is held per chunk, so heartbeats from other threads can be sent between chunks
+            with self._send_lock:
+                self.connection.sendall(file_chunk_header(transfer_id, chunk_size))
+                self.connection.sendfile(file, chunk_offset, chunk_size)
+            packets_sent.inc()
+            bytes_sent.inc(chunk_size)
+
+    def start_outbound_queue(self, max_size: int, overflow_policy: OverflowPolicy, coalesce_delay: float = 0.0,
+                             coalesce_bytes: int = 64 * 1024, max_bytes: int | None = None):
+        """Sends all following packets through a bounded queue drained by a writer thread, see outbound_queue.py
+
+        Packets waiting in the queue are always flushed together, with coalesce_delay > 0 the writer also
+        waits up to coalesce_delay seconds (or until coalesce_bytes are queued) for more packets to flush together
+        The queue holds at most max_size packets and max_bytes bytes, overflow_policy decides what happens beyond
+        """
+
+        self.outbound_queue = OutboundQueue(self.connection, max_size, overflow_policy, coalesce_delay, coalesce_bytes,
+                                            max_bytes)
+
+    def set_nodelay(self, enabled: bool):
+        """Enables or disables TCP_NODELAY, i.e. disables or enables Nagle's algorithm on the connection
+        Nagle's algorithm should be disabled when coalescing writes, so packets are not delayed twice
+        """
+
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(enabled))
+
+    def disconnect(self):
+        """Shuts down the connection from any thread
+        The thread receiving from the connection wakes up with an error and can clean up, see close
+        """
+
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def close(self):
+        """Stops the writer thread if any and closes the connection"""
+        if self.outbound_queue is not None:
+            self.outbound_queue.close()
+        self.connection.close()
+
     def send_message(self, message_body: str, message_type: MessageType):
         """Sends a message to the remote connection
         Adds header to message before sending
@@ -62,8 +163,20 @@ class NetworkNode:
         sends a packet containing header and message email_body
         """
 
-        message_packet = self.add_header(message_body, message_type.value)
-        self.send(message_packet)
+        self.send_packet(self.encode_message(message_body, message_type.value, self.protocol_version,
+                                             self.compression))
+
+    def set_protocol_version(self, protocol_version: int):
+        """Switches sending and receiving of the following packets to protocol_version"""
+        self.protocol_version = protocol_version
+        self.frame_buffer.protocol_version = protocol_version
+
+    def set_compression(self, enabled: bool):
+        """Turns compression of large message bodies on or off for the following v2 packets
+        Compressed packets are always accepted when receiving v2 packets
+        """
+
+        self.compression = enabled
 
     @staticmethod
     def add_header(message_body: str, message_type: str) -> str:
@@ -77,3 +190,60 @@ class NetworkNode:
         message_type = f"{message_type:<{MSG_TYPE_HEADER_SIZE}}"
         message_packet = message_length + message_type + message_body
         return message_packet
+
+    @staticmethod
+    def encode_message(message_body: str, message_type: str, protocol_version: int = PROTOCOL_V1,
+                       compression: bool = False) -> bytes:
+        """Encodes a message into the bytes of a complete message packet following the protocol
+        With compression, v2 bodies over COMPRESSION_THRESHOLD bytes are sent compressed if that makes them smaller
+
+        The same packet can be sent to any number of nodes using the same protocol version,
+        so a message sent to many clients only has to be encoded once, see SharedPacket
+
+        Raises
+        ------
+        ValueError - If the message body does not fit in a packet of the protocol version
+        """
+
+        body = message_body.encode()
+        if protocol_version == PROTOCOL_V2:
+            # Checked before compressing, receivers also refuse bodies decompressing to more
+            if len(body) > V2_MAX_MESSAGE_SIZE:
+                raise ValueError(MSG_TOO_LONG_ERROR)
+            type_code = MESSAGE_TYPE_CODES[message_type]
+            compressed_body = compress_body(body) if compression else None
+            if compressed_body is not None:
+                body, type_code = compressed_body, type_code | COMPRESSED_FLAG
+            return V2_HEADER.pack(len(body), type_code) + body
+
+        if len(body) > V1_MAX_MESSAGE_SIZE:
+            raise ValueError(MSG_TOO_LONG_ERROR)
+        header = f"{len(body):<{MSG_LEN_HEADER_SIZE}}{message_type:<{MSG_TYPE_HEADER_SIZE}}".encode()
+        return header + body
+
+
+class SharedPacket:
+    """One or more messages sent as a single packet buffer to many nodes
+
+    The messages are encoded (and compressed) lazily, at most once for every protocol version
+    and compression setting in use, and the same bytes object is sent to every node using them
+    """
+
+    def __init__(self, *messages: tuple[str, MessageType]):
+        self.messages = messages
+        self._encoded: dict[tuple[int, bool], bytes] = {}
+
+    def encode_for(self, node: NetworkNode) -> bytes:
+        """Returns the encoded packets for the protocol version and compression setting of node
+
+        Raises
+        ------
+        ValueError - If a message does not fit in a packet of the protocol version of node
+        """
+        encoding = (node.protocol_version, node.compression)
+        packet = self._encoded.get(encoding)
+        if packet is None:
+            packet = b"".join(NetworkNode.encode_message(message_body, message_type.value, *encoding)
+                              for message_body, message_type in self.messages)
+            self._encoded[encoding] = packet
+        return packet
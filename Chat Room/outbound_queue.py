@@ -0,0 +1,196 @@
+"""
+Bounded outbound packet queues
+
+Each connected client gets its own OutboundQueue drained by a writer thread,
+so sending to a client only appends to its queue and never waits for the client to read,
+one slow client can no longer stall broadcasts to everyone else
+
+The writer sends all packets waiting in the queue with a single sendmsg (scatter/gather) call,
+and can optionally wait a few milliseconds for more packets to gather before flushing
+"""
+import socket
+import threading
+from collections import deque
+from time import monotonic
+from enum import StrEnum, auto
+
+from comms_protocol import CONN_ERROR
+
+# Error message used when a client is disconnected for not reading its messages
+SLOW_CONSUMER_ERROR = "Disconnected slow consumer"
+# Max number of packets flushed by a single sendmsg call, stays well below IOV_MAX of common platforms
+MAX_FLUSH_PACKETS = 512
+
+
+def send_packets(connection: socket.socket, packets: list[bytes]):
+    """Sends all packets with as few syscalls as possible, like sendall for a list of buffers
+    Falls back to joining the packets on platforms without sendmsg (Windows)
+    """
+
+    if not hasattr(connection, "sendmsg"):
+        connection.sendall(b"".join(packets))
+        return
+
+    buffers = [memoryview(packet) for packet in packets]
+    first = 0  # index of the first buffer not sent completely
+    while first < len(buffers):
+        sent = connection.sendmsg(buffers[first:first + MAX_FLUSH_PACKETS])
+        # Skip the buffers which were sent completely, and the sent part of a partially sent buffer
+        while first < len(buffers) and sent >= len(buffers[first]):
+            sent -= len(buffers[first])
+            first += 1
+        if sent:
+            buffers[first] = buffers[first][sent:]
+
+
+class OverflowPolicy(StrEnum):
+    """Enum for what to do when a packet is queued on a full queue"""
+    DROP_OLDEST = auto()  # Discard the oldest queued packet to make room for the new one
+    DISCONNECT = auto()  # Disconnect the client, it is not keeping up with the chat
+
+
+class OutboundQueue:
+    """Bounded queue of encoded packets written to a socket by a dedicated writer thread
+
+    All packets of a connection must be sent through its queue once it exists,
+    so packets from different threads never interleave on the socket
+
+    Attributes
+    ----------
+    connection : socket.socket
+        socket the packets are written to
+    max_size : int
+        max number of packets which can wait in the queue
+    max_bytes : int | None
+        max number of bytes which can wait in the queue or be in the middle of being sent, None does not limit bytes
+    overflow_policy : OverflowPolicy
+        what to do with a packet when the queue is full, by packets or by bytes
+    coalesce_delay : float
+        seconds the writer waits for more packets before flushing, 0 flushes right away
+    coalesce_bytes : int
+        number of queued bytes which trigger a flush without waiting for coalesce_delay
+
+    Methods
+    -------
+    put(packet)
+        Queues a packet to be written by the writer thread
+    close()
+        Stops the writer thread, packets still in the queue are discarded
+    """
+
+    def __init__(self, connection: socket.socket, max_size: int = 1024,
+                 overflow_policy: OverflowPolicy = OverflowPolicy.DISCONNECT,
+                 coalesce_delay: float = 0.0, coalesce_bytes: int = 64 * 1024, max_bytes: int | None = None):
+        self.connection = connection
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.overflow_policy = overflow_policy
+        self.coalesce_delay = coalesce_delay
+        self.coalesce_bytes = coalesce_bytes
+        self.dropped_packets = 0
+        self.closed = False
+
+        self._packets: deque[bytes] = deque()
+        self._queued_bytes = 0
+        # Bytes taken from the queue by the writer and not sent yet, they count against max_bytes too
+        self._sending_bytes = 0
+        self._condition = threading.Condition()
+        self._writer = threading.Thread(target=self._write_packets, daemon=True)
+        self._writer.start()
+
+    def __len__(self):
+        return len(self._packets)
+
+    def put(self, packet: bytes):
+        """Queues a packet, never blocks
+
+        Raises
+        ------
+        socket.error - If the queue is closed, or the client was disconnected by the overflow policy
+        """
+
+        with self._condition:
+            if self.closed:
+                raise ConnectionResetError(CONN_ERROR)
+
+            if self._is_full(len(packet)):
+                if self.overflow_policy == OverflowPolicy.DISCONNECT:
+                    self._disconnect()
+                    raise ConnectionAbortedError(SLOW_CONSUMER_ERROR)
+                while self._packets and self._is_full(len(packet)):
+                    self._queued_bytes -= len(self._packets.popleft())
+                    self.dropped_packets += 1
+
+            self._packets.append(packet)
+            self._queued_bytes += len(packet)
+            self._condition.notify()
+
+    def _is_full(self, packet_size: int) -> bool:
+        """Checks if there is no room for a packet of packet_size bytes, the condition lock must be held by the caller
+        A single packet larger than max_bytes still fits once nothing else is waiting to be sent
+        """
+
+        if len(self._packets) >= self.max_size:
+            return True
+        waiting_bytes = self._queued_bytes + self._sending_bytes
+        return self.max_bytes is not None and waiting_bytes > 0 and waiting_bytes + packet_size > self.max_bytes
+
+    def close(self):
+        """Stops the writer thread, packets still in the queue are discarded"""
+        with self._condition:
+            self.closed = True
+            self._packets.clear()
+            self._queued_bytes = 0
+            self._condition.notify()
+
+    def _disconnect(self):
+        """Closes the queue and shuts down the connection
+        Shutting down wakes up the thread receiving from the connection so it can clean up the client
+        """
+
+        self.closed = True
+        self._packets.clear()
+        self._queued_bytes = 0
+        self._condition.notify()
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _take_packets(self) -> list[bytes]:
+        """Takes the packets to be flushed next, the condition lock must be held by the caller"""
+        count = min(len(self._packets), MAX_FLUSH_PACKETS)
+        packets = [self._packets.popleft() for _ in range(count)]
+        self._sending_bytes = sum(map(len, packets))
+        self._queued_bytes -= self._sending_bytes
+        return packets
+
+    def _wait_to_coalesce(self):
+        """Waits up to coalesce_delay for coalesce_bytes to be queued, the condition lock must be held by the caller"""
+        deadline = monotonic() + self.coalesce_delay
+        while not self.closed and self._queued_bytes < self.coalesce_bytes:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                return
+            self._condition.wait(remaining)
+
+    def _write_packets(self):
+        """Writer thread, flushes queued packets until the queue is closed or the connection breaks"""
+        while True:
+            with self._condition:
+                # Packets taken last time were all sent
+                self._sending_bytes = 0
+                while not self._packets and not self.closed:
+                    self._condition.wait()
+                if self.coalesce_delay > 0:
+                    self._wait_to_coalesce()
+                if self.closed:
+                    return
+                packets = self._take_packets()
+
+            try:
+                send_packets(self.connection, packets)
+            except OSError:
+                with self._condition:
+                    self._disconnect()
+                return
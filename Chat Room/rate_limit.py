@@ -0,0 +1,144 @@
+"""
+Rate limiting of client packets with token buckets
+
+Every packet a client sends after entering the chat takes a token from the bucket of its connection,
+and from the bucket of its username if usernames are limited too. Buckets hold up to `burst` tokens and
+refill at `rate` tokens per second, so short bursts are fine but a client can not keep flooding the server.
+Packets arriving at an empty bucket are dropped, and the client is told with a THROTTLED packet
+
+File chunks are limited by their bytes instead, and are never dropped, the server stops reading from the client
+until its file bucket has refilled, so TCP slows the sender down without losing parts of the file
+"""
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+
+class TokenBucket:
+    """Thread safe token bucket, starts full"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, tokens: float = 1.0) -> float:
+        """Takes tokens from the bucket
+        Returns 0 if they were taken, else the seconds to wait until the bucket has enough tokens
+        """
+
+        with self._lock:
+            self._refill(monotonic())
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0.0
+            return (tokens - self.tokens) / self.rate
+
+    def consume(self, tokens: float) -> float:
+        """Takes tokens from the bucket even when it does not have enough, leaving it in debt
+        Returns the seconds to wait until the debt is paid back, 0 if there was no debt
+        """
+
+        with self._lock:
+            self._refill(monotonic())
+            self.tokens -= tokens
+            return max(0.0, -self.tokens / self.rate)
+
+    def give_back(self, tokens: float = 1.0):
+        """Returns tokens taken for a packet which was dropped anyway"""
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + tokens)
+
+
+class ClientRateLimit:
+    """Buckets a single client takes a token from for every packet
+
+    Attributes
+    ----------
+    buckets : tuple[TokenBucket, ...]
+        bucket of the connection, followed by the bucket of the username if usernames are limited
+    file_bucket : TokenBucket
+        bucket of the bytes of file chunks sent by the connection
+    throttled : bool
+        True while packets of the client are being dropped, so it is told only once
+    """
+
+    def __init__(self, buckets: tuple[TokenBucket, ...], file_bucket: TokenBucket):
+        self.buckets = buckets
+        self.file_bucket = file_bucket
+        self.throttled = False
+
+    def take(self) -> float:
+        """Takes a token from every bucket
+        Returns 0 if the packet is allowed, else the seconds to wait before sending another one
+        """
+
+        for index, bucket in enumerate(self.buckets):
+            retry_after = bucket.take()
+            if retry_after:
+                # All buckets or none, the packet is dropped
+                for taken_bucket in self.buckets[:index]:
+                    taken_bucket.give_back()
+                return retry_after
+        self.throttled = False
+        return 0.0
+
+    def pace_file(self, chunk_size: int) -> float:
+        """Takes the bytes of a file chunk, returns the seconds to wait before receiving more from the client"""
+        return self.file_bucket.consume(chunk_size)
+
+
+class RateLimiter:
+    """Creates the rate limits of clients, and keeps the buckets of usernames shared by all their connections
+
+    Attributes
+    ----------
+    rate, burst : float
+        refill rate (tokens per second) and size of the bucket of every connection
+    user_rate, user_burst : float | None
+        same for the bucket of every username, None to not limit usernames
+    file_rate, file_burst : float
+        bytes per second of file chunks every connection can send, and how many it can send at once
+    max_users : int
+        number of username buckets kept, the least recently used ones are forgotten
+
+    Methods
+    -------
+    for_client(username) -> ClientRateLimit
+        Rate limit for a new connection of username
+    """
+
+    def __init__(self, rate: float, burst: float, user_rate: float | None = None, user_burst: float | None = None,
+                 file_rate: float = 4 * 1024 * 1024, file_burst: float = 1024 * 1024, max_users: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.user_rate = user_rate
+        self.user_burst = user_burst if user_burst is not None else burst
+        self.file_rate = file_rate
+        self.file_burst = file_burst
+        self.max_users = max_users
+        self._user_buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def for_client(self, username: str) -> ClientRateLimit:
+        buckets = [TokenBucket(self.rate, self.burst)]
+        if self.user_rate is not None:
+            buckets.append(self._user_bucket(username))
+        return ClientRateLimit(tuple(buckets), TokenBucket(self.file_rate, self.file_burst))
+
+    def _user_bucket(self, username: str) -> TokenBucket:
+        with self._lock:
+            bucket = self._user_buckets.get(username)
+            if bucket is None:
+                bucket = self._user_buckets[username] = TokenBucket(self.user_rate, self.user_burst)
+                if len(self._user_buckets) > self.max_users:
+                    self._user_buckets.popitem(last=False)
+            else:
+                self._user_buckets.move_to_end(username)
+            return bucket
@@ -0,0 +1,96 @@
+"""
+Chat rooms
+
+Every client is a member of exactly one room, starting in DEFAULT_ROOM
+Each room keeps its own index of members, so broadcasting in a room only touches the sockets of its members
+no matter how many clients are connected to the server
+"""
+import threading
+from typing import TypeVar, Generic
+
+from comms_protocol import is_valid_name
+
+# Any node class, NetworkNode or AsyncNetworkNode, it must have a connection_id attribute
+Node = TypeVar("Node")
+
+# Room every client is in after entering the chat, and goes back to after leaving a room
+DEFAULT_ROOM = "lobby"
+
+
+class ChatRooms(Generic[Node]):
+    """Thread safe membership index of chat rooms
+
+    Rooms are created when the first member joins and deleted when the last member leaves
+
+    Methods
+    -------
+    join(client_node, room) -> str | None
+        Moves a client to room, returns the room it was in before
+    remove(client_node) -> str | None
+        Removes a client from its room, returns the room it was in
+    room_of(client_node) -> str | None
+        Gets the room of a client
+    members(room) -> tuple
+        Immutable tuple of the members of a room, safe to iterate while clients come and go
+    room_sizes() -> dict[str, int]
+        Number of members of every room
+    """
+
+    def __init__(self):
+        self._members: dict[str, dict[int, Node]] = {}
+        self._room_of: dict[int, str] = {}
+        self._lock = threading.Lock()
+        # Cached results of members(), a room is missing when it changed after its tuple was built
+        self._snapshots: dict[str, tuple[Node, ...]] = {}
+
+    @staticmethod
+    def is_valid_name(room: str) -> bool:
+        return is_valid_name(room)
+
+    def join(self, client_node: Node, room: str) -> str | None:
+        """Moves client_node to room, returns the room it was in before, None if it was in no room"""
+        with self._lock:
+            previous_room = self._remove(client_node)
+            self._members.setdefault(room, {})[client_node.connection_id] = client_node
+            self._room_of[client_node.connection_id] = room
+            self._snapshots.pop(room, None)
+        return previous_room
+
+    def remove(self, client_node: Node) -> str | None:
+        """Removes client_node from its room, returns the room it was in, None if it was in no room"""
+        with self._lock:
+            return self._remove(client_node)
+
+    def room_of(self, client_node: Node) -> str | None:
+        return self._room_of.get(client_node.connection_id)
+
+    def members(self, room: str) -> tuple[Node, ...]:
+        """Returns the members of room as a tuple
+        The tuple is shared by all callers until the room is changed, so it must not be modified
+        """
+
+        snapshot = self._snapshots.get(room)
+        if snapshot is None:
+            with self._lock:
+                snapshot = tuple(self._members.get(room, {}).values())
+                # Rooms are deleted once empty, caching their snapshot would keep them forever
+                if room in self._members:
+                    self._snapshots[room] = snapshot
+        return snapshot
+
+    def room_sizes(self) -> dict[str, int]:
+        with self._lock:
+            return {room: len(members) for room, members in self._members.items()}
+
+    def _remove(self, client_node: Node) -> str | None:
+        """Removes client_node from its room, the lock must be held by the caller"""
+        room = self._room_of.pop(client_node.connection_id, None)
+        if room is None:
+            return None
+
+        members = self._members[room]
+        del members[client_node.connection_id]
+        if not members:
+            del self._members[room]
+        self._snapshots.pop(room, None)
+        return room
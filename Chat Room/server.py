@@ -1,172 +1,110 @@
+"""
+Thread per client chat room server
+Every client gets a thread receiving its packets and handing them to its ClientSession, see chat_service.py,
+and a writer thread draining its outbound queue, see outbound_queue.py
+"""
 import socket
 import threading
-from secrets import compare_digest
+from concurrent.futures import Future
+from time import sleep
 
 from node import NetworkNode
-from comms_protocol import MessageType, WRONG_PASSWORD_ERROR, report_wrong_packet, INVALID_MSG_LEN_ERROR, \
-    WRONG_PACKET_MSG
-
-# To broadcast the message to all clients and not exclude anyone
-NO_CLIENT_ADDRESS = ("x.x.x.x", 0000)
-# Server address
-HOST, PORT = socket.gethostbyname(socket.gethostname()), 5050
-# Connected/active clients list
-clients: list[NetworkNode] = []
-
-
-def authenticate_name(client_node: NetworkNode, username: str):
-    """Checks username and authenticates if username is admin
-    Returns None if username was not authenticated
-    """
-    log_msg: str = ""
-    error_msg: str = ""
-
-    # No auth required if user is not admin
-    if username != "admin":
-        return username
-
-    # Receive a packet
-    message_type, password = client_node.recv_message()
-
-    # If the packet is not a PASSWORD type packet, then fill error_msg and log_msg
-    if message_type != MessageType.PASSWORD.value:
-        error_msg = WRONG_PACKET_MSG.format(listen=MessageType.PASSWORD.value, recv=message_type)
-        log_msg = f"[{client_node.peer_address}] {error_msg}"
-
-    # If the password is not correct, then fill error_msg and log_msg
-    if not compare_digest(password, "adminpass"):
-        error_msg = WRONG_PASSWORD_ERROR
-        log_msg = f"[{client_node.peer_address}] {error_msg}"
-
-    # If something was wrong, log_msg and error_msg would be reported
-    if log_msg != "" and error_msg != "":
-        report_wrong_packet(log_msg, error_msg, client_node)
-        # return None if auth failed
-        return None
-
-    # If everything was correct then admin is authenticated
-    client_node.send_message("Admin authenticated", MessageType.INFO)
-    return username
-
-
-def get_authenticated_name(client_node: NetworkNode, address: tuple[str, int]):
-    # Keep listening for name until it is received and authenticated, or if an error occurs
-    while True:
-        try:
-            # Receive a packet
-            message_type, username = client_node.recv_message()
-
-            # If the packet is not a NAME type packet, report it
-            if message_type != MessageType.NAME.value:
-                error_msg = WRONG_PACKET_MSG.format(listen="username", recv=message_type)
-                log_msg = f"[{address}] {error_msg}"
-                report_wrong_packet(log_msg, error_msg, client_node)
-                continue
-
-            # Check username and authenticate if necessary
-            username = authenticate_name(client_node, username)
-            # username is None if username did not get authorization
-            # else username is authenticated
-            if username is not None:
-                return username
+from chat_service import ChatService, ClientSession, load_credentials, HOST, PORT, LOG_LEVEL, LOG_SAMPLE_RATES, \
+    STATS_HOST, STATS_PORT
+from outbound_queue import OverflowPolicy
+from server_logging import log_event, setup_logging
+from metrics import metrics, start_stats_server, connections
+
+# Clients, rooms, history, chat log and accounts of this server
+service = ChatService()
+# Max number of packets and bytes waiting to be sent to a client, and what to do when a client falls behind
+# The byte limit bounds the memory held for slow file receivers, like max_write_buffer of the async server
+OUTBOUND_QUEUE_SIZE = 1024
+OUTBOUND_QUEUE_BYTES = 4 * 1024 * 1024
+OVERFLOW_POLICY = OverflowPolicy.DISCONNECT
+# Seconds to wait for more packets to send together to a client, 0 sends as soon as the writer is free
+COALESCE_DELAY = 0.0
+# Number of queued bytes which are sent right away without waiting for COALESCE_DELAY
+COALESCE_BYTES = 64 * 1024
+# Disable Nagle's algorithm, packets are already sent in batches by the outbound queues
+TCP_NODELAY = True
+
 
+def handle_client(connection: socket.socket, address: tuple[str, int]):
+    connections.inc()
+    client_node = NetworkNode(connection, address)
+    client_node.set_nodelay(TCP_NODELAY)
+    client_node.start_outbound_queue(OUTBOUND_QUEUE_SIZE, OVERFLOW_POLICY, COALESCE_DELAY, COALESCE_BYTES,
+                                     OUTBOUND_QUEUE_BYTES)
+    service.clients.add(client_node)
+
+    try:
+        serve_client(ClientSession(service, client_node))
+    finally:
+        service.clients.remove(client_node)
+        service.rooms.remove(client_node)
+        client_node.close()
+
+
+def serve_client(session: ClientSession):
+    """Receives packets from the client until it leaves or is disconnected"""
+    client_node = session.client_node
+    while not session.closed:
+        try:
+            # Receive a packet, its body is only decoded if it is text
+            message_type, message_body = client_node.recv_frame()
+            wait = session.receive(message_type, message_body)
+            # Hashing runs on the credential threads, this thread only waits for the result
+            if isinstance(wait, Future):
+                session.password_checked(wait.result())
+            # Not receiving from the client until its file bucket refills slows the sender down through TCP
+            elif wait:
+                sleep(wait)
         except socket.error as e:
-            clients.remove(client_node)
-            print(e.strerror)
-            return None
+            session.disconnected(e)
         except ValueError:
-            report_wrong_packet(INVALID_MSG_LEN_ERROR, INVALID_MSG_LEN_ERROR, client_node)
+            session.invalid_packet()
 
 
-def recieve_message(client_node: NetworkNode, username: str):
-    # Keep listening for messages until it is received, or an error occurs
-    while True:
-        try:
-            # Receive a packet
-            message_type, chat_message = client_node.recv_message()
-
-            if message_type == MessageType.MESSAGE.value:
-                return chat_message
-
-            # If not a message packet, inform client and log on console of wrong packet type
-            error_msg = WRONG_PACKET_MSG.format(listen=MessageType.MESSAGE.value, recv=message_type)
-            log_msg = f"[{username}] {error_msg}"
-            report_wrong_packet(log_msg, error_msg, client_node)
-
-        except socket.error:
-            clients.remove(client_node)
-            leave_message = f"{username} Left the chat"
-            broadcast_message((client_node.peer_address,), None, leave_message, MessageType.INFO)
-            print(f"[LEFT] {leave_message}")
-            return None
-        except ValueError:
-            log_msg = f"[{username}] {INVALID_MSG_LEN_ERROR}"
-            report_wrong_packet(log_msg, INVALID_MSG_LEN_ERROR, client_node)
+def queue_depths() -> list[int]:
+    return [len(c_node.outbound_queue) for c_node in service.clients.snapshot() if c_node.outbound_queue is not None]
 
 
-def broadcast_message(exclude_addresses: tuple[tuple[str, int]], sender_name: str | None, message: str,
-                      message_type: MessageType = MessageType.MESSAGE):
-    """Send messages to all clients
-    When sender_name is None, sends the message without sending username
-    """
+def start_stats(port: int = STATS_PORT):
+    """Registers the metrics of this server and serves all metrics over HTTP, see metrics.py"""
+    metrics.gauge("chat_connected_clients", "Connected clients", lambda: len(service.clients))
+    metrics.gauge("chat_rooms", "Rooms with at least one member", lambda: len(service.rooms.room_sizes()))
+    metrics.gauge("chat_queued_packets", "Packets waiting in the outbound queues of all clients",
+                  lambda: sum(queue_depths()))
+    metrics.gauge("chat_max_queue_depth", "Packets waiting in the fullest outbound queue",
+                  lambda: max(queue_depths(), default=0))
+    start_stats_server(STATS_HOST, port)
 
-    # Iterate over all active client connections
-    for c_node in clients.copy():
-        try:
-            # Don't broadcast if client in exclude addresses
-            if c_node.peer_address in exclude_addresses:
-                continue
 
-            # If a sender_name is supplied, send the name first
-            if sender_name:
-                c_node.send_message(sender_name, MessageType.NAME)
-            c_node.send_message(message, message_type)
+def run_server(host: str = HOST, port: int = PORT):
+    """Runs the thread per client chat room server, see async_server.py for the asyncio server"""
+    log_listener = setup_logging(LOG_LEVEL, LOG_SAMPLE_RATES)
+    load_credentials(service.credentials, log_listener)
+    start_stats()
+    service.reaper.run()
 
-        except socket.error:
-            print(f"[BROADCAST ERROR] Error when sending to {c_node.peer_address}")
-            clients.remove(c_node)
-            print(f"[AUTOFIX] Removed {c_node.peer_address} from clients list")
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server:
+        server.bind((host, port))
+        server.listen()
+        log_event("listening", host=host, port=port)
 
+        try:
+            while True:
+                client_socket, client_address = server.accept()
+                log_event("connection", address=client_address)
 
-def handle_client(connection: socket.socket, address: tuple[str, int]):
-    client_node = NetworkNode(connection)
-    clients.append(client_node)
-
-    # Receive username
-    username = get_authenticated_name(client_node, address)
-    # If username is None, it means there was a socket.error caught
-    if username is None:
-        return
-    print(f"[NAME] {address}: {username}")
-
-    # Broadcasting join message
-    join_message = f"{username} Entered the chat"
-    # NO_CLIENT_ADDRESS is used to broadcast to all clients
-    broadcast_message((NO_CLIENT_ADDRESS,), None, join_message, MessageType.INFO)
-
-    # Listening for messages from client
-    while True:
-        message = recieve_message(client_node, username)
-        # Message is None if a socket.error was caught
-        if message is None:
-            return
-        # No need to broadcast empty messages
-        if message == "":
-            continue
-
-        # Good message was received
-        print(f"[MESSAGE] {username}: {message}")
-        broadcast_message((address,), username, message)
-
-
-with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as SERVER:
-    SERVER.bind((HOST, PORT))
-    SERVER.listen()
-    print(f"Listening on {HOST}:{PORT}\n")
-
-    while True:
-        client_socket, client_address = SERVER.accept()
-        print(f"[CONNECTION] {client_address}")
-
-        thread = threading.Thread(target=handle_client, args=(client_socket, client_address))
-        thread.start()
+                thread = threading.Thread(target=handle_client, args=(client_socket, client_address))
+                thread.start()
+        finally:
+            # Write out the messages still queued for the chat log, and the events still queued for logging
+            service.chat_log.close()
+            log_listener.stop()
+
+
+if __name__ == "__main__":
+    run_server()
@@ -0,0 +1,89 @@
+"""
+Structured logging of the chat room servers
+
+Logging an event only puts a record on a queue, a background thread formats the records as JSON lines
+and writes them out, so client handlers never wait on stdout however many messages are logged
+
+{"time": 1700000000.123, "level": "INFO", "event": "message", "username": "bob", "room": "lobby", ...}
+
+Frequent events, like every chat message, can be sampled so only a fraction of them is logged
+"""
+import json
+import logging
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from typing import TextIO
+
+# Max number of records waiting to be written, records logged while the queue is full are dropped
+LOG_QUEUE_SIZE = 10000
+
+logger = logging.getLogger("chat")
+# Fraction of the records of an event which are logged, e.g. {"message": 0.01} keeps 1% of messages
+sample_rates: dict[str, float] = {}
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Formats a record as a single line JSON object of its time, level, event and fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {"time": round(record.created, 3), "level": record.levelname, "event": record.getMessage()}
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler which leaves formatting to the listener thread, and drops records when the queue is full"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped_records = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Records never leave the process, so they do not have to be formatted before being queued
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped_records += 1
+
+
+def log_event(event: str, level: int = logging.INFO, **fields):
+    """Logs an event along with its fields, e.g. log_event("name", address=address, username=username)
+    Events filtered out by their level or sample rate are dropped before a record is created
+    """
+
+    sample_rate = sample_rates.get(event)
+    if sample_rate is not None and random.random() >= sample_rate:
+        return
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={"fields": fields})
+
+
+def setup_logging(level: int = logging.INFO, event_sample_rates: dict[str, float] | None = None,
+                  stream: TextIO = sys.stdout) -> QueueListener:
+    """Sends the events of the chat logger through a queue to a background thread writing JSON lines to stream
+    Returns the started listener, stopping it writes out the records still in the queue
+    """
+
+    sample_rates.clear()
+    sample_rates.update(event_sample_rates or {})
+
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    queue_handler = NonBlockingQueueHandler(log_queue)
+
+    stream_handler = logging.StreamHandler(stream)
+    stream_handler.setFormatter(JsonLinesFormatter())
+
+    logger.handlers = [queue_handler]
+    logger.setLevel(level)
+    logger.propagate = False
+
+    listener = QueueListener(log_queue, stream_handler)
+    listener.start()
+    return listener
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Modules of the chat room are imported without a package prefix, like the servers and clients do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
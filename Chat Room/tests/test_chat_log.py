@@ -0,0 +1,66 @@
+from chat_log import ChatLog, INDEX_ENTRY
+
+
+def test_writer_skips_record_it_can_not_encode(tmp_path):
+    chat_log = ChatLog(str(tmp_path))
+    # Name length is stored as u16, a 70 000 byte name does not fit
+    chat_log.append("lobby", "x" * 70000, "lost")
+    chat_log.append("lobby", "bob", "kept")
+    chat_log.close()
+
+    records = list(ChatLog(str(tmp_path)).read_from_sequence(0))
+    assert [(record.sequence, record.username, record.message) for record in records] == [(1, "bob", "kept")]
+
+
+def test_writer_skips_only_bad_records_of_a_batch(tmp_path):
+    chat_log = ChatLog(str(tmp_path))
+    chat_log.append("lobby", "alice", "first")
+    chat_log.append("r" * 70000, "alice", "lost")
+    chat_log.append("lobby", "alice", "last")
+    chat_log.close()
+
+    assert [record.message for record in ChatLog(str(tmp_path)).read_from_sequence(0)] == ["first", "last"]
+
+
+def write_log(directory: str, count: int, **options) -> ChatLog:
+    chat_log = ChatLog(directory, **options)
+    for number in range(count):
+        chat_log.append("lobby", "alice", f"message {number}")
+    chat_log.close()
+    return chat_log
+
+
+def test_log_is_split_into_indexed_segments(tmp_path):
+    write_log(str(tmp_path), 100, segment_bytes=1024, index_interval=128)
+    assert len(list(tmp_path.glob("*.log"))) > 1
+
+    chat_log = ChatLog(str(tmp_path), segment_bytes=1024, index_interval=128)
+    assert [record.sequence for record in chat_log.read_from_sequence(42)] == list(range(42, 100))
+    chat_log.close()
+    # Every full segment indexes more records than its first one
+    index_sizes = [path.stat().st_size for path in sorted(tmp_path.glob("*.index"))]
+    assert all(size > INDEX_ENTRY.size for size in index_sizes[:-1])
+
+
+def test_read_from_time_starts_at_the_first_later_record(tmp_path):
+    write_log(str(tmp_path), 100, segment_bytes=1024, index_interval=128)
+    chat_log = ChatLog(str(tmp_path))
+    records = list(chat_log.read_from_sequence(0))
+    timestamp = records[60].timestamp
+    assert list(chat_log.read_from_time(timestamp)) == [record for record in records if record.timestamp >= timestamp]
+    assert list(chat_log.read_from_time(records[-1].timestamp + 1)) == []
+    chat_log.close()
+
+
+def test_reopened_log_drops_a_half_written_record_and_continues(tmp_path):
+    write_log(str(tmp_path), 10)
+    segment_path = max(tmp_path.glob("*.log"))
+    with open(segment_path, "ab") as segment_file:
+        segment_file.write(b"\x00" * 7)
+
+    chat_log = ChatLog(str(tmp_path))
+    assert chat_log.append("lobby", "bob", "after crash") == 10
+    chat_log.close()
+    records = list(ChatLog(str(tmp_path)).read_from_sequence(0))
+    assert [record.sequence for record in records] == list(range(11))
+    assert records[-1].message == "after crash"
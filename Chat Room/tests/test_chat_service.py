@@ -0,0 +1,98 @@
+import socket
+
+import pytest
+
+from node import NetworkNode
+from chat_service import ChatService, ClientSession, MESSAGE_BURST
+from credentials import hash_password, set_account
+from comms_protocol import MessageType, INVALID_NAME_ERROR, INVALID_ROOM_NAME_ERROR, MAX_NAME_LENGTH, PROTOCOL_V2, \
+    FILE_CHUNK_HEADER, PASSWORD_REQUIRED
+
+
+@pytest.fixture
+def service(tmp_path):
+    credentials_file = tmp_path / "credentials.txt"
+    credentials_file.write_text("")
+    set_account(str(credentials_file), "admin", "admin", hash_password("adminpass"))
+    service = ChatService(str(tmp_path / "chat_log"), str(credentials_file))
+    service.credentials.load()
+    yield service
+    service.chat_log.close()
+
+
+@pytest.fixture
+def connection(service):
+    """Session of a connected client, and the node the client receives with"""
+    server_socket, client_socket = socket.socketpair()
+    client_socket.settimeout(2)
+    server_node, client_node = NetworkNode(server_socket, ("test", 0)), NetworkNode(client_socket, ("test", 0))
+    service.clients.add(server_node)
+    yield ClientSession(service, server_node), client_node
+    server_socket.close()
+    client_socket.close()
+
+
+def test_oversized_name_is_refused(connection):
+    session, client_node = connection
+    session.receive(MessageType.NAME.value, ("x" * 70000).encode())
+    assert client_node.recv_message() == (MessageType.INFO.value, INVALID_NAME_ERROR)
+    assert session.username is None
+
+    session.receive(MessageType.NAME.value, b"bob")
+    assert session.username == "bob"
+    assert client_node.recv_message() == (MessageType.INFO.value, "bob Entered the chat")
+
+
+def test_longest_name_is_accepted(connection):
+    session, client_node = connection
+    session.receive(MessageType.NAME.value, ("é" * MAX_NAME_LENGTH).encode())
+    assert session.username == "é" * MAX_NAME_LENGTH
+
+
+def test_oversized_room_is_refused(service, connection):
+    session, client_node = connection
+    session.receive(MessageType.NAME.value, b"bob")
+    client_node.recv_message()
+
+    session.receive(MessageType.JOIN.value, ("r" * (MAX_NAME_LENGTH + 1)).encode())
+    assert client_node.recv_message() == (MessageType.INFO.value, INVALID_ROOM_NAME_ERROR)
+    assert service.rooms.room_of(session.client_node) == "lobby"
+
+
+def test_invalid_file_chunks_count_towards_the_rate_limit(service, connection):
+    session, client_node = connection
+    session.client_node.set_protocol_version(PROTOCOL_V2)
+    client_node.set_protocol_version(PROTOCOL_V2)
+    session.receive(MessageType.NAME.value, b"bob")
+    client_node.recv_message()
+
+    for _ in range(int(MESSAGE_BURST) + 50):
+        session.receive(MessageType.FILE_CHUNK.value, FILE_CHUNK_HEADER.pack(12345) + b"data")
+    replies = [client_node.recv_message() for _ in range(int(MESSAGE_BURST) + 1)]
+    # Only the burst is answered, then the client is told once to slow down
+    assert all(message_type == MessageType.INFO.value for message_type, _ in replies[:-1])
+    assert replies[-1][0] == MessageType.THROTTLED.value
+    client_node.connection.settimeout(0.1)
+    with pytest.raises(socket.timeout):
+        client_node.recv_message()
+
+
+def test_v2_clients_are_asked_for_the_password(connection):
+    session, client_node = connection
+    session.client_node.set_protocol_version(PROTOCOL_V2)
+    client_node.set_protocol_version(PROTOCOL_V2)
+    session.receive(MessageType.NAME.value, b"admin")
+    assert client_node.recv_message() == (MessageType.INFO.value, PASSWORD_REQUIRED)
+
+    session.password_checked(session.receive(MessageType.PASSWORD.value, b"adminpass").result())
+    assert client_node.recv_message() == (MessageType.INFO.value, "Authenticated as admin")
+    assert session.username == "admin"
+
+
+def test_v1_clients_send_the_password_unasked(connection):
+    session, client_node = connection
+    session.receive(MessageType.NAME.value, b"admin")
+    session.password_checked(session.receive(MessageType.PASSWORD.value, b"adminpass").result())
+    # Clients older than protocol versions take the first packet after the name for the reply to the password
+    assert client_node.recv_message() == (MessageType.INFO.value, "Authenticated as admin")
+    assert session.username == "admin"
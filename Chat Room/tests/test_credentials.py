@@ -0,0 +1,41 @@
+import pytest
+
+from credentials import CredentialStore, hash_password, verify_password, set_account
+
+
+@pytest.mark.parametrize("algorithm", ["scrypt", "pbkdf2_sha256"])
+def test_password_hashes_are_salted_and_verified(algorithm):
+    password_hash = hash_password("secret", algorithm)
+    assert password_hash.startswith(f"{algorithm}$")
+    assert password_hash != hash_password("secret", algorithm)
+    assert verify_password("secret", password_hash)
+    assert not verify_password("Secret", password_hash)
+
+
+@pytest.mark.parametrize("password_hash", ["md5$abc", "scrypt$16384$8$1$00", "plaintext"])
+def test_malformed_hashes_raise(password_hash):
+    with pytest.raises(ValueError):
+        verify_password("secret", password_hash)
+
+
+def test_store_checks_passwords_of_its_accounts(tmp_path):
+    path = str(tmp_path / "credentials.txt")
+    with open(path, "w", encoding="utf-8") as credentials_file:
+        credentials_file.write("# comment\n\nbroken line\nmallory admin md5$abc\n")
+    set_account(path, "alice", "admin", hash_password("old"))
+    set_account(path, "alice", "moderator", hash_password("secret"))
+
+    store = CredentialStore(path)
+    store.load()
+    assert sorted(store.accounts) == ["alice", "mallory"]
+    assert store.requires_password("alice") and not store.requires_password("bob")
+    assert store.verify("alice", "secret").result() == "moderator"
+    assert store.verify("alice", "old").result() is None
+    assert store.verify("bob", "secret").result() is None
+    # A malformed hash never lets anyone in
+    assert store.verify("mallory", "abc").result() is None
+
+
+def test_store_refuses_a_missing_file(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        CredentialStore(str(tmp_path / "missing.txt")).load()
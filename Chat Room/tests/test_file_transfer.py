@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+from frame_buffer import FrameBuffer
+from file_transfer import FileTransfers, FileDownloads, MAX_TRANSFERS
+from comms_protocol import MessageType, PROTOCOL_V2, FILE_CHUNK_HEADER
+
+
+def chunk(transfer_id: int, data: bytes) -> bytes:
+    return FILE_CHUNK_HEADER.pack(transfer_id) + data
+
+
+def test_chunks_are_relayed_with_the_server_transfer_id():
+    transfers = FileTransfers()
+    transfer = transfers.start("7 10 notes.txt", "lobby")
+    assert (transfer.room, transfer.file_name, transfer.remaining) == ("lobby", "notes.txt", 10)
+
+    relayed, packet = transfers.relay_packet(chunk(7, b"0123"))
+    assert relayed is transfer and transfer.remaining == 6
+    frame_buffer = FrameBuffer()
+    frame_buffer.protocol_version = PROTOCOL_V2
+    frame_buffer.feed(packet)
+    assert frame_buffer.next_frame() == (MessageType.FILE_CHUNK.value, chunk(transfer.transfer_id, b"0123"))
+
+    transfers.relay_packet(chunk(7, b"456789"))
+    # The finished transfer is forgotten, its id can be used again
+    assert transfers.transfers == {}
+
+
+@pytest.mark.parametrize("message", ["7 0 empty.txt", "7 10 ../notes.txt", "7 10 dir\\notes.txt", "7 10 ", "7 10"])
+def test_invalid_file_announcements_are_refused(message):
+    with pytest.raises(ValueError):
+        FileTransfers().start(message, "lobby")
+
+
+def test_unfinished_transfers_are_limited():
+    transfers = FileTransfers()
+    for transfer_id in range(MAX_TRANSFERS):
+        transfers.start(f"{transfer_id} 10 notes.txt", "lobby")
+    with pytest.raises(ValueError):
+        transfers.start("0 10 notes.txt", "lobby")
+    with pytest.raises(ValueError):
+        transfers.start(f"{MAX_TRANSFERS} 10 notes.txt", "lobby")
+    assert len(transfers.abort()) == MAX_TRANSFERS
+
+
+@pytest.mark.parametrize("body", [b"", chunk(8, b"data"), chunk(7, b""), chunk(7, b"x" * 11)])
+def test_invalid_chunks_are_refused(body):
+    transfers = FileTransfers()
+    transfers.start("7 10 notes.txt", "lobby")
+    with pytest.raises(ValueError):
+        transfers.relay_packet(body)
+    assert transfers.transfers[7].remaining == 10
+
+
+def test_downloads_stay_in_their_directory(tmp_path):
+    downloads = FileDownloads(str(tmp_path))
+    (tmp_path / "notes.txt").write_text("older")
+    download = downloads.start("3 10 ../../notes.txt", "alice")
+    assert download.path == os.path.join(str(tmp_path), "notes (1).txt")
+
+    assert downloads.write_chunk(chunk(3, b"01234")) is None
+    assert downloads.write_chunk(chunk(3, b"56789")) is download
+    assert (tmp_path / "notes (1).txt").read_bytes() == b"0123456789"
+
+
+def test_aborted_download_is_removed(tmp_path):
+    downloads = FileDownloads(str(tmp_path))
+    download = downloads.start("3 10 notes.txt", "alice")
+    downloads.write_chunk(chunk(3, b"01234"))
+    assert downloads.write_chunk(chunk(3, b"")) is download
+    assert download.remaining == 5
+    assert not os.path.exists(download.path)
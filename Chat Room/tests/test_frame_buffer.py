@@ -0,0 +1,84 @@
+import pytest
+
+from node import NetworkNode
+from frame_buffer import FrameBuffer
+from comms_protocol import MessageType, PROTOCOL_V2, V2_HEADER, V2_MAX_MESSAGE_SIZE, MESSAGE_TYPE_CODES, \
+    COMPRESSED_FLAG
+
+
+def packet(message: str, message_type: MessageType = MessageType.MESSAGE, protocol_version: int = 1,
+           compression: bool = False) -> bytes:
+    return NetworkNode.encode_message(message, message_type.value, protocol_version, compression)
+
+
+@pytest.fixture
+def v2_buffer():
+    frame_buffer = FrameBuffer(chunk_size=64)
+    frame_buffer.protocol_version = PROTOCOL_V2
+    return frame_buffer
+
+
+def test_packets_are_parsed_across_feeds():
+    frame_buffer = FrameBuffer(chunk_size=64)
+    data = packet("bob", MessageType.NAME) + packet("hello")
+    frame_buffer.feed(data[:7])
+    assert frame_buffer.next_frame() is None
+    frame_buffer.feed(data[7:20])
+    assert frame_buffer.next_frame() == ("NAME", b"bob")
+    assert frame_buffer.next_frame() is None
+    frame_buffer.feed(data[20:])
+    assert list(frame_buffer.frames()) == [("MESSAGE", b"hello")]
+    assert len(frame_buffer) == 0
+
+
+def test_compressed_v2_packets_are_decompressed(v2_buffer):
+    message = "compressible " * 100
+    v2_buffer.feed(packet(message, protocol_version=PROTOCOL_V2, compression=True))
+    assert v2_buffer.next_frame() == ("MESSAGE", message.encode())
+
+
+def test_invalid_v1_length_drops_the_buffered_data():
+    frame_buffer = FrameBuffer()
+    frame_buffer.feed(b"abcde" + b"MESSAGE   " + packet("hello"))
+    with pytest.raises(ValueError):
+        frame_buffer.next_frame()
+    assert len(frame_buffer) == 0
+
+
+def test_undecodable_v1_type_drops_only_its_packet():
+    frame_buffer = FrameBuffer()
+    frame_buffer.feed(b"2    " + b"\xff\xfe".ljust(10) + b"hi" + packet("hello"))
+    with pytest.raises(ValueError):
+        frame_buffer.next_frame()
+    assert frame_buffer.next_frame() == ("MESSAGE", b"hello")
+
+
+def test_oversized_v2_length_drops_the_buffered_data(v2_buffer):
+    v2_buffer.feed(V2_HEADER.pack(V2_MAX_MESSAGE_SIZE + 1, MESSAGE_TYPE_CODES["MESSAGE"]) + b"body")
+    with pytest.raises(ValueError):
+        v2_buffer.next_frame()
+    assert len(v2_buffer) == 0
+
+
+def test_invalid_compressed_body_drops_only_its_packet(v2_buffer):
+    v2_buffer.feed(V2_HEADER.pack(4, MESSAGE_TYPE_CODES["MESSAGE"] | COMPRESSED_FLAG) + b"junk")
+    v2_buffer.feed(packet("hello", protocol_version=PROTOCOL_V2))
+    with pytest.raises(ValueError):
+        v2_buffer.next_frame()
+    assert v2_buffer.next_frame() == ("MESSAGE", b"hello")
+
+
+def test_unknown_type_code_is_passed_on(v2_buffer):
+    v2_buffer.feed(V2_HEADER.pack(2, 0x7f) + b"hi")
+    assert v2_buffer.next_frame() == ("127", b"hi")
+
+
+def test_buffer_shrinks_after_a_large_packet(v2_buffer):
+    message = "x" * 10000
+    v2_buffer.feed(packet(message, protocol_version=PROTOCOL_V2))
+    assert len(v2_buffer._buffer) >= 10000
+    assert v2_buffer.next_frame() == ("MESSAGE", message.encode())
+    assert len(v2_buffer._buffer) == 64
+
+    v2_buffer.feed(packet("hello", protocol_version=PROTOCOL_V2))
+    assert v2_buffer.next_frame() == ("MESSAGE", b"hello")
@@ -0,0 +1,70 @@
+import socket
+import threading
+
+import pytest
+
+from outbound_queue import OutboundQueue, OverflowPolicy, send_packets
+
+PACKET_SIZE = 256 * 1024
+
+
+@pytest.fixture
+def connection():
+    """Connected socket pair, the second socket is the client which reads (or does not read) the packets"""
+    server_socket, client_socket = socket.socketpair()
+    client_socket.settimeout(5)
+    yield server_socket, client_socket
+    server_socket.close()
+    client_socket.close()
+
+
+def receive_all(client_socket: socket.socket, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        data += client_socket.recv(size - len(data))
+    return bytes(data)
+
+
+def test_send_packets_sends_everything_in_order(connection):
+    server_socket, client_socket = connection
+    packets = [bytes([number]) * (number * 1000 + 1) for number in range(100)]
+    expected = b"".join(packets)
+    received = []
+    reader = threading.Thread(target=lambda: received.append(receive_all(client_socket, len(expected))))
+    reader.start()
+    send_packets(server_socket, packets)
+    reader.join()
+    assert received == [expected]
+
+
+def test_queued_packets_are_written_in_order(connection):
+    server_socket, client_socket = connection
+    queue = OutboundQueue(server_socket, coalesce_delay=0.01)
+    packets = [f"packet {number};".encode() for number in range(1000)]
+    for packet in packets:
+        queue.put(packet)
+    assert receive_all(client_socket, sum(map(len, packets))) == b"".join(packets)
+    queue.close()
+
+
+def test_full_queue_disconnects_a_slow_client(connection):
+    server_socket, client_socket = connection
+    queue = OutboundQueue(server_socket, max_bytes=4 * PACKET_SIZE)
+    with pytest.raises(ConnectionAbortedError):
+        # The client never reads, so the socket buffers fill up and then the queue
+        for _ in range(1000):
+            queue.put(b"x" * PACKET_SIZE)
+    assert queue.closed
+    with pytest.raises(ConnectionResetError):
+        queue.put(b"late")
+
+
+def test_full_queue_drops_the_oldest_packets(connection):
+    server_socket, client_socket = connection
+    queue = OutboundQueue(server_socket, max_size=4, overflow_policy=OverflowPolicy.DROP_OLDEST)
+    for _ in range(1000):
+        queue.put(b"x" * PACKET_SIZE)
+    assert queue.dropped_packets > 0
+    assert len(queue) <= 4
+    assert not queue.closed
+    queue.close()
@@ -0,0 +1,70 @@
+import pytest
+
+import rate_limit
+from rate_limit import TokenBucket, RateLimiter
+
+
+class Clock:
+    """Replaces the monotonic clock of the rate limiter, moved forward by the tests"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit, "monotonic", clock)
+    return clock
+
+
+def test_bucket_allows_a_burst_then_refills(clock):
+    bucket = TokenBucket(rate=10, burst=3)
+    assert [bucket.take() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.take() == pytest.approx(0.1)
+
+    clock.now += 0.1
+    assert bucket.take() == 0.0
+    # Refills never go over the burst
+    clock.now += 60
+    assert [bucket.take() for _ in range(4)][-1] > 0
+
+
+def test_consume_leaves_the_bucket_in_debt(clock):
+    bucket = TokenBucket(rate=100, burst=100)
+    assert bucket.consume(100) == 0.0
+    assert bucket.consume(50) == pytest.approx(0.5)
+    clock.now += 0.5
+    assert bucket.consume(0) == 0.0
+
+
+def test_dropped_packet_takes_no_token_from_any_bucket(clock):
+    limiter = RateLimiter(rate=10, burst=5, user_rate=1, user_burst=2)
+    first, second = limiter.for_client("alice"), limiter.for_client("alice")
+    assert first.take() == 0.0
+    assert second.take() == 0.0
+    # The username bucket is shared by both connections and is now empty
+    assert first.take() > 0
+    assert first.buckets[0].tokens == 4
+
+    other = limiter.for_client("bob")
+    assert other.take() == 0.0
+
+
+def test_unlimited_usernames_only_have_a_connection_bucket(clock):
+    client = RateLimiter(rate=10, burst=5).for_client("alice")
+    assert len(client.buckets) == 1
+    assert client.pace_file(2 * 1024 * 1024) == pytest.approx(0.25)
+
+
+def test_least_recently_used_username_buckets_are_forgotten(clock):
+    limiter = RateLimiter(rate=10, burst=5, user_rate=1, user_burst=1, max_users=2)
+    limiter.for_client("alice").take()
+    limiter.for_client("bob")
+    limiter.for_client("alice")
+    limiter.for_client("carl")
+    assert list(limiter._user_buckets) == ["alice", "carl"]
+    assert limiter.for_client("alice").take() > 0
@@ -0,0 +1,50 @@
+import asyncio
+import socket
+
+import pytest
+
+from worker_bus import WorkerBus, encode_bus_message, decode_bus_message
+from comms_protocol import MessageType, V2_HEADER, V2_MAX_MESSAGE_SIZE
+
+
+@pytest.mark.parametrize("sender_name", ["alice", None])
+def test_bus_messages_round_trip(sender_name):
+    packet = encode_bus_message("söcial", sender_name, "héllo", MessageType.MESSAGE)
+    length, _ = V2_HEADER.unpack_from(packet)
+    body = packet[V2_HEADER.size:]
+    assert length == len(body)
+    assert decode_bus_message(body) == ("söcial", sender_name, "héllo")
+
+
+def test_oversized_bus_message_is_refused():
+    with pytest.raises(ValueError):
+        encode_bus_message("lobby", "alice", "x" * V2_MAX_MESSAGE_SIZE, MessageType.MESSAGE)
+
+
+def test_broadcasts_reach_the_other_worker():
+    async def exchange():
+        first_socket, second_socket = socket.socketpair(socket.AF_UNIX)
+        first, second = WorkerBus([first_socket]), WorkerBus([second_socket])
+        delivered = []
+        received = asyncio.Event()
+
+        def deliver(*broadcast):
+            delivered.append(broadcast)
+            if len(delivered) == 3:
+                received.set()
+
+        await first.start(lambda *broadcast: None)
+        await second.start(deliver)
+        first.publish("lobby", "alice", "hi", MessageType.MESSAGE)
+        first.publish("lobby", None, "bob Entered the chat", MessageType.INFO)
+        # Too large to relay, only logged
+        first.publish("lobby", "alice", "x" * V2_MAX_MESSAGE_SIZE, MessageType.MESSAGE)
+        first.publish("games", "bob", "x" * 100000, MessageType.MESSAGE)
+        await asyncio.wait_for(received.wait(), 5)
+        first.close()
+        second.close()
+        return delivered
+
+    assert asyncio.run(exchange()) == [("lobby", "alice", "hi", MessageType.MESSAGE),
+                                       ("lobby", None, "bob Entered the chat", MessageType.INFO),
+                                       ("games", "bob", "x" * 100000, MessageType.MESSAGE)]
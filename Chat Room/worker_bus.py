@@ -0,0 +1,99 @@
+"""
+Message bus between the worker processes of multi_server.py
+
+Every pair of workers is connected by a Unix domain socket pair, created before the workers are forked.
+Broadcasts are sent to every other worker as protocol v2 packets, see comms_protocol.py,
+whose body is the room and the sender name followed by the message:
+
+room length (u16) | sender name length (u16) | room | sender name | message
+"""
+import asyncio
+import logging
+import socket
+import struct
+from typing import Callable
+
+from server_logging import log_event
+from frame_buffer import FrameBuffer, CHUNK_SIZE
+from comms_protocol import MessageType, MESSAGE_TYPE_CODES, V2_HEADER, V2_MAX_MESSAGE_SIZE, PROTOCOL_V2, \
+    MSG_TOO_LONG_ERROR
+
+BUS_HEADER = struct.Struct("!HH")
+
+# Called with (room, sender_name, message, message_type) for every broadcast made by another worker
+DeliverCallback = Callable[[str, str | None, str, MessageType], None]
+
+
+def encode_bus_message(room: str, sender_name: str | None, message: str, message_type: MessageType) -> bytes:
+    """Raises ValueError if the packet would be larger than other workers accept"""
+    room_bytes, sender_bytes = room.encode(), (sender_name or "").encode()
+    body = b"".join((BUS_HEADER.pack(len(room_bytes), len(sender_bytes)), room_bytes, sender_bytes, message.encode()))
+    if len(body) > V2_MAX_MESSAGE_SIZE:
+        raise ValueError(MSG_TOO_LONG_ERROR)
+    return V2_HEADER.pack(len(body), MESSAGE_TYPE_CODES[message_type]) + body
+
+
+def decode_bus_message(body: bytes) -> tuple[str, str | None, str]:
+    """Returns room, sender name (None for messages without a sender) and message of a bus packet body"""
+    room_length, sender_length = BUS_HEADER.unpack_from(body)
+    room_end = BUS_HEADER.size + room_length
+    sender_end = room_end + sender_length
+    sender_name = body[room_end:sender_end].decode() or None
+    return body[BUS_HEADER.size:room_end].decode(), sender_name, body[sender_end:].decode()
+
+
+class WorkerBus:
+    """Connections of a worker to all the other workers
+
+    Methods
+    -------
+    start(deliver)
+        Starts receiving broadcasts from the other workers, calling deliver for each of them
+    publish(room, sender_name, message, message_type)
+        Sends a broadcast to all the other workers, never waits
+    close()
+        Closes the connections to the other workers
+    """
+
+    def __init__(self, peer_sockets: list[socket.socket]):
+        self.peer_sockets = peer_sockets
+        self._writers: list[asyncio.StreamWriter] = []
+        self._receivers: list[asyncio.Task] = []
+
+    async def start(self, deliver: DeliverCallback):
+        """Wraps the peer sockets in asyncio streams, must be called from the event loop of the worker"""
+        for peer_socket in self.peer_sockets:
+            reader, writer = await asyncio.open_unix_connection(sock=peer_socket)
+            self._writers.append(writer)
+            self._receivers.append(asyncio.create_task(self._receive(reader, deliver)))
+
+    def publish(self, room: str, sender_name: str | None, message: str, message_type: MessageType):
+        # Encoded once and queued on every peer transport
+        try:
+            bus_packet = encode_bus_message(room, sender_name, message, message_type)
+        except ValueError as e:
+            # Members of room held by other workers miss out on it, like clients of a too old protocol version
+            log_event("bus_error", logging.WARNING, room=room, error=str(e))
+            return
+        for writer in self._writers:
+            if not writer.is_closing():
+                writer.write(bus_packet)
+
+    def close(self):
+        for writer in self._writers:
+            writer.close()
+
+    @staticmethod
+    async def _receive(reader: asyncio.StreamReader, deliver: DeliverCallback):
+        """Receives broadcasts of a single peer worker until it exits"""
+        frame_buffer = FrameBuffer()
+        frame_buffer.protocol_version = PROTOCOL_V2
+        while data := await reader.read(CHUNK_SIZE):
+            frame_buffer.feed(data)
+            try:
+                for message_type, body in frame_buffer.frames():
+                    room, sender_name, message = decode_bus_message(body)
+                    deliver(room, sender_name, message, MessageType(message_type))
+            except ValueError as e:
+                log_event("bus_error", logging.WARNING, error=str(e), detail="Dropped broadcasts of a worker")
+        log_event("bus_closed")
@@ -2,17 +2,17 @@ from ttt_engine import Board
 from ttt_engine.board import evaluate_position
 import cProfile
 import pstats
-from random import randint
+from random import choice
 
 if __name__ == '__main__':
 
     with cProfile.Profile() as pr:
         board = Board(4)
         for i in range(6):
-            # COMPLETE ME
-            board.play_move(randint())
+            board.play_move(*choice(board.grid.get_legal_moves()))
         board.grid.print_grid()
         evaluate_position(board)
+        print(board.search_stats)
 
     stats = pstats.Stats(pr)
     stats.sort_stats(pstats.SortKey.TIME)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# ttt_engine is imported from the game directory, like the games do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,61 @@
+import random
+
+import pytest
+
+from ttt_engine import Board, GameState
+from ttt_engine.grid import Grid, BitboardGrid
+from ttt_engine.state_checker import TTTStateChecker, BitboardStateChecker, IncrementalStateChecker
+
+
+def boards(size: int) -> list[Board]:
+    """Board with the reference checker, followed by boards with the faster ones"""
+    incremental_grid = Grid(size)
+    return [Board(size), Board(size, grid=BitboardGrid(size)),
+            Board(size, state_checker=IncrementalStateChecker(incremental_grid), grid=incremental_grid)]
+
+
+@pytest.mark.parametrize("size", [3, 4, 5])
+def test_fast_checkers_agree_with_the_reference_checker(size):
+    moves = random.Random(size)
+    for _ in range(50):
+        games = boards(size)
+        reference = games[0]
+        while True:
+            row, column = moves.choice(reference.grid.get_legal_moves())
+            for board in games:
+                board.play_move(row, column)
+            mark = reference.get_previous_mark()
+            states = [board.state_checker.check_state(mark) for board in games]
+            assert states == [states[0]] * len(games)
+            if states[0] != GameState.ONGOING:
+                break
+        assert isinstance(reference.state_checker, TTTStateChecker)
+        if states[0] == GameState.WIN:
+            win_data = reference.state_checker.win_data
+            for board in games[1:]:
+                assert board.state_checker.win_data.winner == win_data.winner == mark
+                assert board.state_checker.win_data.win_type == win_data.win_type
+                assert sorted(board.state_checker.win_data.win_line) == sorted(win_data.win_line)
+
+
+def test_incremental_checker_follows_unplayed_moves_and_sync():
+    grid = Grid(3)
+    board = Board(3, state_checker=IncrementalStateChecker(grid), grid=grid)
+    for row, column in ((0, 0), (1, 0), (0, 1), (1, 1), (0, 2)):
+        board.play_move(row, column)
+    assert board.state_checker.check_state("X") == GameState.WIN
+
+    board.play_move(0, 2, unplay_move=True)
+    assert board.state_checker.check_state("X") == GameState.ONGOING
+
+    # Changed without play_move, the checker only sees it after sync
+    grid.update_cell(0, 2, "X")
+    board.sync()
+    assert board.state_checker.check_state("X") == GameState.WIN
+
+
+@pytest.mark.parametrize("checker_class, grid_class", [(BitboardStateChecker, BitboardGrid),
+                                                       (IncrementalStateChecker, Grid)])
+def test_square_checkers_refuse_rectangular_grids(checker_class, grid_class):
+    with pytest.raises(ValueError):
+        checker_class(grid_class(3, 4))
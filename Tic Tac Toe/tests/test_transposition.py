@@ -0,0 +1,57 @@
+from ttt_engine import Board, BitboardGrid
+from ttt_engine.transposition import TranspositionTable, Bound
+
+
+def test_table_forgets_the_least_recently_used_position():
+    table = TranspositionTable(max_entries=2)
+    table.store(1, 1, Bound.EXACT, (0, 0))
+    table.store(2, 0, Bound.LOWER, (1, 1))
+    assert table.get(1).best_move == (0, 0)
+    table.store(3, -1, Bound.UPPER, None)
+    assert len(table) == 2
+    assert table.get(2) is None
+    assert table.get(1).evaluation == 1 and table.get(3).bound == Bound.UPPER
+
+
+def test_transposed_move_orders_reach_the_same_hash():
+    first, second = Board(3), Board(3)
+    for row, column in ((0, 0), (1, 1), (2, 2)):
+        first.play_move(row, column)
+    for row, column in ((2, 2), (1, 1), (0, 0)):
+        second.play_move(row, column)
+    assert first.position_hash == second.position_hash
+
+    # The same marks with the other player to move are a different position
+    second.select_next_player()
+    second.sync()
+    assert first.position_hash != second.position_hash
+
+
+def test_played_and_unplayed_moves_keep_the_hash_of_the_grid():
+    board = Board(4, grid=BitboardGrid(4))
+    start_hash = board.position_hash
+    moves = [(0, 1), (3, 3), (2, 0), (1, 2)]
+    for row, column in moves:
+        board.play_move(row, column)
+    played_hash = board.position_hash
+    board.sync()
+    assert board.position_hash == played_hash
+
+    for row, column in reversed(moves):
+        board.play_move(row, column, unplay_move=True)
+    assert board.position_hash == start_hash
+
+
+def test_ai_move_does_not_change_with_a_filled_table():
+    board = Board(3)
+    board.play_move(0, 0)
+    board.play_move(1, 1)
+    board.play_move(2, 2)
+    board.play_ai_move()
+    first_move = [(row, column) for row in range(3) for column in range(3) if board.grid.get_cell(row, column) == "O"]
+    assert len(board.transposition_table) > 0
+
+    board.play_move(*[move for move in first_move if move != (1, 1)][0], unplay_move=True)
+    board.play_ai_move()
+    second_move = [(row, column) for row in range(3) for column in range(3) if board.grid.get_cell(row, column) == "O"]
+    assert second_move == first_move
@@ -3,5 +3,8 @@
 # Board for playing the game
 from .board import Board
 
+# Faster grid for the AI, Board(size, grid=BitboardGrid(size))
+from .grid import BitboardGrid
+
 # State Data for checking game states
 from .state_data import WinType, GameState
@@ -19,6 +19,10 @@ custom_board.player_index = index_of_whichever_player_you_want_it_to_be
                             OR
 custom_board.fix_player_index()
 
+# Recomputes the position hash of the AI and the counts of incremental state checkers
+# play_ai_move() does it too
+custom_board.sync()
+
 Here custom_board.grid.EMPTY_CELL can be swapped for any mark from the custom_board.players list
 to start from custom positions
 
@@ -28,9 +32,10 @@ See fix_player_index() method's docs
 import copy
 from colorama import Fore
 
-from .grid import Grid, Coordinate
-from .game_ai import minmax, evaluate
-from .state_checker import StateChecker, TTTStateChecker
+from .grid import BitboardGrid, Grid, Coordinate
+from .game_ai import KillerMoves, SearchStats, minmax, evaluate
+from .state_checker import BitboardStateChecker, StateChecker, TTTStateChecker
+from .transposition import TranspositionTable, ZobristHasher
 
 
 class Board:
@@ -53,6 +58,14 @@ class Board:
         Instance of Grid class for managing the grid
     state_checker : StateChecker
         Any subclass of ABC StateChecker to check wins or draws and access Win data
+    position_hash : int
+        Zobrist hash of the marks on the grid and the current player, updated by play_move
+    transposition_table : TranspositionTable
+        Positions already searched by the AI, kept across turns
+    killer_moves : KillerMoves
+        Moves which pruned the search of the AI, tried early in the next searches
+    search_stats : SearchStats
+        Number of positions searched by the last play_ai_move
 
     Methods
     -------
@@ -62,11 +75,14 @@ class Board:
         Plays/unplays a move on the grid and selects the next player
     fix_player_index()
         Selects who's turn to play is it depending upon the number of marks on the grid
+    sync()
+        Computes position_hash and the state checker again, after the grid was changed without play_move
     ai_play()
         AI plays a move on the board with selected player and the board selects the next player
     """
 
-    def __init__(self, size: int = 3, players: list[str] = None, state_checker: StateChecker = None):
+    def __init__(self, size: int = 3, players: list[str] = None, state_checker: StateChecker = None,
+                 grid: Grid = None):
         """Constructor for Board class
 
         Parameters
@@ -77,6 +93,13 @@ class Board:
             Player marks which will be used to update board when making a move
         state_checker : StateChecker
             The class used to check if the game is won or drawn
+        grid : Grid
+            Empty grid to play on, e.g. a BitboardGrid for a faster AI or a Grid(rows, columns) for
+            rectangular grids, size is not used then, a Grid of size if not passed
+
+        Raises
+        ------
+        ValueError - If the grid is rectangular and no state_checker is passed, the default ones need square grids
         """
 
         # player_index is zero_indexed variable for indexing players list
@@ -86,19 +109,40 @@ class Board:
         if players is None:
             players = ["X", "O"]
         self.players: list[str] = players
-
-        self.grid: Grid = Grid(size)
-
-        # If no state_checker is passed, use default state checker of TTT
-        if state_checker is None:
+        self._player_indexes: dict[str, int] = {mark: index for index, mark in enumerate(players)}
+
+        if grid is None:
+            grid = Grid(size)
+        self.grid: Grid = grid
+
+        # If no state_checker is passed, use default state checker of TTT, the bitboard version for bitboards
+        if state_checker is None and self.grid.rows != self.grid.columns:
+            raise ValueError(f"A {self.grid.rows} * {self.grid.columns} grid needs a state_checker, "
+                             "e.g. KInARowStateChecker, the default ones only check square grids")
+        if state_checker is None and isinstance(self.grid, BitboardGrid):
+            state_checker = BitboardStateChecker(self.grid)
+        elif state_checker is None:
             state_checker = TTTStateChecker(self.grid)
         self.state_checker: StateChecker = state_checker
 
+        self.zobrist: ZobristHasher = ZobristHasher(self.grid.rows, self.grid.columns, len(self.players))
+        self.position_hash: int = self.zobrist.turn_keys[self.player_index]
+        self.transposition_table: TranspositionTable = TranspositionTable()
+        self.killer_moves: KillerMoves = KillerMoves()
+        self.search_stats: SearchStats = SearchStats()
+
     def reset(self):
-        """Resets the game to intial state, while keeping game settings like baord size, players and state_checker"""
-        # FIXME : passing self.state_checker does not reset the state checker
-        #  old state checker is still referenced
-        self.__init__(self.grid.size, self.players)
+        """Resets the game to intial state, while keeping game settings like baord size, players and state_checker
+        The transposition table is kept, evaluations of positions do not depend on the game they were reached in
+        """
+
+        self.player_index = 0
+        # Cleared in place, the state checker keeps checking this grid
+        self.grid.grid = [[self.grid.EMPTY_CELL for _ in range(self.grid.columns)] for _ in range(self.grid.rows)]
+        win_data = self.state_checker.win_data
+        win_data.winner, win_data.win_type, win_data.win_line = "", None, []
+        self.search_stats = SearchStats()
+        self.sync()
 
     def play_move(self, row: int, column: int, unplay_move: bool = False):
         # TODO: Implement raising exception when playing a move on an already occupied cell
@@ -113,6 +157,8 @@ class Board:
                 If True, places an EMPTY_CELL mark on the given coordinate
         """
 
+        previous_player_index = self.player_index
+        replaced_mark = self.grid.get_cell(row, column)
         if not unplay_move:
             mark = self.get_current_mark()
             self.select_next_player()
@@ -120,7 +166,16 @@ class Board:
             mark = self.grid.EMPTY_CELL
             self.select_previous_player()
 
+        # Removes the replaced mark and the previous player from the hash, then adds the new ones
+        cell_keys = self.zobrist.cell_keys[row][column]
+        for cell_mark in (replaced_mark, mark):
+            cell_player_index = self._player_indexes.get(cell_mark)
+            if cell_player_index is not None:
+                self.position_hash ^= cell_keys[cell_player_index]
+        self.position_hash ^= self.zobrist.turn_keys[previous_player_index] ^ self.zobrist.turn_keys[self.player_index]
+
         self.grid.update_cell(row, column, mark)
+        self.state_checker.cell_updated(row, column, replaced_mark, mark)
 
     def get_current_mark(self) -> str:
         """Gets the mark of current player"""
@@ -167,8 +222,21 @@ class Board:
 
         raise NotImplementedError("Sorry I was too tired to implement this")
 
+    def sync(self):
+        """Computes position_hash from the grid and player_index, and syncs the state checker with the grid
+        Needed after setting them directly, e.g. in custom setups"""
+        cells = [[self._player_indexes.get(mark) for mark in row] for row in self.grid.grid]
+        self.position_hash = self.zobrist.hash_position(cells, self.player_index)
+        self.state_checker.sync()
+
     def play_ai_move(self):
-        """Use the minmax AI function to get the best move and play it"""
+        """Use the minmax AI function to get the best move and play it
+        Positions searched in earlier turns are looked up in the transposition table instead of searched again
+        """
+
+        # Custom setups change the grid without play_move
+        self.sync()
+        self.search_stats = SearchStats()
         best_move: Coordinate = minmax(self, maximizing=True, evaluating=False)
         self.play_move(best_move[0], best_move[1])
 
@@ -181,6 +249,8 @@ def evaluate_position(board: Board):
 
     str_evaluations: list[str] = []
     legal_moves = board.grid.get_legal_moves()
+    board.sync()
+    board.search_stats = SearchStats()
 
     if board.player_index == 0:
         eval_color_coding = {"+0": Fore.BLUE, "+1": Fore.GREEN, "-1": Fore.RED}
@@ -5,11 +5,13 @@ ttt_engine.game_ai
 AI module for playing the game
 """
 
-from math import inf
+from dataclasses import dataclass
+from functools import lru_cache
 from typing import TypeAlias
 
 from .grid import Coordinate
 from .state_data import GameState
+from .transposition import Bound
 
 Board: TypeAlias = 'Board'
 
@@ -18,6 +20,83 @@ DRAW = 0
 MAXIMIZER_WIN = 1
 MINIMIZER_WIN = -1
 
+# Number of killer moves remembered for every move number
+KILLER_SLOTS = 2
+
+
+@dataclass
+class SearchStats:
+    """Counters of the work done by the AI, reset by Board.play_ai_move
+
+    Attributes
+    ----------
+    nodes : int
+        positions searched, positions found in the transposition table are not counted
+    table_hits : int
+        positions whose evaluation was taken from the transposition table
+    cutoffs : int
+        positions whose remaining moves were pruned, because the opponent would avoid the position anyway
+    """
+
+    nodes: int = 0
+    table_hits: int = 0
+    cutoffs: int = 0
+
+
+class KillerMoves:
+    """Moves which recently pruned the rest of the moves of a position, tried early in positions
+    with the same number of marks on the grid, where they are likely to prune again
+
+    Kept by move number instead of depth of the search, so they stay useful in the following turns
+    """
+
+    def __init__(self):
+        self.moves: dict[int, list[Coordinate]] = {}
+
+    def get(self, move_number: int) -> list[Coordinate]:
+        return self.moves.get(move_number, [])
+
+    def add(self, move_number: int, move: Coordinate):
+        killers = self.moves.setdefault(move_number, [])
+        if move in killers:
+            return
+        killers.insert(0, move)
+        del killers[KILLER_SLOTS:]
+
+
+@lru_cache
+def cell_priorities(rows: int, columns: int) -> dict[Coordinate, tuple[int, int]]:
+    """Static move ordering of a rows * columns grid, cells on more lines (center, then corners) come first
+    and cells nearer to the center break the ties, e.g. center, corners, then edges on a 3 * 3 grid
+    """
+
+    priorities = {}
+    center_row, center_column = (rows - 1) / 2, (columns - 1) / 2
+    for row in range(rows):
+        for column in range(columns):
+            # Every cell is on a row and a column, cells on the diagonals of square grids are on one more line each
+            lines = 2 + (rows == columns) * ((row == column) + (row + column == columns - 1))
+            distance = abs(row - center_row) + abs(column - center_column)
+            priorities[(row, column)] = (-lines, distance)
+    return priorities
+
+
+def order_moves(minmax_board: Board, moves: list[Coordinate], table_move: Coordinate | None) -> list[Coordinate]:
+    """Sorts moves so the ones most likely to be best are searched first, which prunes the most moves:
+    the best move stored in the transposition table, killer moves, then cells on the most lines"""
+
+    priorities = cell_priorities(minmax_board.grid.rows, minmax_board.grid.columns)
+    killers = minmax_board.killer_moves.get(len(priorities) - len(moves))
+
+    def move_priority(move: Coordinate) -> tuple:
+        if move == table_move:
+            return -2, 0, 0
+        if move in killers:
+            return -1, killers.index(move), 0
+        return 0, *priorities[move]
+
+    return sorted(moves, key=move_priority)
+
 
 def minmax(minmax_board: Board, maximizing: bool = True, evaluating: bool = False):
     """ Minmax AI for Tic Tac Toe
@@ -25,6 +104,10 @@ def minmax(minmax_board: Board, maximizing: bool = True, evaluating: bool = Fals
     It uses the Minmax AI Algorithm to either get the best move
     or the current evaluation of the position with best play by both sides
 
+    The search prunes moves with alpha-beta pruning, see search(), and stores every searched position
+    in the transposition table of the board, so positions reached again through other move orders,
+    or in later turns, are not searched again
+
     Parameters
     ----------
     minmax_board : Board
@@ -36,43 +119,99 @@ def minmax(minmax_board: Board, maximizing: bool = True, evaluating: bool = Fals
         When evaluating is False, returns the best move on the board
     """
 
-    min_eval = inf
-    max_eval = -inf
-    best_move: Coordinate | None = None
+    # The table stores evaluations for the player whose turn it is, who is the maximizing player here
+    # only if maximizing is True, the same position can be searched from both sides
+    side = 1 if maximizing else -1
+    entry = minmax_board.transposition_table.get(minmax_board.position_hash)
+    if entry is not None and entry.bound == Bound.EXACT:
+        minmax_board.search_stats.table_hits += 1
+        return side * entry.evaluation if evaluating else entry.best_move
+
+    evaluation, best_move = search(minmax_board, MINIMIZER_WIN, MAXIMIZER_WIN, root=True)
+    return side * evaluation if evaluating else best_move
+
+
+def search(minmax_board: Board, alpha: int, beta: int, root: bool = False) -> tuple[int, Coordinate | None]:
+    """Alpha-beta search of the position, returns its evaluation for the player whose turn it is and the best move
+
+    Moves are only searched until one is found which is at least beta, as the opponent already has a move
+    keeping the evaluation below beta and will never allow this position. Evaluations not between alpha and beta
+    are only bounds, an evaluation of alpha or below is an upper bound and beta or above is a lower bound
+
+    Parameters
+    ----------
+    minmax_board : Board
+        Board to search
+    alpha : int
+        Evaluation the player whose turn it is can already get, through another position
+    beta : int
+        Evaluation the opponent can already keep the player to, through another position
+    root : bool
+        True for the position the AI is asked about, its best move is searched with the whole window
+        even if the transposition table has bounds of its evaluation, so the move is never only a bound
+    """
+
+    table = minmax_board.transposition_table
+    position_hash = minmax_board.position_hash
+    stats = minmax_board.search_stats
+
+    entry = table.get(position_hash)
+    table_move = None
+    if entry is not None:
+        table_move = entry.best_move
+        if entry.bound == Bound.EXACT:
+            stats.table_hits += 1
+            return entry.evaluation, entry.best_move
+        if not root:
+            if entry.bound == Bound.LOWER:
+                alpha = max(alpha, entry.evaluation)
+            else:
+                beta = min(beta, entry.evaluation)
+            if alpha >= beta:
+                stats.table_hits += 1
+                return entry.evaluation, entry.best_move
+    stats.nodes += 1
 
     # BASE CASES
     game_state = minmax_board.state_checker.check_state(minmax_board.get_previous_mark(), update_win_data=False)
 
     if game_state == GameState.WIN:
-        if not evaluating:
-            return best_move
-
-        # If current player is the maximizing player then it means the last player played the winning move
-        # Hence it returns MINIMIZER_WIN as eval, and vice versa
-        return MINIMIZER_WIN if maximizing else MAXIMIZER_WIN
+        # The player who played the previous move won, so the player whose turn it is lost
+        table.store(position_hash, MINIMIZER_WIN, Bound.EXACT, None)
+        return MINIMIZER_WIN, None
 
     if game_state == GameState.DRAW:
-        return DRAW if evaluating else best_move
-
-    # MINMAX ALGORITHM
-    for move in minmax_board.grid.get_legal_moves():
-        evaluation = evaluate(minmax_board, move, not maximizing)
-        if maximizing:
-            if evaluation > max_eval:
-                max_eval = evaluation
-                best_move = move
-            if max_eval == MAXIMIZER_WIN:
-                return max_eval if evaluating else best_move
-        else:
-            if evaluation < min_eval:
-                min_eval = evaluation
-                best_move = move
-            if min_eval == MINIMIZER_WIN:
-                return min_eval if evaluating else best_move
-
-    if evaluating:
-        return max_eval if maximizing else min_eval
-    return best_move
+        table.store(position_hash, DRAW, Bound.EXACT, None)
+        return DRAW, None
+
+    # ALPHA-BETA ALGORITHM
+    legal_moves = minmax_board.grid.get_legal_moves()
+    best_eval = MINIMIZER_WIN - 1
+    best_move: Coordinate | None = None
+    for move in order_moves(minmax_board, legal_moves, table_move):
+        minmax_board.play_move(move[0], move[1])
+        # Evaluation of the opponent is the negative of the evaluation of the player, so is their window
+        evaluation = -search(minmax_board, -beta, -max(alpha, best_eval))[0]
+        minmax_board.play_move(move[0], move[1], unplay_move=True)
+
+        if evaluation > best_eval:
+            best_eval = evaluation
+            best_move = move
+        if best_eval >= beta:
+            stats.cutoffs += 1
+            move_number = minmax_board.grid.rows * minmax_board.grid.columns - len(legal_moves)
+            minmax_board.killer_moves.add(move_number, move)
+            break
+
+    # Bounds at the ends of the evaluation range are exact, nothing is better than a win or worse than a loss
+    if best_eval in (MINIMIZER_WIN, MAXIMIZER_WIN) or alpha < best_eval < beta:
+        bound = Bound.EXACT
+    elif best_eval >= beta:
+        bound = Bound.LOWER
+    else:
+        bound = Bound.UPPER
+    table.store(position_hash, best_eval, bound, best_move)
+    return best_eval, best_move
 
 
 def evaluate(board: Board, move: Coordinate, maximizing: bool):
@@ -5,6 +5,8 @@ ttt_engine.grid
 Grid for keeping track of moves played
 
 Grid class remembers the moves played, and provides methods to get info about cells on the grid
+BitboardGrid remembers them as one integer per player instead, for state checkers and the AI to check
+whole lines of cells at once, see BitboardStateChecker in state_checker.py
 """
 
 from typing import TypeAlias
@@ -24,8 +26,10 @@ class Grid:
     ----------
     EMPTY_CELL : str
         mark of the empty cell to be used while creating the grid and checking empty cells
-    size : str
-        size of the grid, a grid (2D list) will be generated of size * size dimensions
+    size : int
+        number of rows of the grid, and of columns of square grids
+    rows, columns : int
+        dimensions of the grid, a grid (2D list) will be generated of rows * columns dimensions
     grid : list[list[str]]
         the actual grid storing the cells
 
@@ -45,10 +49,12 @@ class Grid:
 
     EMPTY_CELL = "_"
 
-    def __init__(self, size: int):
-        """Generates a new grid of dimensions size * size"""
+    def __init__(self, size: int, columns: int | None = None):
+        """Generates a new grid of dimensions size * size, or size * columns if columns is passed"""
         self.size: int = size
-        self.grid: list[list[str]] = [[Grid.EMPTY_CELL for _ in range(size)] for _ in range(size)]
+        self.rows: int = size
+        self.columns: int = size if columns is None else columns
+        self.grid: list[list[str]] = [[Grid.EMPTY_CELL for _ in range(self.columns)] for _ in range(self.rows)]
 
     def is_empty(self, row: int, column: int) -> bool:
         """Returns True if mark at (row, column) is an empty cell mark, else returns False"""
@@ -86,12 +92,95 @@ class Grid:
 
     def print_grid(self):
         """Prints the grid"""
-        # generates column labels above grid
+        # generates column labels above grid, cells are as wide as the widest label
         # column_label for size 3 -> "1 2 3"
-        column_label = " ".join([str(num + 1) for num in range(self.size)])
+        cell_width = len(str(self.columns))
+        row_label_width = len(str(self.rows))
+        column_label = " ".join([str(num + 1).ljust(cell_width) for num in range(self.columns)])
 
         print()
-        print(f"  {column_label}")
+        print(f"{' ' * row_label_width} {column_label}")
         for index, row in enumerate(self.grid):
-            print(f'{index + 1} {" ".join(row)}')
+            cells = " ".join(mark.ljust(cell_width) for mark in row).rstrip()
+            print(f"{str(index + 1).ljust(row_label_width)} {cells}")
         print()
+
+
+class BitboardGrid(Grid):
+    """Grid storing the cells of every mark as the bits of an integer, a bitboard
+
+    Bit row * columns + column of the mask of a mark is set if the cell at (row, column) has the mark,
+    so a line of cells is a mask too and checking a whole line takes a single AND, see BitboardStateChecker
+
+    It can be used anywhere a Grid is used, the grid attribute is built from the masks when read,
+    and assigning a grid to it (custom setups) builds the masks again
+
+    Attributes
+    ----------
+    masks : dict[str, int]
+        bitboard of every mark which was put on the grid
+    occupied : int
+        bitboard of all non empty cells
+    full_mask : int
+        bitboard with every cell of the grid set
+
+    Methods
+    -------
+    bit(row, column) -> int
+        Bitboard with only the cell at (row, column) set
+    """
+
+    def __init__(self, size: int, columns: int | None = None):
+        self.masks: dict[str, int] = {}
+        self.occupied: int = 0
+        self.full_mask: int = (1 << size * (size if columns is None else columns)) - 1
+        super().__init__(size, columns)
+
+    @property
+    def grid(self) -> list[list[str]]:
+        return [[self.get_cell(row, column) for column in range(self.columns)] for row in range(self.rows)]
+
+    @grid.setter
+    def grid(self, grid: list[list[str]]):
+        self.masks = {}
+        self.occupied = 0
+        for row_num, row in enumerate(grid):
+            for column_num, mark in enumerate(row):
+                self.update_cell(row_num, column_num, mark)
+
+    def bit(self, row: int, column: int) -> int:
+        return 1 << row * self.columns + column
+
+    def is_empty(self, row: int, column: int) -> bool:
+        return not self.occupied & self.bit(row, column)
+
+    def get_cell(self, row: int, column: int) -> str:
+        cell = self.bit(row, column)
+        if self.occupied & cell:
+            for mark, mask in self.masks.items():
+                if mask & cell:
+                    return mark
+        return Grid.EMPTY_CELL
+
+    def update_cell(self, row: int, column: int, mark: str):
+        cell = self.bit(row, column)
+        if self.occupied & cell:
+            for cell_mark, mask in self.masks.items():
+                self.masks[cell_mark] = mask & ~cell
+
+        if mark == Grid.EMPTY_CELL:
+            self.occupied &= ~cell
+        else:
+            self.masks[mark] = self.masks.get(mark, 0) | cell
+            self.occupied |= cell
+
+    def get_legal_moves(self) -> list[Coordinate]:
+        """Returns a list of coordinates (row, column) of all Empty Cells, in the same order as Grid"""
+        legal_moves = []
+        empty_cells = self.full_mask & ~self.occupied
+        while empty_cells:
+            # Lowest set bit, cleared once its cell is added
+            cell = empty_cells & -empty_cells
+            legal_moves.append(divmod(cell.bit_length() - 1, self.columns))
+            empty_cells ^= cell
+        return legal_moves
@@ -11,9 +11,11 @@ or other tic tac toe variations. Any custom state checker must inherit from Stat
 State checkers also have an attribute win_data, see state_data.py for info
 """
 
+import itertools
 from abc import ABC, abstractmethod
+from functools import lru_cache
 
-from .grid import Grid
+from .grid import BitboardGrid, Coordinate, Grid
 from .state_data import WinType, WinData, GameState
 
 
@@ -31,6 +33,14 @@ class StateChecker(ABC):
         """Checks if the game is a draw or a win for any player or if the game is onging
         Update `win_data` if a player wins and `update_win_data` flag is True"""
 
+    def cell_updated(self, row: int, column: int, replaced_mark: str, mark: str):
+        """Called by Board.play_move after the cell at (row, column) changed from replaced_mark to mark
+        Override to keep state between checks, see IncrementalStateChecker"""
+
+    def sync(self):
+        """Called by Board.sync after the grid was changed without Board.play_move
+        Override to compute the state kept between checks from the grid again"""
+
 
 class TTTStateChecker(StateChecker):
     """TTTStateChecker for checking game state
@@ -207,3 +217,346 @@ class TTTStateChecker(StateChecker):
             if mark != first_mark:
                 return False
         return True
+
+
+@lru_cache
+def win_lines(size: int) -> tuple[tuple[WinType, list[Coordinate]], ...]:
+    """Win type and coordinates of the cells of every winning line of a size * size grid,
+    rows, then columns, then both diagonals, the order TTTStateChecker checks them in"""
+
+    lines = [(WinType.HORIZONTAL, [(row, column) for column in range(size)]) for row in range(size)]
+    lines += [(WinType.VERTICAL, [(row, column) for row in range(size)]) for column in range(size)]
+    lines += [(WinType.DIAGONAL, [(i, i) for i in range(size)]),
+              (WinType.DIAGONAL, [((size - 1) - i, i) for i in range(size)])]
+    return tuple(lines)
+
+
+@lru_cache
+def bitboard_win_lines(size: int) -> tuple[tuple[int, WinType, list[Coordinate]], ...]:
+    """Every winning line of a size * size grid as (bitboard, win type, coordinates of its cells)"""
+    bitboard_lines = []
+    for win_type, line in win_lines(size):
+        line_mask = 0
+        for row, column in line:
+            line_mask |= 1 << row * size + column
+        bitboard_lines.append((line_mask, win_type, line))
+    return tuple(bitboard_lines)
+
+
+class BitboardStateChecker(StateChecker):
+    """State checker with the rules of TTTStateChecker for a BitboardGrid
+
+    Every winning line is precomputed as a bitboard, so checking a line is a single AND and compare
+    instead of building a list of its cells
+
+    Attributes
+    ----------
+    grid : BitboardGrid
+        grid whose state is to be checked when methods are called
+    win_lines : tuple[tuple[int, WinType, list[Coordinate]], ...]
+        bitboard, win type and cells of every winning line, see bitboard_win_lines
+    _win_data : WinData
+
+    Methods
+    -------
+    check_state(winner_mark: str, update_win_data: bool = True) -> GameState
+        checks if there is a win or draw on the grid or if the game is onging
+    check_win(winner_mark: str, update_win_data: bool) -> bool
+        checks if winner_mark has a winning line, updates the _win_data accordingly
+    check_draw() -> bool
+        checks if every cell is marked, see IMPORTANT of TTTStateChecker
+    """
+
+    def __init__(self, grid: BitboardGrid):
+        # Lines are only precomputed for square grids, use KInARowStateChecker for other dimensions
+        if grid.rows != grid.columns:
+            raise ValueError(f"A {grid.rows} * {grid.columns} grid is not square, use KInARowStateChecker")
+        self.grid = grid
+        self.win_lines = bitboard_win_lines(grid.size)
+        self._win_data = WinData()
+
+    @property
+    def win_data(self):
+        """Property for accessing _win_data"""
+        return self._win_data
+
+    def check_state(self, winner_mark: str, update_win_data: bool = True) -> GameState:
+        """Checks if there is a win or draw on the grid or if the game is onging, see TTTStateChecker.check_state"""
+        if self.check_win(winner_mark, update_win_data):
+            return GameState.WIN
+        if self.check_draw():
+            return GameState.DRAW
+        return GameState.ONGOING
+
+    def check_draw(self) -> bool:
+        return self.grid.occupied == self.grid.full_mask
+
+    def check_win(self, winner_mark: str, update_win_data: bool = True) -> bool:
+        """Checks for a winning line of winner_mark
+        Only the player who played the last move can have completed a line, so other marks are not checked
+        """
+
+        mask = self.grid.masks.get(winner_mark, 0)
+        for line_mask, win_type, line in self.win_lines:
+            if mask & line_mask != line_mask:
+                continue
+
+            if update_win_data:
+                self.win_data.winner = winner_mark
+                self.win_data.win_type = win_type
+                self.win_data.win_line = list(line)
+            return True
+
+        return False
+
+
+class IncrementalStateChecker(StateChecker):
+    """State checker with the rules of TTTStateChecker, keeping the state of the game between checks
+
+    The number of marks of every player on every winning line is updated by Board.play_move through
+    cell_updated, which only touches the lines through the changed cell. Checking for a win is then
+    a lookup of the number of completed lines of the player, and checking for a draw compares
+    the number of marks on the grid with the number of cells
+
+    The grid must only be changed through Board.play_move, or Board.sync must be called afterwards
+
+    Attributes
+    ----------
+    grid : Grid
+        grid whose state is to be checked when methods are called
+    lines : tuple[tuple[WinType, list[Coordinate]], ...]
+        win type and cells of every winning line, see win_lines
+    cell_lines : list[list[list[int]]]
+        indexes in lines of the lines through every cell, indexed by [row][column]
+    line_counts : dict[str, list[int]]
+        number of marks of a player on every line, by player mark
+    completed_lines : dict[str, int]
+        number of lines with only marks of a player, by player mark
+    marks : int
+        number of marks on the grid
+    _win_data : WinData
+
+    Methods
+    -------
+    check_state(winner_mark: str, update_win_data: bool = True) -> GameState
+        checks if there is a win or draw on the grid or if the game is onging
+    check_win(winner_mark: str, update_win_data: bool) -> bool
+        checks if winner_mark has a completed line, updates the _win_data accordingly
+    check_draw() -> bool
+        checks if every cell is marked, see IMPORTANT of TTTStateChecker
+    cell_updated(row, column, replaced_mark, mark)
+        counts the change of a cell on the lines through it
+    sync()
+        counts the marks on the grid again
+    """
+
+    def __init__(self, grid: Grid):
+        # Lines are only precomputed for square grids, use KInARowStateChecker for other dimensions
+        if grid.rows != grid.columns:
+            raise ValueError(f"A {grid.rows} * {grid.columns} grid is not square, use KInARowStateChecker")
+        self.grid = grid
+        self.lines = win_lines(grid.size)
+        self.cell_lines: list[list[list[int]]] = [[[] for _ in range(grid.size)] for _ in range(grid.size)]
+        for line_index, (_, line) in enumerate(self.lines):
+            for row, column in line:
+                self.cell_lines[row][column].append(line_index)
+        self._win_data = WinData()
+        self.sync()
+
+    @property
+    def win_data(self):
+        """Property for accessing _win_data"""
+        return self._win_data
+
+    def check_state(self, winner_mark: str, update_win_data: bool = True) -> GameState:
+        """Checks if there is a win or draw on the grid or if the game is onging, see TTTStateChecker.check_state"""
+        if self.check_win(winner_mark, update_win_data):
+            return GameState.WIN
+        if self.check_draw():
+            return GameState.DRAW
+        return GameState.ONGOING
+
+    def check_draw(self) -> bool:
+        return self.marks == self.grid.size ** 2
+
+    def check_win(self, winner_mark: str, update_win_data: bool = True) -> bool:
+        """Checks for a completed line of winner_mark
+        Only the player who played the last move can have completed a line, so other marks are not checked
+        """
+
+        if not self.completed_lines.get(winner_mark):
+            return False
+
+        if update_win_data:
+            # Lines are only searched once the game is won, not on every check
+            counts = self.line_counts[winner_mark]
+            line_index = next(index for index, count in enumerate(counts) if count == self.grid.size)
+            win_type, line = self.lines[line_index]
+            self.win_data.winner = winner_mark
+            self.win_data.win_type = win_type
+            self.win_data.win_line = list(line)
+        return True
+
+    def cell_updated(self, row: int, column: int, replaced_mark: str, mark: str):
+        if replaced_mark != Grid.EMPTY_CELL:
+            self._count_mark(row, column, replaced_mark, -1)
+        if mark != Grid.EMPTY_CELL:
+            self._count_mark(row, column, mark, 1)
+
+    def sync(self):
+        self.line_counts: dict[str, list[int]] = {}
+        self.completed_lines: dict[str, int] = {}
+        self.marks: int = 0
+        for row_num, row in enumerate(self.grid.grid):
+            for column_num, mark in enumerate(row):
+                self.cell_updated(row_num, column_num, Grid.EMPTY_CELL, mark)
+
+    def _count_mark(self, row: int, column: int, mark: str, change: int):
+        """Adds change to the number of marks of mark on every line through the cell at (row, column)"""
+        counts = self.line_counts.get(mark)
+        if counts is None:
+            counts = self.line_counts[mark] = [0] * len(self.lines)
+
+        size = self.grid.size
+        completed = 0
+        for line_index in self.cell_lines[row][column]:
+            completed -= counts[line_index] == size
+            counts[line_index] += change
+            completed += counts[line_index] == size
+        if completed:
+            self.completed_lines[mark] = self.completed_lines.get(mark, 0) + completed
+        self.marks += change
+
+
+class KInARowStateChecker(StateChecker):
+    """State checker for k marks in a row on grids of any rows * columns, e.g. gomoku (5 in a row on 15 * 15)
+    or the lines of connect 4 (4 in a row on 6 * 7), k consecutive marks of a player in a row, column or
+    diagonal win the game, longer lines win too
+
+    A new line of k marks must go through the last move, so only the cells in line with it are checked,
+    at most 4 * 2 * (k - 1) cells per check whatever the size of the grid. The moves are remembered through
+    cell_updated, so the grid must only be changed through Board.play_move, or Board.sync must be called afterwards
+
+    Attributes
+    ----------
+    grid : Grid
+        grid whose state is to be checked when methods are called, Grid or BitboardGrid of any dimensions
+    k : int
+        number of marks in a row needed to win
+    moves : list[Coordinate]
+        cells marked on the grid, in the order they were marked
+    synced_moves : int
+        number of moves at the start of moves whose order is unknown, as they were read from the grid by sync
+    _win_data : WinData
+
+    Methods
+    -------
+    check_state(winner_mark: str, update_win_data: bool = True) -> GameState
+        checks if there is a win or draw on the grid or if the game is onging
+    check_win(winner_mark: str, update_win_data: bool) -> bool
+        checks if winner_mark has k marks in a row through the last move, updates the _win_data accordingly
+    check_draw() -> bool
+        checks if every cell is marked, see IMPORTANT of TTTStateChecker
+    cell_updated(row, column, replaced_mark, mark)
+        remembers the last move
+    sync()
+        reads the moves from the grid again
+    """
+
+    # (row step, column step, win type) of the directions of lines, the opposite directions are checked too
+    DIRECTIONS = ((0, 1, WinType.HORIZONTAL), (1, 0, WinType.VERTICAL),
+                  (1, 1, WinType.DIAGONAL), (1, -1, WinType.DIAGONAL))
+
+    def __init__(self, grid: Grid, k: int):
+        if not 0 < k <= max(grid.rows, grid.columns):
+            raise ValueError(f"k must be between 1 and {max(grid.rows, grid.columns)} for a "
+                             f"{grid.rows} * {grid.columns} grid")
+        self.grid = grid
+        self.k = k
+        self._win_data = WinData()
+        self.sync()
+
+    @property
+    def win_data(self):
+        """Property for accessing _win_data"""
+        return self._win_data
+
+    def check_state(self, winner_mark: str, update_win_data: bool = True) -> GameState:
+        """Checks if there is a win or draw on the grid or if the game is onging, see TTTStateChecker.check_state"""
+        if self.check_win(winner_mark, update_win_data):
+            return GameState.WIN
+        if self.check_draw():
+            return GameState.DRAW
+        return GameState.ONGOING
+
+    def check_draw(self) -> bool:
+        return len(self.moves) == self.grid.rows * self.grid.columns
+
+    def check_win(self, winner_mark: str, update_win_data: bool = True) -> bool:
+        """Checks for k marks of winner_mark in a row through the last move
+        If the order of the moves is unknown after sync, every mark of winner_mark is checked once
+        """
+
+        if len(self.moves) > self.synced_moves:
+            cells = self.moves[-1:]
+        else:
+            cells = [(row, column) for row, column in self.moves if self.grid.get_cell(row, column) == winner_mark]
+
+        for row, column in cells:
+            win_line, win_type = self.find_line(row, column, winner_mark)
+            if win_line is None:
+                continue
+
+            if update_win_data:
+                self.win_data.winner = winner_mark
+                self.win_data.win_type = win_type
+                self.win_data.win_line = win_line
+            return True
+
+        return False
+
+    def find_line(self, row: int, column: int, mark: str) -> tuple[list[Coordinate] | None, WinType | None]:
+        """Returns the first k cells and the win type of a line of at least k marks through (row, column),
+        (None, None) if the cell is not part of one"""
+
+        if self.grid.get_cell(row, column) != mark:
+            return None, None
+
+        for row_step, column_step, win_type in self.DIRECTIONS:
+            # Marks in a row before the cell, then after it, both stop after k - 1 cells
+            before = self._count_marks(row, column, -row_step, -column_step, mark)
+            after = self._count_marks(row, column, row_step, column_step, mark)
+            if before + 1 + after >= self.k:
+                start_row, start_column = row - before * row_step, column - before * column_step
+                return [(start_row + i * row_step, start_column + i * column_step) for i in range(self.k)], win_type
+
+        return None, None
+
+    def _count_marks(self, row: int, column: int, row_step: int, column_step: int, mark: str) -> int:
+        """Number of consecutive marks after (row, column) going in the direction of the steps, at most k - 1"""
+        count = 0
+        for _ in range(self.k - 1):
+            row += row_step
+            column += column_step
+            if not (0 <= row < self.grid.rows and 0 <= column < self.grid.columns) \
+                    or self.grid.get_cell(row, column) != mark:
+                break
+            count += 1
+        return count
+
+    def cell_updated(self, row: int, column: int, replaced_mark: str, mark: str):
+        if replaced_mark != Grid.EMPTY_CELL:
+            # Unplayed moves are the last ones, other cells are searched for
+            index = len(self.moves) - 1
+            if self.moves[index] != (row, column):
+                index = self.moves.index((row, column))
+            del self.moves[index]
+            if index < self.synced_moves:
+                self.synced_moves -= 1
+        if mark != Grid.EMPTY_CELL:
+            self.moves.append((row, column))
+
+    def sync(self):
+        cells = itertools.product(range(self.grid.rows), range(self.grid.columns))
+        self.moves: list[Coordinate] = [(row, column) for row, column in cells if not self.grid.is_empty(row, column)]
+        self.synced_moves: int = len(self.moves)
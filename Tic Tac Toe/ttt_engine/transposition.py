@@ -0,0 +1,129 @@
+"""
+ttt_engine.transposition
+~~~~~~~~~~~~~~~~~~~~~~~~
+
+Transposition table for the AI
+
+The same position is reached through many different move orders, e.g. X(0, 0) O(1, 1) X(2, 2)
+and X(2, 2) O(1, 1) X(0, 0). The transposition table remembers the evaluation and best move of every
+searched position, so each position is only searched once, during a turn and in the following turns
+
+Positions are identified by their Zobrist hash, a XOR of one random number per (cell, player) pair
+on the grid and one for the player whose turn it is. Playing or unplaying a move updates the hash
+with two XORs instead of hashing the whole grid again
+"""
+
+import random
+from collections import OrderedDict
+from dataclasses import dataclass
+from enum import StrEnum, auto
+
+from .grid import Coordinate
+
+# Seed of the Zobrist keys, the same position always gets the same hash
+ZOBRIST_SEED = 2023
+# Default max number of positions kept in a transposition table
+MAX_ENTRIES = 2 ** 20
+
+
+class Bound(StrEnum):
+    """How the stored evaluation relates to the real evaluation of the position"""
+    EXACT = auto()  # evaluation is the real evaluation
+    LOWER = auto()  # real evaluation is at least the stored evaluation
+    UPPER = auto()  # real evaluation is at most the stored evaluation
+
+
+@dataclass(slots=True)
+class TTEntry:
+    """Search result of a position
+
+    Attributes
+    ----------
+    evaluation : int
+        evaluation for the player whose turn it is, +1 if they win with best play by both sides
+    bound : Bound
+        if evaluation is exact or only a bound of the real evaluation
+    best_move : Coordinate | None
+        best move found in the position, None if the game was already over
+    """
+
+    evaluation: int
+    bound: Bound
+    best_move: Coordinate | None
+
+
+class ZobristHasher:
+    """Random keys for hashing positions of a grid
+
+    Attributes
+    ----------
+    cell_keys : list[list[list[int]]]
+        key of every player for every cell, indexed by [row][column][player_index]
+    turn_keys : list[int]
+        key of every player, for the player whose turn it is
+
+    Methods
+    -------
+    hash_position(cells, player_index) -> int
+        Hash of the whole position, for when the grid was changed without playing moves
+    """
+
+    def __init__(self, rows: int, columns: int, players: int, seed: int = ZOBRIST_SEED):
+        key_generator = random.Random(seed)
+        self.cell_keys: list[list[list[int]]] = [[[key_generator.getrandbits(64) for _ in range(players)]
+                                                  for _ in range(columns)] for _ in range(rows)]
+        self.turn_keys: list[int] = [key_generator.getrandbits(64) for _ in range(players)]
+
+    def hash_position(self, cells: list[list[int | None]], player_index: int) -> int:
+        """Returns the hash of the position
+
+        Parameters
+        ----------
+        cells : list[list[int | None]]
+            player index of the mark of every cell, None for empty cells
+        player_index : int
+            index of the player whose turn it is
+        """
+
+        position_hash = self.turn_keys[player_index]
+        for row, row_cells in enumerate(cells):
+            for column, cell in enumerate(row_cells):
+                if cell is not None:
+                    position_hash ^= self.cell_keys[row][column][cell]
+        return position_hash
+
+
+class TranspositionTable:
+    """Search results of positions by their hash, the least recently used ones are forgotten once full
+
+    Methods
+    -------
+    get(position_hash) -> TTEntry | None
+        Search result of the position, None if it was not searched or was forgotten
+    store(position_hash, evaluation, bound, best_move)
+        Remembers the search result of the position
+    clear()
+        Forgets all positions
+    """
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[int, TTEntry] = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, position_hash: int) -> TTEntry | None:
+        entry = self._entries.get(position_hash)
+        if entry is not None:
+            self._entries.move_to_end(position_hash)
+        return entry
+
+    def store(self, position_hash: int, evaluation: int, bound: Bound, best_move: Coordinate | None):
+        self._entries[position_hash] = TTEntry(evaluation, bound, best_move)
+        self._entries.move_to_end(position_hash)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()